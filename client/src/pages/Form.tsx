@@ -91,51 +91,78 @@ function Form() {
     setFormData({ ...formData, additionalWebsites: newWebsites });
   };
 
-  const checkScrapingStatus = async (companyName: string) => {
-    try {
-      const response = await fetch(`${HOST}/scraping_status/${companyName}`);
-      const result = await response.json();
+  const notifyScrapingCompleted = (companyName: string) => {
+    setLoading(false);
+    toast(
+      (t) => (
+        <span>
+          Chatbot initialization completed. Proceed to chatbot?
+          <br />
+          <button
+            onClick={() => {
+              navigate(
+                `/chatbot?company=${companyName
+                  .toLowerCase()
+                  .replace(" ", "_")}`
+              );
+              toast.dismiss(t.id);
+            }}
+            className="bg-black p-2 font-bold text-white mt-2"
+          >
+            Yes
+          </button>
+          <button
+            onClick={() => toast.dismiss(t.id)}
+            className="bg-red-600 p-2 font-bold text-white mt-2 ml-2"
+          >
+            No
+          </button>
+        </span>
+      ),
+      {
+        duration: 60000,
+      }
+    );
+  };
+
+  const checkScrapingStatus = (companyName: string) => {
+    // The server pushes the job progress, reconnecting is handled by EventSource
+    const events = new EventSource(`${HOST}/scraping_events/${companyName}`);
+
+    const finish = () => {
+      events.close();
+      notifyScrapingCompleted(companyName);
+    };
+
+    const fail = (message: string) => {
+      events.close();
+      setLoading(false);
+      toast.error(message);
+    };
+
+    events.addEventListener("snapshot", (event) => {
+      const result = JSON.parse((event as MessageEvent).data);
+      if (result.status === "Completed") finish();
+      else if (result.status === "Failed")
+        fail(`Chatbot initialization failed: ${result.job.error}`);
+      else if (result.status === "Not Found")
+        fail("No scraping job was found for this company");
+    });
+
+    events.addEventListener("job", (event) => {
+      const result = JSON.parse((event as MessageEvent).data);
+      if (result.status === "completed") finish();
+      else if (result.status === "failed")
+        fail(`Chatbot initialization failed: ${result.error}`);
+    });
 
-      if (response.ok && result.status !== "In Progress") {
+    events.onerror = () => {
+      if (events.readyState === EventSource.CLOSED) {
+        console.error("Scraping status stream closed");
         setLoading(false);
-        toast(
-          (t) => (
-            <span>
-              Chatbot initialization completed. Proceed to chatbot?
-              <br />
-              <button
-                onClick={() => {
-                  navigate(
-                    `/chatbot?company=${companyName
-                      .toLowerCase()
-                      .replace(" ", "_")}`
-                  );
-                  toast.dismiss(t.id);
-                }}
-                className="bg-black p-2 font-bold text-white mt-2"
-              >
-                Yes
-              </button>
-              <button
-                onClick={() => toast.dismiss(t.id)}
-                className="bg-red-600 p-2 font-bold text-white mt-2 ml-2"
-              >
-                No
-              </button>
-            </span>
-          ),
-          {
-            duration: 60000,
-          }
-        );
-      } else {
-        setTimeout(() => checkScrapingStatus(companyName), 5000);
+        toast.error("Something went wrong while checking scraping status");
       }
-    } catch (error) {
-      console.error("Error checking scraping status:", error);
-      setLoading(false);
-      toast.error("Something went wrong while checking scraping status");
-    }
+    };
   };
 
   const handleSubmit = async (e: any) => {
@@ -0,0 +1,75 @@
+import os
+from typing import Optional
+
+# Attachments larger than this are skipped before (or while) being downloaded
+MAX_ATTACHMENT_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(50 * 1024 * 1024)))
+# Whether a HEAD request checks size and type before an attachment is downloaded
+ATTACHMENT_HEAD_CHECK = os.getenv("ATTACHMENT_HEAD_CHECK", "true").lower() == "true"
+
+# Bytes needed to recognize a file format
+SNIFF_BYTES = 1024
+PDF_MAGIC = b"%PDF-"
+OLE_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+ZIP_MAGIC = b"PK\x03\x04"
+
+ATTACHMENT_MAGIC = {
+    "pdf": PDF_MAGIC,
+    "doc": OLE_MAGIC,
+    "xls": OLE_MAGIC,
+    "ppt": OLE_MAGIC,
+    "docx": ZIP_MAGIC,
+    "xlsx": ZIP_MAGIC,
+    "pptx": ZIP_MAGIC,
+}
+
+
+class AttachmentRejected(Exception):
+    """The attachment is too large or is not the file type its URL claims."""
+
+
+def check_attachment_headers(headers, max_bytes: int = MAX_ATTACHMENT_BYTES) -> None:
+    """
+    Rejects an attachment from its response headers, before its body is transferred.
+
+    Args:
+        headers (httpx.Headers): Headers of the HEAD or GET response.
+        max_bytes (int, optional): Largest accepted attachment size.
+
+    Raises:
+        AttachmentRejected: If the declared size exceeds `max_bytes` or the declared
+            type is textual (an HTML error or login page served instead of the file).
+    """
+    content_length = headers.get("Content-Length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        raise AttachmentRejected(
+            f"declared size of {content_length} bytes exceeds {max_bytes} bytes"
+        )
+
+    content_type = headers.get("Content-Type", "").lower()
+    if content_type.startswith("text/"):
+        raise AttachmentRejected(f"served as {content_type}")
+
+
+def sniff_attachment(head: bytes, extension: str) -> None:
+    """
+    Checks the first bytes of an attachment against the signature of its extension.
+
+    Args:
+        head (bytes): Up to `SNIFF_BYTES` leading bytes of the file.
+        extension (str): Extension taken from the attachment URL.
+
+    Raises:
+        AttachmentRejected: If the bytes do not look like a file of that type.
+    """
+    magic = ATTACHMENT_MAGIC.get(extension)
+    if magic is None:
+        return
+    # PDF readers tolerate junk before the header, the other formats start with it
+    matches = magic in head if magic == PDF_MAGIC else head.startswith(magic)
+    if not matches:
+        raise AttachmentRejected(f"content does not look like a .{extension} file")
+
+
+def attachment_extension(url: str) -> Optional[str]:
+    extension = url.split("?")[0].split("#")[0].rsplit(".", 1)[-1].lower()
+    return extension if extension in ATTACHMENT_MAGIC else None
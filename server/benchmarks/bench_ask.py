@@ -0,0 +1,308 @@
+"""
+Load test of `/ask` at growing concurrency against a stand-in OpenAI API.
+
+Runs the API with uvicorn from a scratch working directory, its OpenAI client
+pointed at a local stand-in of the assistants endpoints that streams every answer
+in `--deltas` chunks, `--delta-ms` apart, like a model generating tokens. Then
+fires `/ask` at each `--concurrency` level and reports the latency percentiles.
+With `--stream` the questions go to `/ask/stream` instead, and the time to the
+first words of the answer is reported as well. Runs fully offline, PocketBase is
+not needed.
+
+Run from the server directory:
+
+    python -m benchmarks.bench_ask --concurrency 1,4,16,32 --max-slowdown 2
+    python -m benchmarks.bench_ask --stream
+
+When no request blocks the event loop, the latency of a request is the time its
+answer streams for, whatever the concurrency, until the machine runs out of CPU
+for the API, the stand-in and the load generator together. The slowdown column is
+the median latency relative to the first level; with `--max-slowdown` the exit
+status is 1 when the last level is slower than that, and `--json` prints the
+results.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+
+class StubAssistantsHandler(BaseHTTPRequestHandler):
+    """Answers thread, message and streamed run creations like the OpenAI API."""
+
+    protocol_version = "HTTP/1.1"
+    deltas = 10
+    delta_seconds = 0.1
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, body: dict):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        created_at = int(time.time())
+        if self.path.endswith("/threads"):
+            self.send_json(
+                {
+                    "id": f"thread_{uuid.uuid4().hex}",
+                    "object": "thread",
+                    "created_at": created_at,
+                    "metadata": {},
+                }
+            )
+        elif self.path.endswith("/messages"):
+            self.send_json(
+                {
+                    "id": f"msg_{uuid.uuid4().hex}",
+                    "object": "thread.message",
+                    "created_at": created_at,
+                    "thread_id": self.path.split("/")[-2],
+                    "role": "user",
+                    "content": [],
+                    "status": "completed",
+                }
+            )
+        elif json.loads(body).get("stream"):
+            self.stream_run()
+        else:
+            self.send_error(404)
+
+    def stream_run(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for delta in range(self.deltas):
+            time.sleep(self.delta_seconds)
+            event = {
+                "id": "msg_answer",
+                "object": "thread.message.delta",
+                "delta": {
+                    "content": [
+                        {
+                            "index": 0,
+                            "type": "text",
+                            "text": {"value": f"Part {delta} of the answer. "},
+                        }
+                    ]
+                },
+            }
+            self.send_chunk(
+                f"event: thread.message.delta\ndata: {json.dumps(event)}\n\n".encode()
+            )
+        self.send_chunk(b"event: done\ndata: [DONE]\n\n")
+        self.send_chunk(b"")
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def serve_stub_api(deltas: int, delta_seconds: float, sender):
+    StubAssistantsHandler.deltas = deltas
+    StubAssistantsHandler.delta_seconds = delta_seconds
+    server = StubServer(("127.0.0.1", 0), StubAssistantsHandler)
+    sender.send(server.server_address[1])
+    server.serve_forever()
+
+
+def serve_api(port: int, users: int):
+    """Serve `index.app`, with a session already open for every user."""
+    import uvicorn
+
+    import index
+
+    for user in range(users):
+        index.session_manager[f"example<SEP>user-{user}"] = {
+            "assistant_id": "asst_bench",
+            "vector_store_id": "vs_bench",
+            "thread_id": f"thread_{user}",
+        }
+    uvicorn.run(
+        index.app, host="127.0.0.1", port=port, log_level="warning", backlog=4096
+    )
+
+
+def start_processes(args: argparse.Namespace, users: int) -> tuple:
+    """
+    Start the stand-in API and the API in processes of their own, keeping them out
+    of the load generator, and return them with the URL of the API.
+    """
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    stub = multiprocessing.Process(
+        target=serve_stub_api,
+        args=(args.deltas, args.delta_ms / 1000, sender),
+        daemon=True,
+    )
+    stub.start()
+    os.environ.update(
+        OPENAI_API_KEY="bench",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{receiver.recv()}/v1",
+        EMBEDDED_SCRAPE_WORKER="false",
+    )
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    api = multiprocessing.Process(target=serve_api, args=(port, users), daemon=True)
+    api.start()
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    return stub, api, f"http://127.0.0.1:{port}"
+
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def run_level(
+    base_url: str, concurrency: int, rounds: int, stream: bool = False
+) -> dict:
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=300) as http:
+
+        async def ask(user: int) -> tuple:
+            """Ask a question, timing its first words and its end, in seconds."""
+            start = time.perf_counter()
+            question = {
+                "company_name": "Example",
+                "persona": f"user-{user}",
+                "prompt": "How do I reset my password?",
+            }
+            if not stream:
+                response = await http.post("/ask", json=question)
+                response.raise_for_status()
+                if "answer" not in response.json():
+                    raise RuntimeError(f"/ask failed: {response.text}")
+                latency = time.perf_counter() - start
+                return latency, latency
+
+            first_words = None
+            async with http.stream("POST", "/ask/stream", json=question) as response:
+                response.raise_for_status()
+                kind = None
+                async for line in response.aiter_lines():
+                    if line.startswith("event: "):
+                        kind = line[len("event: ") :]
+                    if kind == "delta" and first_words is None:
+                        first_words = time.perf_counter() - start
+                    if kind == "error" and line.startswith("data: "):
+                        raise RuntimeError(f"/ask/stream failed: {line}")
+            if kind != "done":
+                raise RuntimeError("/ask/stream ended without an answer")
+            return first_words, time.perf_counter() - start
+
+        timings = []
+        start = time.perf_counter()
+        for _ in range(rounds):
+            timings += await asyncio.gather(*(ask(user) for user in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    first_words = [timing[0] for timing in timings]
+    latencies = [timing[1] for timing in timings]
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "ttft_p50_ms": round(statistics.median(first_words) * 1000, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "max_ms": round(max(latencies) * 1000, 1),
+        "requests_per_sec": round(len(latencies) / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--concurrency", default="1,4,16,32")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--deltas", type=int, default=10)
+    parser.add_argument("--delta-ms", type=float, default=100)
+    parser.add_argument(
+        "--stream", action="store_true", help="Ask /ask/stream instead of /ask"
+    )
+    parser.add_argument("--max-slowdown", type=float, help="Fail above this")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.concurrency.split(",")]
+    workdir = tempfile.mkdtemp(prefix="bench_ask_")
+    cwd = os.getcwd()
+    sys.path.insert(0, cwd)
+    # Keeps the logs and job state of the run out of the server directory
+    os.chdir(workdir)
+    stub, api, api_url = start_processes(args, max(levels))
+    try:
+        results = [
+            asyncio.run(run_level(api_url, concurrency, args.rounds, args.stream))
+            for concurrency in levels
+        ]
+    finally:
+        for process in (api, stub):
+            process.terminate()
+            process.join()
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for result in results:
+        result["slowdown"] = round(result["p50_ms"] / results[0]["p50_ms"], 2)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(
+            f"answers of {args.deltas} deltas {args.delta_ms:g} ms apart,"
+            f" {args.rounds} rounds per level"
+        )
+        print(
+            f"{'concurrency':>11} {'requests':>9} {'ttft p50':>9} {'p50 ms':>8}"
+            f" {'p95 ms':>8} {'max ms':>8} {'req/s':>8} {'slowdown':>9}"
+        )
+        for result in results:
+            print(
+                f"{result['concurrency']:>11} {result['requests']:>9}"
+                f" {result['ttft_p50_ms']:>9.1f} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f}"
+                f" {result['max_ms']:>8.1f} {result['requests_per_sec']:>8.1f}"
+                f" {result['slowdown']:>9.2f}"
+            )
+
+    if args.max_slowdown and results[-1]["slowdown"] > args.max_slowdown:
+        print(
+            f"FAIL: p50 latency {results[-1]['slowdown']}x the one at concurrency"
+            f" {results[0]['concurrency']}, above {args.max_slowdown}x",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+End-to-end crawler benchmark against a synthetic local website.
+
+Serves a `benchmarks.synthetic_site` site from a separate process and crawls it with
+`crawler.crawl_website` from a scratch working directory, so reports, attachments
+and crawl state never touch the real ones. Runs fully offline.
+
+Run from the server directory:
+
+    python -m benchmarks.bench_crawl --pages 500 --throttled-ratio 0.05 --slow-ratio 0.1
+
+The per-host rate defaults to 500 requests/sec so that the crawler itself is
+measured. In production `CRAWL_HOST_RATE` defaults to 10, which caps the crawl of a
+single site at about 10 pages/sec whatever the concurrency; pass `--host-rate 10`
+to see that ceiling.
+
+Reports pages/sec, p50/p99 fetch latency (from the request being sent), p50/p99 time
+spent queued on the host's rate limiter, peak RSS and bytes written. With
+`--min-pages-per-sec` the exit status is 1 when the crawl is slower than that, which
+lets a release pipeline gate on it; `--json` prints the results for archiving.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic_site import (
+    add_spec_arguments,
+    spec_from_arguments,
+    start_site_process,
+)
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def run_crawl(base_url: str, args: argparse.Namespace) -> dict:
+    """Crawl the site from a scratch directory and collect the measurements."""
+    workdir = tempfile.mkdtemp(prefix="bench_crawl_")
+    os.chdir(workdir)
+    # Read by the crawler modules at import time
+    os.environ["CRAWL_STATE_DB"] = os.path.join(workdir, "state", "crawl.sqlite3")
+    os.environ["CRAWL_HOST_RATE"] = str(args.host_rate)
+    os.environ.pop("SCRAPERAPI_KEY", None)
+    import crawler
+
+    os.makedirs(os.path.join("temp", "markdown"), exist_ok=True)
+    os.makedirs(os.path.join("temp", "attachments"), exist_ok=True)
+
+    start = time.perf_counter()
+    stats = asyncio.run(
+        crawler.crawl_website(
+            f"{base_url}/index.html",
+            "bench",
+            max_pages=args.max_pages,
+            max_retries=args.max_retries,
+            concurrency=args.concurrency,
+            max_connections_per_host=args.max_connections_per_host,
+            use_sitemaps=args.sitemap,
+        )
+    )
+    elapsed = time.perf_counter() - start
+
+    return {
+        "elapsed_seconds": round(elapsed, 3),
+        "pages_per_second": round(stats["pages_visited"] / elapsed, 1),
+        "fetch_latency_p50_ms": stats["fetch_latency_p50_ms"],
+        "fetch_latency_p99_ms": stats["fetch_latency_p99_ms"],
+        "queue_wait_p50_ms": stats["queue_wait_p50_ms"],
+        "queue_wait_p99_ms": stats["queue_wait_p99_ms"],
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "bytes_written": directory_size(os.path.join(workdir, "temp"))
+        + directory_size(os.path.join(workdir, "state")),
+        "workdir": workdir,
+        "stats": stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    add_spec_arguments(parser)
+    parser.add_argument("--max-pages", type=int, default=1000)
+    parser.add_argument("--max-retries", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--max-connections-per-host", type=int, default=6)
+    parser.add_argument(
+        "--host-rate",
+        type=float,
+        default=500.0,
+        help="Per-host requests/sec cap, high by default so the crawler is measured"
+        " (production defaults to 10)",
+    )
+    parser.add_argument("--min-pages-per-sec", type=float, help="Fail below this")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    parser.add_argument(
+        "--keep-workdir", action="store_true", help="Keep the reports and crawl state"
+    )
+    args = parser.parse_args()
+
+    spec = spec_from_arguments(args)
+    server, base_url = start_site_process(spec)
+    cwd = os.getcwd()
+    try:
+        results = run_crawl(base_url, args)
+    finally:
+        server.terminate()
+        server.join()
+        os.chdir(cwd)
+    if not args.keep_workdir:
+        shutil.rmtree(results.pop("workdir"))
+
+    if args.json:
+        print(json.dumps({"spec": vars(spec), **results}, indent=2))
+    else:
+        stats = results["stats"]
+        print(
+            f"Site: {spec.pages} pages, fan-out {spec.fanout}, {spec.page_kb} KB pages"
+        )
+        print(
+            f"Crawled {stats['pages_visited']} URLs in {results['elapsed_seconds']} s"
+            f" ({stats['pages_failed']} failed)"
+        )
+        print(f"{'pages/sec':<20} {results['pages_per_second']:>10}")
+        print(f"{'p50 fetch latency':<20} {results['fetch_latency_p50_ms']:>10} ms")
+        print(f"{'p99 fetch latency':<20} {results['fetch_latency_p99_ms']:>10} ms")
+        print(f"{'p50 queue wait':<20} {results['queue_wait_p50_ms']:>10} ms")
+        print(f"{'p99 queue wait':<20} {results['queue_wait_p99_ms']:>10} ms")
+        print(f"{'peak RSS':<20} {results['peak_rss_mb']:>10} MB")
+        print(f"{'bytes written':<20} {results['bytes_written']:>10}")
+
+    if args.min_pages_per_sec and results["pages_per_second"] < args.min_pages_per_sec:
+        print(
+            f"FAIL: {results['pages_per_second']} pages/sec is below the"
+            f" {args.min_pages_per_sec} pages/sec gate",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""
+Benchmark of the report conversion and upload path for every ingest format.
+
+Builds markdown report batches out of synthetic pages, the way a crawl does, then
+for each `utils.INGEST_FORMATS` format times the conversion of the batches and
+their upload with `uploader.VectorStoreUploader`.
+
+Run from the server directory:
+
+    python -m benchmarks.bench_ingest --pages 500 --upload-mbps 20
+
+By default the uploads go to a local stand-in of the OpenAI files and vector store
+endpoints, which only measures sending the files; `--upload-mbps` caps its
+bandwidth, shared by the concurrent uploads, to mimic a real link, and
+`--fail-rate` makes it reject a share of the files of every batch to exercise the
+retries. The time the vector store spends extracting the text back out of PDFs is
+not included there. Pass `--vector-store-id` (with `OPENAI_API_KEY` set) to upload
+to a real vector store instead, which includes it.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from openai import AsyncOpenAI
+
+from benchmarks.synthetic_site import SiteSpec
+from page_parser import extract_page
+from report_batches import REPORT_BATCH_BYTES, ReportBatcher
+
+# Bytes of a request body read at once, and taken from the link at once
+READ_CHUNK_BYTES = 64 * 1024
+
+
+class SharedLink:
+    """
+    Token bucket of `bytes_per_second`, shared by every handler thread.
+
+    Concurrent uploads split the bandwidth between them, like they would on a real
+    link, instead of each getting all of it.
+    """
+
+    def __init__(self, bytes_per_second: float):
+        self.bytes_per_second = bytes_per_second
+        self.lock = threading.Lock()
+        # When the bytes taken so far have gone through the link
+        self.free_at = time.monotonic()
+
+    def take(self, size: int):
+        """Block until `size` bytes went through the link."""
+        with self.lock:
+            now = time.monotonic()
+            self.free_at = max(self.free_at, now) + size / self.bytes_per_second
+            delay = self.free_at - now
+        time.sleep(delay)
+
+
+class StubVectorStoreHandler(BaseHTTPRequestHandler):
+    """Accepts file uploads and file batches like the OpenAI API, instantly."""
+
+    link = None
+    fail_rate = 0.0
+    # Ids of the completed and failed files of every batch
+    batches: dict = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, body: dict):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def file_batch(self, batch_id: str, vector_store_id: str) -> dict:
+        completed, failed = self.batches[batch_id]
+        return {
+            "id": batch_id,
+            "object": "vector_store.files_batch",
+            "created_at": int(time.time()),
+            "vector_store_id": vector_store_id,
+            "status": "completed",
+            "file_counts": {
+                "cancelled": 0,
+                "completed": len(completed),
+                "failed": len(failed),
+                "in_progress": 0,
+                "total": len(completed) + len(failed),
+            },
+        }
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = bytearray()
+        while len(body) < length:
+            chunk = self.rfile.read(min(READ_CHUNK_BYTES, length - len(body)))
+            if not chunk:
+                break
+            if self.link:
+                self.link.take(len(chunk))
+            body.extend(chunk)
+
+        if self.path.endswith("/files"):
+            self.send_json(
+                {
+                    "id": f"file-{uuid.uuid4().hex}",
+                    "object": "file",
+                    "bytes": length,
+                    "created_at": int(time.time()),
+                    "filename": "upload",
+                    "purpose": "assistants",
+                    "status": "processed",
+                }
+            )
+        else:
+            batch_id = f"vsfb_{uuid.uuid4().hex}"
+            completed, failed = [], []
+            for file_id in json.loads(body)["file_ids"]:
+                (failed if random.random() < self.fail_rate else completed).append(
+                    file_id
+                )
+            self.batches[batch_id] = completed, failed
+            self.send_json(self.file_batch(batch_id, self.path.split("/")[-2]))
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        parts = path.split("/")
+        if parts[-1] != "files":
+            self.send_json(self.file_batch(parts[-1], parts[-3]))
+            return
+
+        completed, failed = self.batches[parts[-2]]
+        file_ids = failed if "filter=failed" in query else completed
+        if "filter=" not in query:
+            file_ids = completed + failed
+        if "after=" in query:
+            # Everything fits in the first page
+            file_ids = []
+        self.send_json(
+            {
+                "object": "list",
+                "data": [
+                    {
+                        "id": file_id,
+                        "object": "vector_store.file",
+                        "created_at": int(time.time()),
+                        "usage_bytes": 0,
+                        "vector_store_id": parts[-4],
+                        "status": "failed" if file_id in failed else "completed",
+                        "last_error": None,
+                    }
+                    for file_id in file_ids
+                ],
+                "first_id": file_ids[0] if file_ids else None,
+                "last_id": file_ids[-1] if file_ids else None,
+                "has_more": False,
+            }
+        )
+
+    def do_DELETE(self):
+        file_id = self.path.split("/")[-1]
+        self.send_json({"id": file_id, "object": "file", "deleted": True})
+
+
+def start_stub_api(upload_mbps: float, fail_rate: float) -> tuple:
+    StubVectorStoreHandler.link = (
+        SharedLink(upload_mbps * 1e6 / 8) if upload_mbps else None
+    )
+    StubVectorStoreHandler.fail_rate = fail_rate
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubVectorStoreHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def write_reports(reports_dir: str, spec: SiteSpec, batch_bytes: int) -> list:
+    """Write the reports of the synthetic site as a crawl would, in batches."""
+    from utils import generate_page_report
+
+    batches = []
+    batcher = ReportBatcher(reports_dir, batch_bytes, on_batch=batches.append)
+    for page in range(spec.pages):
+        url = f"https://www.example.com/page-{page}.html"
+        extracted = extract_page(spec.render_page(page), url)
+        generate_page_report(url, extracted, "Example", batcher=batcher)
+    batcher.close()
+    return batches
+
+
+def run_format(
+    ingest_format: str,
+    workdir: str,
+    args: argparse.Namespace,
+    client: AsyncOpenAI,
+    vector_store_id: str,
+) -> dict:
+    from conversion import prepare_report_for_upload
+    from uploader import UploadRegistry, VectorStoreUploader
+
+    format_dir = os.path.join(workdir, ingest_format)
+    reports_dir = os.path.join(format_dir, "markdown")
+    spec = SiteSpec(pages=args.pages, page_kb=args.page_kb, seed=args.seed)
+    batches = write_reports(reports_dir, spec, args.batch_bytes)
+
+    start = time.perf_counter()
+    upload_paths = [
+        prepare_report_for_upload(path, os.path.join(format_dir, "pdf"), ingest_format)
+        for path in batches
+    ]
+    convert_seconds = time.perf_counter() - start
+
+    # A registry of its own, the markdown and text reports having the same content
+    uploader = VectorStoreUploader(
+        client,
+        UploadRegistry(os.path.join(format_dir, "uploads.sqlite3")),
+        batch_files=args.upload_batch_files,
+        poll_seconds=0.1,
+    )
+    start = time.perf_counter()
+    result = asyncio.run(uploader.upload(vector_store_id, upload_paths))
+    upload_seconds = time.perf_counter() - start
+
+    return {
+        "format": ingest_format,
+        "files": len(upload_paths),
+        "failed": len(result.failed),
+        "upload_bytes": sum(os.path.getsize(path) for path in upload_paths),
+        "convert_seconds": round(convert_seconds, 3),
+        "upload_seconds": round(upload_seconds, 3),
+        "total_seconds": round(convert_seconds + upload_seconds, 3),
+    }
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix="bench_ingest_")
+    # Keeps the logs and scratch files of the run out of the server directory
+    os.chdir(workdir)
+    from uploader import UPLOAD_BATCH_FILES
+    from utils import INGEST_FORMATS
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--page-kb", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--batch-bytes", type=int, default=REPORT_BATCH_BYTES)
+    parser.add_argument("--upload-batch-files", type=int, default=UPLOAD_BATCH_FILES)
+    parser.add_argument(
+        "--formats", default=",".join(INGEST_FORMATS), help="Formats to compare"
+    )
+    parser.add_argument(
+        "--upload-mbps",
+        type=float,
+        default=0,
+        help="Bandwidth of the local stand-in API, 0 for unlimited",
+    )
+    parser.add_argument(
+        "--fail-rate",
+        type=float,
+        default=0,
+        help="Share of the files the local stand-in API fails to process",
+    )
+    parser.add_argument(
+        "--vector-store-id", help="Upload to this real vector store instead"
+    )
+    parser.add_argument("--json", action="store_true", help="Print JSON results")
+    args = parser.parse_args()
+
+    server = None
+    if args.vector_store_id:
+        client = AsyncOpenAI()
+        vector_store_id = args.vector_store_id
+    else:
+        server, base_url = start_stub_api(args.upload_mbps, args.fail_rate)
+        client = AsyncOpenAI(api_key="bench", base_url=base_url)
+        vector_store_id = "vs_bench"
+
+    try:
+        results = [
+            run_format(ingest_format, workdir, args, client, vector_store_id)
+            for ingest_format in args.formats.split(",")
+        ]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        if server:
+            server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(
+        f"{args.pages} pages of {args.page_kb} KB in batches of {args.batch_bytes} bytes"
+    )
+    print(
+        f"{'format':<10} {'files':>6} {'failed':>6} {'upload MB':>10} {'convert s':>10}"
+        f" {'upload s':>10} {'total s':>10}"
+    )
+    for result in results:
+        print(
+            f"{result['format']:<10} {result['files']:>6} {result['failed']:>6}"
+            f" {result['upload_bytes'] / 1e6:>10.2f} {result['convert_seconds']:>10.2f}"
+            f" {result['upload_seconds']:>10.2f} {result['total_seconds']:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
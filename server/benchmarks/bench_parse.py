@@ -0,0 +1,130 @@
+"""
+Micro-benchmark of HTML page extraction.
+
+Compares the previous two-parse path (BeautifulSoup once for the report fields and
+once more for the links) with the single-pass `page_parser.extract_page` backends.
+
+Run from the server directory:
+
+    python -m benchmarks.bench_parse --corpus path/to/saved/html --rounds 5
+
+Without `--corpus` a synthetic corpus of pages is generated in memory.
+"""
+
+import argparse
+import os
+import random
+import time
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+
+from page_parser import PARSER_BACKENDS, extract_page
+
+WORDS = (
+    "product support pricing customer account service order delivery warranty "
+    "team contact privacy policy terms install update release guide feature "
+    "platform secure cloud data report integration partner careers news"
+).split()
+
+
+def legacy_extract(content: bytes, url: str) -> dict:
+    """The extraction as done before single-pass parsing: two full parses."""
+    soup = BeautifulSoup(content, "lxml")
+    title = (
+        soup.title.string.strip()
+        if soup.title and soup.title.string
+        else "No Title Found"
+    )
+    description_meta = soup.find("meta", attrs={"name": "description"})
+    description = (
+        description_meta["content"].strip()
+        if description_meta and description_meta.get("content")
+        else "No Description Found"
+    )
+    body_text = "\n".join([p.get_text(strip=True) for p in soup.find_all("p")])
+
+    soup = BeautifulSoup(content, "lxml")
+    links = [urljoin(url, a["href"]) for a in soup.find_all("a", href=True)]
+    return {
+        "title": title,
+        "description": description,
+        "body_text": body_text,
+        "links": links,
+    }
+
+
+def synthetic_page(index: int, rng: random.Random) -> bytes:
+    paragraphs = "".join(
+        f"<p>{' '.join(rng.choices(WORDS, k=rng.randint(20, 80)))}</p>"
+        for _ in range(rng.randint(10, 40))
+    )
+    links = "".join(
+        f'<li><a href="/page-{rng.randrange(1000)}.html">link</a></li>'
+        for _ in range(rng.randint(20, 80))
+    )
+    return (
+        "<!DOCTYPE html><html><head>"
+        f"<title>Page {index}</title>"
+        f'<meta name="description" content="Synthetic page {index}">'
+        "</head><body>"
+        f"<nav><ul>{links}</ul></nav><main>{paragraphs}</main>"
+        "<footer><p>Copyright Example Inc.</p></footer>"
+        "</body></html>"
+    ).encode("utf-8")
+
+
+def load_corpus(corpus_dir: str, pages: int) -> list:
+    if not corpus_dir:
+        rng = random.Random(42)
+        return [synthetic_page(i, rng) for i in range(pages)]
+
+    corpus = []
+    for root, _, files in os.walk(corpus_dir):
+        for name in sorted(files):
+            if name.endswith((".html", ".htm")):
+                with open(os.path.join(root, name), "rb") as f:
+                    corpus.append(f.read())
+    if not corpus:
+        raise SystemExit(f"No .html files found in {corpus_dir}")
+    return corpus
+
+
+def run(label: str, extract, corpus: list, rounds: int) -> float:
+    url = "https://www.example.com/docs/index.html"
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for content in corpus:
+            extract(content, url)
+        best = min(best, time.perf_counter() - start)
+
+    pages_per_second = len(corpus) / best
+    print(f"{label:<24} {pages_per_second:>10.1f} pages/sec")
+    return pages_per_second
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--corpus", help="Directory of saved .html pages")
+    parser.add_argument("--pages", type=int, default=200, help="Synthetic pages")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus, args.pages)
+    size_mb = sum(len(c) for c in corpus) / 1e6
+    print(f"Corpus: {len(corpus)} pages, {size_mb:.1f} MB, best of {args.rounds}")
+
+    baseline = run("before (bs4 x2)", legacy_extract, corpus, args.rounds)
+    for backend in PARSER_BACKENDS:
+        rate = run(
+            f"after ({backend})",
+            lambda content, url: extract_page(content, url, backend),
+            corpus,
+            args.rounds,
+        )
+        print(f"{'':<24} {rate / baseline:>10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
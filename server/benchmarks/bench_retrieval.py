@@ -0,0 +1,146 @@
+"""
+Recall and latency benchmark of the local retrieval backend.
+
+Writes the articles of `benchmarks.support_corpus` as page reports, the way a crawl
+does, indexes them in a `retrieval.LocalRetrieval` store of a scratch working
+directory, then searches every question of the corpus. A question is answered
+when a chunk of its article is among the first k results. Runs fully offline.
+
+Run from the server directory:
+
+    python -m benchmarks.bench_retrieval --products 200 --min-recall 0.9
+
+Reports recall@k, the mean reciprocal rank of the article, search latency
+percentiles and the indexing throughput. With `--min-recall` the exit status is 1
+when the recall at the largest k is lower; `--json` prints the results.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.support_corpus import build_corpus
+from report_batches import REPORT_BATCH_BYTES, ReportBatcher
+
+
+def write_reports(reports_dir: str, articles: list) -> list:
+    from utils import generate_page_report
+
+    batches = []
+    batcher = ReportBatcher(reports_dir, REPORT_BATCH_BYTES, on_batch=batches.append)
+    for article in articles:
+        page = {"title": article.title, "description": "", "body_text": article.body}
+        generate_page_report(article.url, page, "Example", batcher=batcher)
+    batcher.close()
+    return batches
+
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def run(workdir: str, args: argparse.Namespace) -> dict:
+    from retrieval import LocalRetrieval
+    from uploader import UploadRegistry
+
+    articles, questions = build_corpus(args.products, args.seed)
+    paths = write_reports(os.path.join(workdir, "markdown"), articles)
+    retrieval = LocalRetrieval(
+        os.path.join(workdir, "retrieval"),
+        UploadRegistry(os.path.join(workdir, "uploads.sqlite3")),
+    )
+    store_id = await retrieval.create_store("example")
+
+    start = time.perf_counter()
+    await retrieval.add_files(store_id, paths)
+    index_seconds = time.perf_counter() - start
+    index = retrieval.index(store_id)
+    index.refresh()
+
+    ks = sorted(int(k) for k in args.k.split(","))
+    found = {k: 0 for k in ks}
+    reciprocal_ranks = []
+    latencies = []
+    for question in questions:
+        start = time.perf_counter()
+        hits = index.search(question.text, ks[-1])
+        latencies.append(time.perf_counter() - start)
+
+        sources = [hit.source for hit in hits]
+        rank = sources.index(question.url) + 1 if question.url in sources else None
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+        for k in ks:
+            if rank and rank <= k:
+                found[k] += 1
+
+    index_bytes = sum(
+        os.path.getsize(os.path.join(index.path, name))
+        for name in os.listdir(index.path)
+    )
+    return {
+        "embedder": index.embedder.name,
+        "dimensions": index.dimensions,
+        "articles": len(articles),
+        "chunks": index.rows,
+        "questions": len(questions),
+        **{f"recall@{k}": round(found[k] / len(questions), 3) for k in ks},
+        "mrr": round(statistics.mean(reciprocal_ranks), 3),
+        "search_p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "search_p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "index_seconds": round(index_seconds, 2),
+        "chunks_per_sec": round(index.rows / index_seconds, 1),
+        "index_mb": round(index_bytes / 1e6, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--products", type=int, default=40, help="Products of the corpus"
+    )
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--k", default="1,5,10", help="Depths of the recall")
+    parser.add_argument(
+        "--embedder", help="Embedder of the store, see RETRIEVAL_EMBEDDER"
+    )
+    parser.add_argument("--dimensions", type=int, help="Dimensions of hashed vectors")
+    parser.add_argument("--min-recall", type=float, help="Fail below this")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    if args.embedder:
+        os.environ["RETRIEVAL_EMBEDDER"] = args.embedder
+    if args.dimensions:
+        os.environ["RETRIEVAL_DIMENSIONS"] = str(args.dimensions)
+
+    workdir = tempfile.mkdtemp(prefix="bench_retrieval_")
+    cwd = os.getcwd()
+    # Keeps the logs of the run out of the server directory
+    os.chdir(workdir)
+    try:
+        results = asyncio.run(run(workdir, args))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, value in results.items():
+            print(f"{name:<16} {value}")
+
+    recall = results[f"recall@{max(int(k) for k in args.k.split(','))}"]
+    if args.min_recall is not None and recall < args.min_recall:
+        print(f"FAIL: recall {recall} below {args.min_recall}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Recall and latency benchmark of the BM25 page search.
+
+Indexes the articles of `benchmarks.support_corpus` with a
+`page_search.PageIndexWriter`, the way a crawl does, in a scratch directory, then
+searches every question of the corpus. A question is answered when its article is
+among the first k results. With `--recrawl` every article is indexed a second
+time, as a refresh would, to measure search over superseded pages and the
+compaction of the segments. Runs fully offline.
+
+Run from the server directory:
+
+    python -m benchmarks.bench_search --products 400 --max-p95-ms 20
+
+Reports recall@k, the mean reciprocal rank of the article, search latency
+percentiles, the indexing throughput and the segments left. With `--min-recall`
+or `--max-p95-ms` the exit status is 1 when a threshold is missed; `--json`
+prints the results.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.support_corpus import build_corpus
+
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run(workdir: str, args: argparse.Namespace) -> dict:
+    from page_search import PageIndex, PageIndexWriter, company_directory
+
+    articles, questions = build_corpus(args.products, args.seed)
+    start = time.perf_counter()
+    for _ in range(2 if args.recrawl else 1):
+        writer = PageIndexWriter("example", workdir)
+        for article in articles:
+            writer.add(article.url, article.title, article.body)
+        writer.close()
+    index_seconds = time.perf_counter() - start
+    indexed = len(articles) * (2 if args.recrawl else 1)
+
+    index = PageIndex(company_directory("example", workdir))
+    start = time.perf_counter()
+    index.refresh()
+    open_ms = (time.perf_counter() - start) * 1000
+
+    ks = sorted(int(k) for k in args.k.split(","))
+    found = {k: 0 for k in ks}
+    reciprocal_ranks = []
+    latencies = []
+    for question in questions:
+        start = time.perf_counter()
+        results = index.search(question.text, ks[-1])
+        latencies.append(time.perf_counter() - start)
+
+        urls = [result.url for result in results]
+        if len(set(urls)) != len(urls):
+            raise RuntimeError(f"Duplicate pages returned for {question.text!r}")
+        rank = urls.index(question.url) + 1 if question.url in urls else None
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+        for k in ks:
+            if rank and rank <= k:
+                found[k] += 1
+
+    index_bytes = sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(index.directory)
+        for name in names
+    )
+    return {
+        "pages": len(articles),
+        "pages_indexed": indexed,
+        "segments": len(index.segments),
+        "questions": len(questions),
+        **{f"recall@{k}": round(found[k] / len(questions), 3) for k in ks},
+        "mrr": round(statistics.mean(reciprocal_ranks), 3),
+        "search_p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "search_p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "open_ms": round(open_ms, 2),
+        "index_seconds": round(index_seconds, 2),
+        "pages_per_sec": round(indexed / index_seconds, 1),
+        "index_mb": round(index_bytes / 1e6, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--products", type=int, default=40, help="Products of the corpus"
+    )
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--k", default="1,5,10", help="Depths of the recall")
+    parser.add_argument(
+        "--segment-pages", type=int, help="Pages per segment, see SEARCH_SEGMENT_PAGES"
+    )
+    parser.add_argument(
+        "--recrawl", action="store_true", help="Index every page a second time"
+    )
+    parser.add_argument("--min-recall", type=float, help="Fail below this")
+    parser.add_argument("--max-p95-ms", type=float, help="Fail above this")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    if args.segment_pages:
+        os.environ["SEARCH_SEGMENT_PAGES"] = str(args.segment_pages)
+
+    workdir = tempfile.mkdtemp(prefix="bench_search_")
+    cwd = os.getcwd()
+    # Keeps the logs of the run out of the server directory
+    os.chdir(workdir)
+    try:
+        results = run(workdir, args)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, value in results.items():
+            print(f"{name:<16} {value}")
+
+    failures = []
+    recall = results[f"recall@{max(int(k) for k in args.k.split(','))}"]
+    if args.min_recall is not None and recall < args.min_recall:
+        failures.append(f"recall {recall} below {args.min_recall}")
+    if args.max_p95_ms is not None and results["search_p95_ms"] > args.max_p95_ms:
+        failures.append(
+            f"p95 latency {results['search_p95_ms']} ms above {args.max_p95_ms} ms"
+        )
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Deterministic corpus of support articles with questions whose answer is known.
+
+Every article covers one topic for one product, so a question about a topic of a
+product has exactly one relevant article. Articles of the same product and of the
+same topic share much of their wording, and every article carries boilerplate
+paragraphs common to the whole site, so finding the right one takes more than
+matching a few frequent words. Questions are phrased differently from the
+articles they are about.
+"""
+
+import random
+from dataclasses import dataclass
+
+# (title, sentences of the article, questions about it), {product} and {number}
+# being filled in per article
+TOPICS = [
+    (
+        "Resetting your {product} password",
+        [
+            "Open the account settings of {product} and choose Reset password.",
+            "A reset link valid for {number} minutes is emailed to the account owner.",
+            "Administrators can force a password reset for every member of a team.",
+        ],
+        [
+            "I forgot my {product} password, how do I get back in?",
+            "How long is the {product} password reset link valid?",
+        ],
+    ),
+    (
+        "Exporting invoices from {product}",
+        [
+            "Invoices of {product} are exported from the Billing page as CSV or PDF.",
+            "Exports cover at most {number} months of invoices at a time.",
+            "Accountants with read-only access can export invoices as well.",
+        ],
+        [
+            "Can I download my {product} invoices as a spreadsheet?",
+            "How many months of {product} billing history fit in one export?",
+        ],
+    ),
+    (
+        "Installing {product} on a new machine",
+        [
+            "Download the {product} installer from the Downloads page of your account.",
+            "The installer needs {number} GB of free disk space and administrator rights.",
+            "Silent installation is available with the /quiet flag for IT teams.",
+        ],
+        [
+            "What do I need before setting up {product} on my computer?",
+            "How much disk space does the {product} setup require?",
+        ],
+    ),
+    (
+        "Connecting {product} to single sign-on",
+        [
+            "{product} supports SAML and OpenID Connect identity providers.",
+            "Single sign-on is configured by an owner under Security, Identity.",
+            "Users are provisioned on first login within {number} seconds.",
+        ],
+        [
+            "Does {product} work with our SAML identity provider?",
+            "Where do I configure SSO login for {product}?",
+        ],
+    ),
+    (
+        "Backing up {product} data",
+        [
+            "{product} takes an automatic backup of your workspace every night.",
+            "Backups are retained for {number} days and can be restored by an owner.",
+            "Manual snapshots can be taken before large imports.",
+        ],
+        [
+            "How long does {product} keep my backups?",
+            "Can I restore my {product} workspace from last week?",
+        ],
+    ),
+    (
+        "Cancelling a {product} subscription",
+        [
+            "Subscriptions to {product} are cancelled from the Plan page by the owner.",
+            "Access continues until the end of the paid period, then data is kept {number} days.",
+            "Annual plans cancelled in the first month are refunded in full.",
+        ],
+        [
+            "How do I stop paying for {product}?",
+            "What happens to my data after I end my {product} plan?",
+        ],
+    ),
+    (
+        "Shipping times for {product} hardware",
+        [
+            "{product} devices ship from our warehouse within {number} business days.",
+            "Tracking numbers are emailed as soon as the parcel leaves the warehouse.",
+            "Express delivery is available in most countries at checkout.",
+        ],
+        [
+            "When will my {product} device arrive?",
+            "Is there faster delivery for {product} hardware orders?",
+        ],
+    ),
+    (
+        "Returning a {product} device",
+        [
+            "{product} devices can be returned within {number} days of delivery.",
+            "Start a return from the Orders page to print a prepaid label.",
+            "Refunds are issued to the original payment method once the device is inspected.",
+        ],
+        [
+            "Can I send back a {product} unit I am not happy with?",
+            "How do I get a refund for my {product} hardware?",
+        ],
+    ),
+    (
+        "Upgrading the {product} firmware",
+        [
+            "Firmware updates for {product} install automatically overnight.",
+            "Version {number} fixes a connection drop reported on older routers.",
+            "Updates can be postponed for up to a week from the device settings.",
+        ],
+        [
+            "How do I get the latest {product} firmware version?",
+            "Can I delay an automatic {product} update?",
+        ],
+    ),
+    (
+        "Inviting members to a {product} team",
+        [
+            "Owners and admins invite members to {product} from the Team page.",
+            "Invitations expire after {number} days if they are not accepted.",
+            "Members can be given the viewer, editor or admin role.",
+        ],
+        [
+            "How do I add a colleague to our {product} workspace?",
+            "Why did my {product} invitation expire?",
+        ],
+    ),
+    (
+        "{product} API rate limits",
+        [
+            "The {product} API accepts {number} requests per minute for each token.",
+            "Requests over the limit are answered with status 429 and a Retry-After header.",
+            "Higher limits are available on the Enterprise plan.",
+        ],
+        [
+            "How many calls can I make to the {product} API?",
+            "What does a 429 response from the {product} API mean?",
+        ],
+    ),
+    (
+        "Warranty coverage of {product}",
+        [
+            "{product} hardware is covered by a {number} month limited warranty.",
+            "The warranty covers manufacturing defects but not accidental damage.",
+            "Claims are opened from the Support page with the serial number of the device.",
+        ],
+        [
+            "Is my broken {product} still under guarantee?",
+            "How long is the {product} warranty?",
+        ],
+    ),
+]
+
+BOILERPLATE = [
+    "Our support team answers every request within one business day, in English, "
+    "French and German. Premium plans include phone support around the clock.",
+    "Questions about your account, billing or orders can also be sent to the "
+    "community forum, where other customers and our staff share their answers.",
+    "We take privacy seriously: customer data is encrypted at rest and in transit "
+    "and is never sold to third parties. Read our privacy policy for details.",
+    "Release notes for every product are published on the news page, together with "
+    "the training webinars and guides of the month.",
+]
+
+SYLLABLES = "zen tri qua vo lex ora mir cas pel dun ix ka ro sy ten vu bri lo".split()
+
+
+@dataclass
+class Article:
+    url: str
+    title: str
+    body: str
+
+
+@dataclass
+class Question:
+    text: str
+    url: str
+
+
+def product_names(count: int, rng: random.Random) -> list[str]:
+    names = set()
+    while len(names) < count:
+        names.add("".join(rng.choices(SYLLABLES, k=3)).capitalize())
+    return sorted(names)
+
+
+def build_corpus(products: int = 40, seed: int = 7) -> tuple:
+    """
+    Build the articles of `products` products and the questions about them.
+
+    Returns:
+        tuple: The `Article`s, and a `Question` for every one of them.
+    """
+    rng = random.Random(seed)
+    articles, questions = [], []
+    for product in product_names(products, rng):
+        for number, (title, sentences, asked) in enumerate(TOPICS):
+            values = {"product": product, "number": rng.randint(2, 90)}
+            url = f"https://support.example.com/{product.lower()}/topic-{number}"
+            paragraphs = rng.sample(BOILERPLATE, 2)
+            paragraphs.insert(
+                1, " ".join(sentence.format(**values) for sentence in sentences)
+            )
+            articles.append(
+                Article(url, title.format(**values), "\n\n".join(paragraphs))
+            )
+            questions.append(Question(rng.choice(asked).format(**values), url))
+    return articles, questions
@@ -0,0 +1,289 @@
+"""
+Deterministic synthetic website served from a local HTTP server.
+
+Pages, links and attachments are generated from the page number and a seed, so a
+site with the same `SiteSpec` is identical from one run to the next and no network
+access is needed. Besides regular pages the site can answer with 403 (forbidden),
+429 (throttled once, then served) and slow responses.
+
+Serve a site by hand from the server directory:
+
+    python -m benchmarks.synthetic_site --pages 500 --port 8900
+"""
+
+import argparse
+import multiprocessing
+import random
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "product support pricing customer account service order delivery warranty "
+    "team contact privacy policy terms install update release guide feature "
+    "platform secure cloud data report integration partner careers news billing "
+    "invoice shipping returns catalog storage network analytics dashboard export "
+    "import backup restore migrate license upgrade training webinar community"
+).split()
+
+ATTACHMENT_TYPES = {
+    "pdf": ("application/pdf", b"%PDF-1.4\n"),
+    "docx": (
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        b"PK\x03\x04",
+    ),
+}
+
+
+@dataclass
+class SiteSpec:
+    """Shape of a synthetic site.
+
+    Attributes:
+        pages (int): Number of HTML pages, page 0 being the home page.
+        fanout (int): Links to other pages on each page.
+        page_kb (int): Approximate size of the body text of a page.
+        attachment_ratio (float): Share of pages linking an attachment.
+        attachment_kb (int): Size of each attachment.
+        attachment_mix (str): Comma separated attachment types, see `ATTACHMENT_TYPES`.
+        forbidden_ratio (float): Share of pages always answering 403.
+        throttled_ratio (float): Share of pages answering 429 to their first request.
+        slow_ratio (float): Share of pages answering after `slow_ms`.
+        slow_ms (int): Delay of slow pages.
+        sitemap (bool): Whether robots.txt points to a sitemap listing every page.
+        seed (int): Seed of the generated content.
+    """
+
+    pages: int = 200
+    fanout: int = 8
+    page_kb: int = 8
+    attachment_ratio: float = 0.05
+    attachment_kb: int = 256
+    attachment_mix: str = "pdf,docx"
+    forbidden_ratio: float = 0.0
+    throttled_ratio: float = 0.0
+    slow_ratio: float = 0.0
+    slow_ms: int = 200
+    sitemap: bool = False
+    seed: int = 42
+
+    def page_rng(self, page: int, salt: str = "") -> random.Random:
+        return random.Random(f"{self.seed}:{salt}:{page}")
+
+    def page_kind(self, page: int) -> str:
+        """One of "forbidden", "throttled", "slow" or "ok"; the home page is ok."""
+        if page == 0:
+            return "ok"
+        roll = self.page_rng(page, "kind").random()
+        for kind, ratio in (
+            ("forbidden", self.forbidden_ratio),
+            ("throttled", self.throttled_ratio),
+            ("slow", self.slow_ratio),
+        ):
+            if roll < ratio:
+                return kind
+            roll -= ratio
+        return "ok"
+
+    def attachment(self, page: int):
+        """Path of the attachment linked from a page, None if it links none."""
+        rng = self.page_rng(page, "attachment")
+        if rng.random() >= self.attachment_ratio:
+            return None
+        extension = rng.choice(self.attachment_mix.split(","))
+        return f"/files/document-{page}.{extension}"
+
+    def render_page(self, page: int) -> bytes:
+        rng = self.page_rng(page)
+        # Every page links the next one so the whole site is reachable
+        targets = [(page + 1) % self.pages] + [
+            rng.randrange(self.pages) for _ in range(self.fanout - 1)
+        ]
+        links = "".join(
+            f'<li><a href="/page-{target}.html">Page {target}</a></li>'
+            for target in targets
+        )
+        attachment = self.attachment(page)
+        if attachment:
+            links += f'<li><a href="{attachment}">Download</a></li>'
+
+        paragraphs = []
+        size = 0
+        while size < self.page_kb * 1024:
+            paragraph = " ".join(rng.choices(WORDS, k=rng.randint(30, 90)))
+            paragraphs.append(f"<p>{paragraph}</p>")
+            size += len(paragraph)
+
+        return (
+            "<!DOCTYPE html><html><head>"
+            f"<title>Synthetic page {page}</title>"
+            f'<meta name="description" content="Page {page} of a synthetic site">'
+            "</head><body>"
+            f"<nav><ul>{links}</ul></nav><main>{''.join(paragraphs)}</main>"
+            "<footer><p>Copyright Synthetic Example Inc. All rights reserved.</p></footer>"
+            "</body></html>"
+        ).encode("utf-8")
+
+    def render_attachment(self, path: str) -> bytes:
+        extension = path.rsplit(".", 1)[-1]
+        magic = ATTACHMENT_TYPES[extension][1]
+        return magic + b"\0" * (self.attachment_kb * 1024 - len(magic))
+
+    def render_sitemap(self, base_url: str) -> bytes:
+        urls = "".join(
+            f"<url><loc>{base_url}/page-{page}.html</loc></url>"
+            for page in range(self.pages)
+        )
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+            f"{urls}</urlset>"
+        ).encode("utf-8")
+
+
+class SyntheticSiteHandler(BaseHTTPRequestHandler):
+    spec: SiteSpec
+    hits: dict
+    hits_lock: threading.Lock
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status: int, content_type: str, body: bytes, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        base_url = f"http://{self.headers.get('Host')}"
+
+        if path == "/robots.txt":
+            rules = "User-agent: *\nAllow: /\n"
+            if self.spec.sitemap:
+                rules += f"Sitemap: {base_url}/sitemap.xml\n"
+            return self.send_body(200, "text/plain", rules.encode("utf-8"))
+        if path == "/sitemap.xml" and self.spec.sitemap:
+            return self.send_body(
+                200, "application/xml", self.spec.render_sitemap(base_url)
+            )
+        if path in ("/", "/index.html"):
+            return self.send_body(200, "text/html", self.spec.render_page(0))
+
+        if path.startswith("/files/document-"):
+            page = path[len("/files/document-") :].split(".")[0]
+            if page.isdigit() and self.spec.attachment(int(page)) == path:
+                content_type = ATTACHMENT_TYPES[path.rsplit(".", 1)[-1]][0]
+                body = self.spec.render_attachment(path)
+                return self.send_body(200, content_type, body)
+            return self.send_body(404, "text/html", b"<p>Not found</p>")
+
+        page = path[len("/page-") : -len(".html")] if path.startswith("/page-") else ""
+        if not page.isdigit() or int(page) >= self.spec.pages:
+            return self.send_body(404, "text/html", b"<p>Not found</p>")
+
+        page = int(page)
+        kind = self.spec.page_kind(page)
+        if kind == "forbidden":
+            return self.send_body(403, "text/html", b"<p>Forbidden</p>")
+        if kind == "throttled":
+            with self.hits_lock:
+                self.hits[path] = self.hits.get(path, 0) + 1
+                first_hit = self.hits[path] == 1
+            if first_hit:
+                return self.send_body(
+                    429, "text/html", b"<p>Slow down</p>", {"Retry-After": "1"}
+                )
+        if kind == "slow":
+            time.sleep(self.spec.slow_ms / 1000)
+        self.send_body(200, "text/html", self.spec.render_page(page))
+
+
+class SyntheticSiteServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Crawlers killed mid-response (timeouts) are expected, not worth a traceback
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def make_server(spec: SiteSpec, port: int = 0) -> ThreadingHTTPServer:
+    """Bind a threaded HTTP server for the site on localhost, port 0 picks a free one."""
+    handler = type(
+        "Handler",
+        (SyntheticSiteHandler,),
+        {"spec": spec, "hits": {}, "hits_lock": threading.Lock()},
+    )
+    return SyntheticSiteServer(("127.0.0.1", port), handler)
+
+
+def serve(spec: SiteSpec, port: int, ready):
+    server = make_server(spec, port)
+    ready.send(server.server_address[1])
+    ready.close()
+    server.serve_forever()
+
+
+def start_site_process(spec: SiteSpec, port: int = 0) -> tuple:
+    """
+    Serves the site from a separate process, keeping it out of the measurements of
+    the calling process.
+
+    Args:
+        spec (SiteSpec): Site to serve.
+        port (int, optional): Port to listen on, 0 picks a free one.
+
+    Returns:
+        tuple: The server process and the base URL of the site.
+    """
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(
+        target=serve, args=(spec, port, sender), daemon=True
+    )
+    process.start()
+    sender.close()
+    port = receiver.recv()
+    return process, f"http://127.0.0.1:{port}"
+
+
+def add_spec_arguments(parser: argparse.ArgumentParser):
+    """Expose every `SiteSpec` field as a command line option."""
+    for name, default in asdict(SiteSpec()).items():
+        option = f"--{name.replace('_', '-')}"
+        if isinstance(default, bool):
+            parser.add_argument(option, action="store_true", default=default)
+        else:
+            parser.add_argument(option, type=type(default), default=default)
+
+
+def spec_from_arguments(args: argparse.Namespace) -> SiteSpec:
+    return SiteSpec(**{name: getattr(args, name) for name in asdict(SiteSpec())})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    add_spec_arguments(parser)
+    parser.add_argument("--port", type=int, default=8900)
+    args = parser.parse_args()
+
+    server = make_server(spec_from_arguments(args), args.port)
+    print(f"Serving synthetic site on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import hashlib
+
+
+class BoilerplateFilter:
+    """
+    Removes text blocks that repeat across the pages of a crawl.
+
+    Cookie banners, footers, newsletter blurbs and navigation text show up as the
+    same paragraph on every page. The filter remembers a digest of every block it
+    has let through; a block that was already emitted by an earlier page is dropped,
+    so the reports keep at most one copy of it.
+    """
+
+    def __init__(self):
+        self.emitted = set()
+        self.blocks_dropped = 0
+        self.bytes_dropped = 0
+
+    def snapshot(self) -> str:
+        """Serializable state of the filter: the emitted digests, hex encoded."""
+        return b"".join(self.emitted).hex()
+
+    def restore(self, snapshot: str):
+        digests = bytes.fromhex(snapshot)
+        self.emitted.update(digests[i : i + 8] for i in range(0, len(digests), 8))
+
+    @staticmethod
+    def block_key(block: str) -> bytes:
+        normalized = " ".join(block.lower().split())
+        return hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest()
+
+    def learn(self, body_text: str):
+        """Record the blocks of a page without filtering it."""
+        for block in body_text.split("\n"):
+            if block.strip():
+                self.emitted.add(self.block_key(block))
+
+    def strip(self, body_text: str) -> str:
+        """
+        Drops the blocks of a page that an earlier page already emitted.
+
+        Args:
+            body_text (str): Page body, one block (paragraph) per line.
+
+        Returns:
+            str: The body without repeated blocks.
+        """
+        kept = []
+        for block in body_text.split("\n"):
+            if not block.strip():
+                continue
+            key = self.block_key(block)
+            if key in self.emitted:
+                self.blocks_dropped += 1
+                self.bytes_dropped += len(block.encode("utf-8"))
+                continue
+            self.emitted.add(key)
+            kept.append(block)
+        return "\n".join(kept)
@@ -0,0 +1,266 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from office import OFFICE_EXTENSIONS, office_converter
+from utils import (
+    INGEST_FORMAT,
+    INGEST_FORMATS,
+    convert_markdown_to_pdf,
+    logger,
+    process_context,
+)
+
+# Processes converting documents, shared by every conversion of this process
+CONVERSION_WORKERS = int(
+    os.getenv("CONVERSION_WORKERS", str(min(4, os.cpu_count() or 1)))
+)
+CONVERSION_CACHE_DIR = os.getenv(
+    "CONVERSION_CACHE_DIR", os.path.join(os.getcwd(), "state", "conversions")
+)
+# Least recently used conversions are evicted past this total size
+CONVERSION_CACHE_BYTES = int(os.getenv("CONVERSION_CACHE_BYTES", str(1024**3)))
+
+# Version of every converter's output. Bump it when a converter changes, so that
+# the conversions cached with the previous version are not reused.
+CONVERTER_VERSIONS = {"markdown_pdf": "1", "office_pdf": "2"}
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def run_converter(converter: str, input_path: str, output_dir: str) -> str:
+    """Convert `input_path` to a PDF in `output_dir`, in a conversion process."""
+    if converter == "markdown_pdf":
+        return convert_markdown_to_pdf(input_path, output_dir)
+    raise ValueError(f"Unknown converter {converter}")
+
+
+class ConversionCache:
+    """
+    Content-addressed store of converted documents.
+
+    Entries are keyed by the hash of the input and the converter version, so an
+    input seen before, under any name, is never converted twice. Reads refresh the
+    modification time of an entry, and once the cache grows past `max_bytes` the
+    least recently used entries are evicted. The cache can be shared by every
+    process of a machine.
+    """
+
+    def __init__(
+        self, root: str = CONVERSION_CACHE_DIR, max_bytes: int = CONVERSION_CACHE_BYTES
+    ):
+        self.root = root
+        self.max_bytes = max_bytes
+        # Estimated total size, recomputed from disk before evicting
+        self.size: Optional[int] = None
+        self.lock = threading.Lock()
+        # Conversions in progress, on the same file system so entries move in atomically
+        self.scratch_root = os.path.join(root, ".scratch")
+        os.makedirs(self.scratch_root, exist_ok=True)
+
+    def key(self, converter: str, input_path: str) -> str:
+        digest = hashlib.sha256(
+            f"{converter}:{CONVERTER_VERSIONS[converter]}:".encode("utf-8")
+        )
+        with open(input_path, "rb") as f:
+            while chunk := f.read(HASH_CHUNK_BYTES):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + ".pdf")
+
+    def get(self, key: str) -> Optional[str]:
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key: str, converted_path: str, output_path: str):
+        """Move a converted file into the cache and link it at `output_path`, before
+        any eviction can remove it."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.move(converted_path, path)
+        link_or_copy(path, output_path)
+        with self.lock:
+            if self.size is not None:
+                self.size += os.path.getsize(path)
+            if self.size is None or self.size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        entries = []
+        for directory, subdirectories, names in os.walk(self.root):
+            if directory == self.root:
+                subdirectories.remove(".scratch")
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if self.size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+            logger.info(f"Evicted {path} from the conversion cache")
+
+
+class DocumentConverter:
+    """
+    Converts documents to PDF on a bounded process pool, through a `ConversionCache`.
+
+    `convert` blocks until the PDF is ready and is meant to be called from threads,
+    e.g. with `asyncio.to_thread`, so the event loop never runs a conversion. At
+    most `workers` markdown conversions run at once, however many threads are
+    waiting. Office documents are converted by the persistent LibreOffice
+    processes of `office.office_converter` instead.
+    """
+
+    def __init__(
+        self,
+        workers: int = CONVERSION_WORKERS,
+        cache: Optional[ConversionCache] = None,
+    ):
+        self.workers = workers
+        self.cache = cache
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.lock = threading.Lock()
+
+    def convert(self, converter: str, input_path: str, output_dir: str) -> str:
+        """
+        Convert a document to PDF, reusing a cached conversion of the same content.
+
+        Args:
+            converter (str): One of `CONVERTER_VERSIONS`.
+            input_path (str): Document to convert.
+            output_dir (str): Directory receiving `<input name>.pdf`.
+
+        Returns:
+            str: Path of the PDF in `output_dir`.
+        """
+        with self.lock:
+            if self.cache is None:
+                self.cache = ConversionCache()
+            if self.pool is None and converter != "office_pdf":
+                self.pool = ProcessPoolExecutor(
+                    self.workers, mp_context=process_context()
+                )
+
+        os.makedirs(output_dir, exist_ok=True)
+        output_path = os.path.join(
+            output_dir, os.path.splitext(os.path.basename(input_path))[0] + ".pdf"
+        )
+        key = self.cache.key(converter, input_path)
+        cached_path = self.cache.get(key)
+        if cached_path:
+            try:
+                link_or_copy(cached_path, output_path)
+                logger.info(f"Reused the cached conversion of {input_path}")
+                return output_path
+            except FileNotFoundError:
+                # Evicted in the meantime
+                pass
+
+        # Converted out of `output_dir`, which may hold a file with the same name
+        with tempfile.TemporaryDirectory(dir=self.cache.scratch_root) as scratch:
+            try:
+                if converter == "office_pdf":
+                    converted_path = office_converter.convert(
+                        input_path, os.path.join(scratch, "converted.pdf")
+                    )
+                else:
+                    converted_path = self.pool.submit(
+                        run_converter, converter, input_path, scratch
+                    ).result()
+            except BrokenProcessPool:
+                # A conversion process died, the next conversion starts a new pool
+                with self.lock:
+                    self.pool = None
+                raise
+            self.cache.put(key, converted_path, output_path)
+        return output_path
+
+    def shutdown(self):
+        if self.pool:
+            self.pool.shutdown()
+            self.pool = None
+
+
+def link_or_copy(source: str, destination: str):
+    """Hard link `destination` to `source`, which eviction then cannot remove."""
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError as e:
+        # A source evicted meanwhile is reported to the caller, which converts the
+        # document again; any other failure, e.g. another filesystem, copies it
+        if isinstance(e, FileNotFoundError):
+            raise
+        shutil.copyfile(source, destination)
+
+
+def prepare_report_for_upload(
+    path: str, output_dir: str, ingest_format: str = INGEST_FORMAT
+) -> str:
+    """
+    Turn a markdown report into the file uploaded to the vector store.
+
+    Args:
+        path (str): Path to the markdown report.
+        output_dir (str): Directory of the generated PDF, for the "pdf" format.
+        ingest_format (str): One of `INGEST_FORMATS`. Defaults to the
+            `INGEST_FORMAT` environment variable, then "markdown".
+
+    Returns:
+        str: Path of the file to upload. Markdown reports are uploaded in place,
+            text ones are only renamed to ".txt".
+    """
+    if ingest_format == "markdown":
+        return path
+    if ingest_format == "text":
+        text_path = os.path.splitext(path)[0] + ".txt"
+        os.replace(path, text_path)
+        return text_path
+    if ingest_format == "pdf":
+        return converter.convert("markdown_pdf", path, output_dir)
+    raise ValueError(
+        f"Unknown ingest format {ingest_format}, expected one of {INGEST_FORMATS}"
+    )
+
+
+def prepare_attachment_for_upload(path: str, output_dir: str) -> str:
+    """
+    Turn a downloaded attachment into the file uploaded to the vector store.
+
+    Args:
+        path (str): Path to the attachment.
+        output_dir (str): Directory of the PDF converted from an office document.
+
+    Returns:
+        str: Path of the file to upload. PDFs are uploaded in place.
+    """
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    if extension == "pdf":
+        return path
+    if extension in OFFICE_EXTENSIONS:
+        return converter.convert("office_pdf", path, output_dir)
+    raise ValueError(f"Cannot upload attachment {path}, unsupported file type")
+
+
+converter = DocumentConverter()
@@ -0,0 +1,233 @@
+import json
+import os
+import sqlite3
+import zlib
+from datetime import datetime
+from typing import Optional
+
+DEFAULT_STATE_DB = os.getenv(
+    "CRAWL_STATE_DB", os.path.join(os.getcwd(), "state", "crawl.sqlite3")
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS page_validators (
+    company_name TEXT NOT NULL,
+    url TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    content_hash TEXT,
+    links TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (company_name, url)
+);
+CREATE TABLE IF NOT EXISTS pending_validators (
+    source TEXT NOT NULL,
+    company_name TEXT NOT NULL,
+    url TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    content_hash TEXT,
+    links TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (source, company_name, url)
+);
+CREATE TABLE IF NOT EXISTS crawl_checkpoints (
+    company_name TEXT NOT NULL,
+    start_url TEXT NOT NULL,
+    state BLOB NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (company_name, start_url)
+);
+CREATE TABLE IF NOT EXISTS crawl_results (
+    company_name TEXT NOT NULL,
+    start_url TEXT NOT NULL,
+    url TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    PRIMARY KEY (company_name, start_url, url)
+);
+"""
+
+
+class CrawlStore:
+    """
+    Persistent per-URL crawl state shared between crawls of the same company.
+
+    Backed by a SQLite database so that concurrent scrape processes can read and
+    write it safely.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or DEFAULT_STATE_DB
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.connection = sqlite3.connect(self.path, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def get_page(self, company_name: str, url: str) -> Optional[dict]:
+        """Return the validators stored for a URL by the previous crawl.
+
+        Args:
+            company_name (str): Company the URL was crawled for.
+            url (str): Canonical URL.
+
+        Returns:
+            Optional[dict]: `etag`, `last_modified`, `content_hash` and `links`,
+                or None if the URL was never crawled.
+        """
+        row = self.connection.execute(
+            "SELECT etag, last_modified, content_hash, links FROM page_validators"
+            " WHERE company_name = ? AND url = ?",
+            (company_name, url),
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "etag": row[0],
+            "last_modified": row[1],
+            "content_hash": row[2],
+            "links": json.loads(row[3]) if row[3] else [],
+        }
+
+    def save_pages(self, company_name: str, pages: list):
+        """Store the validators of freshly fetched URLs in a single transaction.
+
+        The validators of a page whose content went into a report batch or an
+        attachment are kept pending until that file is uploaded, see
+        `promote_pages`, so that a page whose content never made it to the vector
+        store is not taken as unchanged by the next incremental crawl.
+
+        Args:
+            company_name (str): Company the URLs were crawled for.
+            pages (list): (source, url, etag, last_modified, content_hash, links)
+                tuples, with the file carrying the content of the page or None if
+                it has nothing to upload, the canonical URL, the ETag and
+                Last-Modified response headers, the hash of the content that ends
+                up in the reports and the outbound links, replayed when the page
+                is unchanged.
+        """
+        if not pages:
+            return
+        updated_at = datetime.now().isoformat()
+        rows = [
+            (
+                source,
+                company_name,
+                url,
+                etag,
+                last_modified,
+                content_hash,
+                json.dumps(links),
+                updated_at,
+            )
+            for source, url, etag, last_modified, content_hash, links in pages
+        ]
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO page_validators"
+                " (company_name, url, etag, last_modified, content_hash, links,"
+                " updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [row[1:] for row in rows if row[0] is None],
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO pending_validators"
+                " (source, company_name, url, etag, last_modified, content_hash,"
+                " links, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [row for row in rows if row[0] is not None],
+            )
+
+    def promote_pages(self, sources: list) -> int:
+        """Commit the pending validators of the pages in files that were uploaded.
+
+        Args:
+            sources (list): Paths of the uploaded report batches and attachments.
+
+        Returns:
+            int: Number of pages whose validators were committed.
+        """
+        promoted = 0
+        with self.connection:
+            for source in sources:
+                promoted += self.connection.execute(
+                    "INSERT OR REPLACE INTO page_validators"
+                    " (company_name, url, etag, last_modified, content_hash, links,"
+                    " updated_at) SELECT company_name, url, etag, last_modified,"
+                    " content_hash, links, updated_at FROM pending_validators"
+                    " WHERE source = ?",
+                    (source,),
+                ).rowcount
+                self.connection.execute(
+                    "DELETE FROM pending_validators WHERE source = ?", (source,)
+                )
+        return promoted
+
+    def discard_pending_pages(self, directory: str) -> int:
+        """Drop the pending validators of the files under `directory` never uploaded.
+
+        Args:
+            directory (str): Workspace of a finished scrape job.
+
+        Returns:
+            int: Number of pages whose validators were dropped.
+        """
+        prefix = os.path.join(directory, "")
+        with self.connection:
+            return self.connection.execute(
+                "DELETE FROM pending_validators WHERE substr(source, 1, ?) = ?",
+                (len(prefix), prefix),
+            ).rowcount
+
+    def save_checkpoint(
+        self, company_name: str, start_url: str, state: dict, results: list
+    ):
+        """Persist the state of a running crawl along with the URLs it completed.
+
+        Args:
+            company_name (str): Company the crawl runs for.
+            start_url (str): Canonical start URL identifying the crawl.
+            state (dict): JSON serializable crawl state, stored zlib compressed.
+            results (list): (url, outcome) pairs completed since the last checkpoint.
+        """
+        blob = zlib.compress(json.dumps(state).encode("utf-8"))
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO crawl_checkpoints"
+                " (company_name, start_url, state, updated_at) VALUES (?, ?, ?, ?)",
+                (company_name, start_url, blob, datetime.now().isoformat()),
+            )
+            self.save_results(company_name, start_url, results)
+
+    def save_results(self, company_name: str, start_url: str, results: list):
+        """Record the outcome of completed URLs, see `save_checkpoint`."""
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO crawl_results"
+                " (company_name, start_url, url, outcome) VALUES (?, ?, ?, ?)",
+                [(company_name, start_url, url, outcome) for url, outcome in results],
+            )
+
+    def load_checkpoint(self, company_name: str, start_url: str) -> Optional[dict]:
+        """Return the last checkpointed state of a crawl, None if there is none."""
+        row = self.connection.execute(
+            "SELECT state FROM crawl_checkpoints WHERE company_name = ? AND start_url = ?",
+            (company_name, start_url),
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def clear_checkpoint(
+        self, company_name: str, start_url: str, include_results: bool = False
+    ):
+        """Forget the checkpoint of a crawl, and optionally its per-URL results."""
+        tables = ["crawl_checkpoints"]
+        if include_results:
+            tables.append("crawl_results")
+        with self.connection:
+            for table in tables:
+                self.connection.execute(
+                    f"DELETE FROM {table} WHERE company_name = ? AND start_url = ?",
+                    (company_name, start_url),
+                )
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,862 @@
+import asyncio
+import contextlib
+import hashlib
+import math
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Optional
+from urllib.parse import urlparse, quote_plus
+
+import httpx
+
+from attachments import (
+    ATTACHMENT_HEAD_CHECK,
+    MAX_ATTACHMENT_BYTES,
+    SNIFF_BYTES,
+    AttachmentRejected,
+    attachment_extension,
+    check_attachment_headers,
+    sniff_attachment,
+)
+from boilerplate import BoilerplateFilter
+from crawl_store import CrawlStore
+from dedup import DEFAULT_SIMILARITY_THRESHOLD, NearDuplicateIndex
+from discovery import CRAWLER_USER_AGENT, discover_sitemap_urls, fetch_robots
+from frontier import CrawlFrontier, canonicalize_url
+from page_parser import extract_page
+from page_search import PageIndexWriter
+from rate_limit import DEFAULT_HOST_RATE, HostRateLimiter
+from report_batches import ReportBatcher
+from workspace import JobWorkspace
+from utils import (
+    attachment_path,
+    generate_page_report,
+    logger,
+)
+
+# Number of URLs fetched concurrently for a single crawl
+DEFAULT_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "10"))
+# Upper bound of simultaneous requests sent to one host
+DEFAULT_MAX_CONNECTIONS_PER_HOST = int(os.getenv("CRAWL_MAX_CONNECTIONS_PER_HOST", "6"))
+# Whether robots.txt disallow rules and Crawl-delay are honored
+DEFAULT_RESPECT_ROBOTS = os.getenv("CRAWL_RESPECT_ROBOTS", "true").lower() == "true"
+
+THROTTLE_STATUS_CODES = (429, 503)
+ATTACHMENT_CHUNK_BYTES = 64 * 1024
+# Longest Retry-After the crawler is willing to wait for
+MAX_RETRY_AFTER = 300.0
+# A running crawl checkpoints after this many completed URLs or seconds
+CHECKPOINT_PAGES = int(os.getenv("CRAWL_CHECKPOINT_PAGES", "50"))
+CHECKPOINT_SECONDS = float(os.getenv("CRAWL_CHECKPOINT_SECONDS", "10"))
+# Shortest interval between two progress reports of a running crawl
+PROGRESS_SECONDS = float(os.getenv("CRAWL_PROGRESS_SECONDS", "1"))
+# Whether paragraphs repeated across the pages of a crawl are reported only once
+DEFAULT_STRIP_BOILERPLATE = (
+    os.getenv("CRAWL_STRIP_BOILERPLATE", "true").lower() == "true"
+)
+
+
+def create_http_client(max_connections: int) -> httpx.AsyncClient:
+    """Create the shared keep-alive client used for the whole crawl.
+
+    Args:
+        max_connections (int): Size of the connection pool.
+
+    Returns:
+        httpx.AsyncClient: Client reusing connections (and TLS sessions) across requests.
+    """
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        keepalive_expiry=30,
+    )
+    return httpx.AsyncClient(
+        verify=False,
+        timeout=5,
+        limits=limits,
+        headers={"User-Agent": CRAWLER_USER_AGENT},
+    )
+
+
+class RetryLater(Exception):
+    """A fetch failed transiently and should be rescheduled instead of retried inline."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given either in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        seconds = (retry_at - datetime.now(timezone.utc)).total_seconds()
+    return min(MAX_RETRY_AFTER, max(0.0, seconds))
+
+
+def scraperapi_url(url: str) -> str:
+    SCRAPERAPI_KEY = os.getenv("SCRAPERAPI_KEY")
+    encoded_url = quote_plus(url)
+    return f"http://api.scraperapi.com?api_key={SCRAPERAPI_KEY}&url={encoded_url}"
+
+
+def raise_if_throttled(response: httpx.Response, limiter: HostRateLimiter):
+    """Slow the host down and raise RetryLater on 429/503, speed it up otherwise."""
+    if response.status_code in THROTTLE_STATUS_CODES:
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        limiter.on_throttle(retry_after)
+        raise RetryLater(f"Throttled with HTTP {response.status_code}", retry_after)
+    limiter.on_success()
+
+
+async def fetch_url(
+    client: httpx.AsyncClient,
+    url: str,
+    limiter: HostRateLimiter,
+    headers: Optional[dict] = None,
+) -> httpx.Response:
+    """Fetch a single URL once, falling back to ScraperAPI on 403.
+
+    Overload signals (429, 503, timeouts) slow the host's limiter down, successful
+    responses speed it back up.
+
+    Args:
+        client (httpx.AsyncClient): Shared crawl client.
+        url (str): URL to fetch.
+        limiter (HostRateLimiter): Rate limiter of the URL's host.
+        headers (Optional[dict]): Extra request headers, e.g. conditional validators.
+
+    Returns:
+        httpx.Response: The response.
+
+    Raises:
+        RetryLater: If the fetch failed in a way worth retrying.
+    """
+    try:
+        async with limiter:
+            response = await client.get(url, headers=headers)
+    except httpx.TimeoutException as e:
+        limiter.on_throttle()
+        raise RetryLater(f"Timed out: {e!r}")
+    except httpx.RequestError as e:
+        raise RetryLater(f"Request error: {e!r}")
+
+    raise_if_throttled(response, limiter)
+
+    if response.status_code == 403:
+        if not os.getenv("SCRAPERAPI_KEY"):
+            logger.info(f"Forbidden access for URL: {url}, no ScraperAPI key set.")
+            return response
+        logger.info(f"Forbidden access for URL: {url}. Using ScraperAPI.")
+        try:
+            response = await client.get(scraperapi_url(url), timeout=30)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            raise RetryLater(f"ScraperAPI error: {e!r}")
+
+    return response
+
+
+async def stream_attachment(
+    response: httpx.Response, url: str, part_path: str, max_bytes: int
+) -> str:
+    """
+    Writes an attachment response to `part_path` chunk by chunk.
+
+    The transfer is aborted as soon as the headers, the leading bytes or the running
+    size show that the attachment is oversized or not the type its URL claims.
+
+    Args:
+        response (httpx.Response): Streamed response whose body was not read yet.
+        url (str): URL of the attachment.
+        part_path (str): Temporary file receiving the body.
+        max_bytes (int): Largest accepted attachment size.
+
+    Returns:
+        str: SHA-256 of the attachment.
+
+    Raises:
+        AttachmentRejected: If the attachment has to be skipped.
+    """
+    check_attachment_headers(response.headers, max_bytes)
+    extension = attachment_extension(url)
+    digest = hashlib.sha256()
+    head = b""
+    size = 0
+
+    try:
+        with open(part_path, "wb") as part_file:
+            async for chunk in response.aiter_bytes(ATTACHMENT_CHUNK_BYTES):
+                if len(head) < SNIFF_BYTES:
+                    head += chunk[: SNIFF_BYTES - len(head)]
+                    if len(head) == SNIFF_BYTES:
+                        sniff_attachment(head, extension)
+
+                size += len(chunk)
+                if size > max_bytes:
+                    raise AttachmentRejected(f"larger than {max_bytes} bytes")
+
+                digest.update(chunk)
+                part_file.write(chunk)
+
+        if len(head) < SNIFF_BYTES:
+            sniff_attachment(head, extension)
+    except BaseException:
+        # Rejected before a byte was written, the file may not exist
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(part_path)
+        raise
+
+    return digest.hexdigest()
+
+
+async def download_attachment(
+    client: httpx.AsyncClient,
+    url: str,
+    limiter: HostRateLimiter,
+    company_name: str,
+    validators: list,
+    key: str,
+    previous: Optional[dict],
+    attachments_folder: str,
+    max_bytes: int = MAX_ATTACHMENT_BYTES,
+    head_check: bool = ATTACHMENT_HEAD_CHECK,
+    on_attachment: Optional[Callable[[str], None]] = None,
+) -> tuple:
+    """
+    Streams an attachment to the company's attachment folder.
+
+    An optional HEAD request rejects oversized or mislabeled files before any byte of
+    them is transferred. The body is then streamed to disk, never held in memory, and
+    falls back to ScraperAPI on 403 like pages do.
+
+    Args:
+        client (httpx.AsyncClient): Shared crawl client.
+        url (str): URL of the attachment.
+        limiter (HostRateLimiter): Rate limiter of the URL's host.
+        company_name (str): The company name for folder organization.
+        validators (list): Receives the validators of the response, see
+            `CrawlStore.save_pages`. Those of a saved attachment are pending
+            until it is uploaded.
+        key (str): Canonical URL the validators are stored under.
+        previous (Optional[dict]): Validators stored by the previous crawl, if the
+            crawl is incremental.
+        attachments_folder (str): Attachment folder of the scrape job.
+        max_bytes (int, optional): Largest accepted attachment size.
+        head_check (bool, optional): Check size and type with a HEAD request first.
+        on_attachment (Optional[Callable[[str], None]]): Called with the path of
+            the attachment once it is saved, when it is new or changed, after its
+            validators were added to `validators`.
+
+    Returns:
+        tuple: An empty list of links, and one of "new", "changed", "unchanged",
+            "skipped" or "failed".
+
+    Raises:
+        RetryLater: If the download failed in a way worth retrying.
+    """
+    part_path = os.path.join(
+        attachments_folder,
+        company_name,
+        f".{hashlib.sha1(key.encode('utf-8')).hexdigest()}.part",
+    )
+    os.makedirs(os.path.dirname(part_path), exist_ok=True)
+    headers = conditional_headers(previous)
+
+    try:
+        if head_check:
+            try:
+                async with limiter:
+                    head = await client.head(url, headers=headers)
+            except httpx.RequestError as e:
+                logger.debug(
+                    f"HEAD request for {url} failed, downloading anyway: {e!r}"
+                )
+            else:
+                if head.status_code == 304 and previous:
+                    return [], "unchanged"
+                if head.status_code < 300:
+                    check_attachment_headers(head.headers, max_bytes)
+
+        try:
+            async with limiter:
+                async with client.stream("GET", url, headers=headers) as response:
+                    raise_if_throttled(response, limiter)
+                    status_code = response.status_code
+                    response_validators = (
+                        response.headers.get("ETag"),
+                        response.headers.get("Last-Modified"),
+                    )
+                    if status_code == 304 and previous:
+                        return [], "unchanged"
+                    if status_code >= 400 and status_code != 403:
+                        logger.info(f"Attachment {url} answered HTTP {status_code}")
+                        return [], "failed"
+                    if status_code != 403:
+                        content_hash = await stream_attachment(
+                            response, url, part_path, max_bytes
+                        )
+
+            if status_code == 403 and not os.getenv("SCRAPERAPI_KEY"):
+                logger.info(f"Forbidden access for URL: {url}, no ScraperAPI key set.")
+                return [], "failed"
+            if status_code == 403:
+                logger.info(f"Forbidden access for URL: {url}. Using ScraperAPI.")
+                async with client.stream(
+                    "GET", scraperapi_url(url), timeout=30
+                ) as response:
+                    response.raise_for_status()
+                    content_hash = await stream_attachment(
+                        response, url, part_path, max_bytes
+                    )
+        except httpx.TimeoutException as e:
+            limiter.on_throttle()
+            raise RetryLater(f"Timed out: {e!r}")
+        except httpx.HTTPError as e:
+            raise RetryLater(f"Request error: {e!r}")
+    except AttachmentRejected as e:
+        logger.info(f"Skipping attachment {url}: {e}")
+        return [], "skipped"
+
+    file_path = None
+    if previous and previous["content_hash"] == content_hash:
+        os.remove(part_path)
+        outcome = "unchanged"
+        logger.info(f"Content of {url} is unchanged since the previous crawl.")
+    else:
+        outcome = "changed" if previous else "new"
+        file_path = attachment_path(url, attachments_folder, company_name)
+        os.replace(part_path, file_path)
+        logger.info(f"Saved attachment {url} to {file_path}")
+
+    if status_code == 200:
+        validators.append((file_path, key, *response_validators, content_hash, []))
+    if file_path and on_attachment:
+        on_attachment(file_path)
+    return [], outcome
+
+
+def percentile(values: list, q: float) -> float:
+    """Nearest-rank percentile of `values`, 0.0 when empty."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def conditional_headers(previous: Optional[dict]) -> dict:
+    """Build If-None-Match / If-Modified-Since headers from stored validators."""
+    headers = {}
+    if previous and previous["etag"]:
+        headers["If-None-Match"] = previous["etag"]
+    if previous and previous["last_modified"]:
+        headers["If-Modified-Since"] = previous["last_modified"]
+    return headers
+
+
+def hash_page(page: dict) -> str:
+    """Hash the fields of a page that end up in its report."""
+    digest = hashlib.sha256()
+    for field in ("title", "description", "body_text"):
+        digest.update(page[field].encode("utf-8", errors="ignore"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def parse_page(content: bytes, url: str) -> tuple:
+    """Extract the fields of a page and hash the ones that end up in its report."""
+    page = extract_page(content, url)
+    return page, hash_page(page)
+
+
+class ReportWriter:
+    """
+    Writes the reports and search index entries of a crawl on a thread of its own.
+
+    Pages are written in the order they are submitted and never on the event loop,
+    so neither a slow disk nor a merge of the search index holds the fetches back.
+    Once a page is written, `on_written` is called back on the event loop with
+    its validators, pending on the report batch the page went into, and the
+    batches sealed meanwhile.
+    """
+
+    def __init__(
+        self,
+        company_name: str,
+        reports_dir: str,
+        on_written: Callable[[list, list], None],
+        page_index: Optional[PageIndexWriter] = None,
+    ):
+        self.loop = asyncio.get_running_loop()
+        self.company_name = company_name
+        self.reports_dir = reports_dir
+        self.on_written = on_written
+        self.sealed = []
+        self.batcher = ReportBatcher(reports_dir, on_batch=self.sealed.append)
+        self.page_index = page_index
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="crawl-writer")
+
+    def write(self, url: str, page: dict, validators: Optional[tuple] = None):
+        """Queue the report of a page, see `utils.generate_page_report`."""
+        self.executor.submit(self.write_page, url, page, validators)
+
+    def write_page(self, url: str, page: dict, validators: Optional[tuple]):
+        written = []
+        try:
+            path = generate_page_report(
+                url, page, self.company_name, self.reports_dir, self.batcher
+            )
+            if path and validators:
+                written.append((path, *validators))
+            if self.page_index:
+                self.page_index.add(url, page["title"], page["body_text"])
+        except Exception as e:
+            logger.error(f"Error writing the report of {url}: {e}")
+        self.hand_over(written)
+
+    def hand_over(self, written: list):
+        sealed = self.sealed[:]
+        self.sealed.clear()
+        if written or sealed:
+            self.loop.call_soon_threadsafe(self.on_written, written, sealed)
+
+    def close_files(self):
+        self.batcher.close()
+        self.hand_over([])
+        if self.page_index:
+            self.page_index.close()
+
+    async def close(self):
+        """Write the queued pages, then seal the open batches and flush the index."""
+        await self.loop.run_in_executor(self.executor, self.close_files)
+        self.executor.shutdown()
+
+
+async def process_response(
+    url: str,
+    response: httpx.Response,
+    key: str,
+    previous: Optional[dict],
+    duplicates: NearDuplicateIndex,
+    writer: ReportWriter,
+    validators: list,
+    boilerplate: Optional[BoilerplateFilter] = None,
+) -> tuple:
+    """Write the page report, returning the links found on the page.
+
+    Pages whose content hash matches `previous` are left out of the reports, and so
+    are pages whose body text is a near-duplicate of a page already seen.
+    Paragraphs an earlier page already reported are dropped from the page report.
+    The page is parsed on a thread and its report written by `writer`, so the event
+    loop only runs the checks against the crawl state.
+
+    Args:
+        url (str): URL the response was fetched from.
+        response (httpx.Response): Fetched response.
+        key (str): Canonical URL the validators are stored under.
+        previous (Optional[dict]): Validators stored by the previous crawl, if the
+            crawl is incremental.
+        duplicates (NearDuplicateIndex): Fingerprints of the pages seen in this crawl.
+        writer (ReportWriter): Writes the reports and search index of the crawl,
+            and hands the validators of a reported page over once it is written.
+        validators (list): Receives the validators of the other pages, see
+            `CrawlStore.save_pages`.
+        boilerplate (Optional[BoilerplateFilter]): Paragraphs reported by this crawl,
+            None to keep every paragraph.
+
+    Returns:
+        tuple: Absolute URLs linked from the page, and one of "new", "changed",
+            "unchanged", "duplicate" or "skipped".
+    """
+    content_type = response.headers.get("Content-Type", "").lower()
+    if "text/html" not in content_type:
+        logger.debug(f"Non-HTML content at {url}, skipping parsing.")
+        return [], "skipped"
+
+    page, content_hash = await asyncio.to_thread(parse_page, response.content, url)
+    links = page["links"]
+    response_validators = None
+    if response.status_code == 200:
+        response_validators = (
+            key,
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+            content_hash,
+            links,
+        )
+
+    if previous and previous["content_hash"] == content_hash:
+        outcome = "unchanged"
+        duplicates.is_duplicate(page["body_text"])
+        if boilerplate:
+            boilerplate.learn(page["body_text"])
+        logger.info(f"Content of {url} is unchanged since the previous crawl.")
+    elif duplicates.is_duplicate(page["body_text"]):
+        outcome = "duplicate"
+        logger.info(f"{url} is a near-duplicate of an already scraped page, skipping.")
+    else:
+        outcome = "changed" if previous else "new"
+        if boilerplate:
+            page = {**page, "body_text": boilerplate.strip(page["body_text"])}
+        writer.write(url, page, response_validators)
+        return links, outcome
+
+    if response_validators:
+        validators.append((None, *response_validators))
+    return links, outcome
+
+
+async def crawl_website(
+    start_url: str,
+    company_name: str,
+    max_pages: int = 1000,
+    max_retries: int = 5,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    max_connections_per_host: int = DEFAULT_MAX_CONNECTIONS_PER_HOST,
+    normalization_rules: Optional[dict] = None,
+    incremental: bool = False,
+    respect_robots: bool = DEFAULT_RESPECT_ROBOTS,
+    use_sitemaps: bool = True,
+    similarity_threshold: float = DEFAULT_SIMILARITY_THRESHOLD,
+    strip_boilerplate: bool = DEFAULT_STRIP_BOILERPLATE,
+    resume: bool = False,
+    workspace: Optional[JobWorkspace] = None,
+    on_batch: Optional[Callable[[str], None]] = None,
+    on_attachment: Optional[Callable[[str], None]] = None,
+    on_progress: Optional[Callable[[dict], None]] = None,
+) -> dict:
+    """
+    Crawls a website concurrently starting from the given URL.
+
+    Up to `concurrency` URLs are fetched at once over a single keep-alive client.
+    Each host gets a `HostRateLimiter` allowing at most `max_connections_per_host`
+    requests in flight, which backs off when the host throttles. Failed fetches are
+    deferred in the frontier with exponential backoff (or the host's Retry-After)
+    so that the other URLs keep flowing in the meantime.
+    The validators of every fetched URL are kept in the `CrawlStore`; an incremental
+    crawl sends them as conditional requests and only reports new or changed content.
+    Those of reported pages and saved attachments stay pending, committed to the
+    store before the report batch or attachment is handed over, until it is
+    uploaded, see `CrawlStore.promote_pages`.
+    Reported pages are added to the company's BM25 index as well, see `page_search`.
+
+    The frontier is seeded with the start URL followed by the site's sitemap entries
+    (most important first), then grows with the links found on each page. URLs
+    disallowed by robots.txt are never enqueued and its Crawl-delay is honored.
+
+    The frontier, the seen URLs, the statistics and the dedup state are periodically
+    checkpointed to the `CrawlStore`, as well as when the crawl gets cancelled, so
+    that a crawl cut short by a timeout can be resumed by a later run.
+
+    Args:
+        start_url (str): The starting URL for scraping.
+        company_name (str): The name of the company for organizing reports.
+        max_pages (int, optional): Maximum number of pages to scrape. Defaults to 1000.
+        max_retries (int, optional): Attempts per URL before skipping it. Defaults to 5.
+        concurrency (int, optional): Number of URLs fetched in parallel.
+        max_connections_per_host (int, optional): Concurrent requests allowed per host.
+        normalization_rules (Optional[dict]): Overrides for the URL canonicalization
+            rules used to detect already known pages, see `frontier.canonicalize_url`.
+        incremental (bool, optional): Skip content unchanged since the previous crawl.
+        respect_robots (bool, optional): Honor robots.txt disallow rules and Crawl-delay.
+        use_sitemaps (bool, optional): Seed the frontier from the site's sitemaps.
+        similarity_threshold (float, optional): SimHash similarity from which a page
+            counts as a near-duplicate of an earlier one and is left out of the reports.
+        strip_boilerplate (bool, optional): Report paragraphs repeated across pages
+            (footers, banners, navigation) only once.
+        resume (bool, optional): Continue from the last checkpoint of a crawl of the
+            same start URL, if any, instead of starting over.
+        workspace (Optional[JobWorkspace]): Where reports and attachments are
+            written. Defaults to the shared "temp" directory.
+        on_batch (Optional[Callable[[str], None]]): Called with the path of every
+            report batch of `REPORT_BATCH_BYTES` completed during the crawl, and of
+            the last, smaller ones once the crawl is over.
+        on_attachment (Optional[Callable[[str], None]]): Called with the path of
+            every new or changed attachment saved during the crawl.
+        on_progress (Optional[Callable[[dict], None]]): Called with the crawl
+            statistics so far, at most every `PROGRESS_SECONDS`.
+
+    Returns:
+        dict: Crawl statistics (`pages_visited`, `pages_new`, `pages_changed`,
+            `pages_unchanged`, `pages_duplicate`, `pages_failed`), the
+            `dedup_ratio`, the share of parsed pages dropped as near-duplicates, and
+            the `boilerplate_blocks_dropped` / `boilerplate_bytes_dropped`, the
+            `fetch_latency_p50_ms` / `fetch_latency_p99_ms` of the pages fetched by
+            this run, from request to response, and the `queue_wait_p50_ms` /
+            `queue_wait_p99_ms` they spent waiting for their host's rate limiter.
+    """
+    if not isinstance(concurrency, int) or concurrency <= 0:
+        raise ValueError("Concurrency must be a positive integer")
+
+    workspace = workspace or JobWorkspace.shared()
+    frontier = CrawlFrontier(normalization_rules)
+    crawl_key = canonicalize_url(start_url, normalization_rules)
+    base_domain = urlparse(crawl_key).netloc
+    store = CrawlStore()
+    duplicates = NearDuplicateIndex(similarity_threshold)
+    boilerplate = BoilerplateFilter() if strip_boilerplate else None
+    stats = {
+        "pages_visited": 0,
+        "pages_new": 0,
+        "pages_changed": 0,
+        "pages_unchanged": 0,
+        "pages_duplicate": 0,
+        "pages_failed": 0,
+    }
+    limiters = {}
+    attempts = {}
+    in_flight = {}
+    results = []
+    # Validators of the URLs fetched since they were last saved
+    validators = []
+    latencies = []
+    queue_waits = []
+    robots = None
+    crawl_delay = None
+
+    def save_validators():
+        store.save_pages(company_name, validators)
+        validators.clear()
+
+    def report_written(written: list, sealed: list):
+        validators.extend(written)
+        if sealed:
+            # Saved first, for the validators to be promoted once it is uploaded
+            save_validators()
+            for path in sealed:
+                if on_batch:
+                    on_batch(path)
+
+    def attachment_saved(path: str):
+        save_validators()
+        if on_attachment:
+            on_attachment(path)
+
+    writer = ReportWriter(
+        company_name,
+        workspace.markdown_dir,
+        report_written,
+        PageIndexWriter(company_name),
+    )
+
+    checkpoint = store.load_checkpoint(company_name, crawl_key) if resume else None
+    if checkpoint:
+        frontier = CrawlFrontier.restore(checkpoint["frontier"], normalization_rules)
+        attempts.update(checkpoint["attempts"])
+        stats.update(checkpoint["stats"])
+        for fingerprint in checkpoint["fingerprints"]:
+            duplicates.add(fingerprint)
+        if boilerplate:
+            boilerplate.restore(checkpoint["boilerplate"])
+        logger.info(
+            f"Resuming crawl of {start_url} with {len(frontier)} queued URLs: {stats}"
+        )
+    else:
+        store.clear_checkpoint(company_name, crawl_key, include_results=True)
+
+    def save_checkpoint():
+        snapshot = frontier.snapshot(tuple(in_flight.values()))
+        state = {
+            "frontier": snapshot,
+            "attempts": {
+                url: attempts[url] for url in snapshot["queue"] if url in attempts
+            },
+            "stats": stats,
+            "fingerprints": duplicates.fingerprints,
+            "boilerplate": boilerplate.snapshot() if boilerplate else "",
+        }
+        store.save_checkpoint(company_name, crawl_key, state, results)
+        results.clear()
+        save_validators()
+
+    def enqueue(url: str) -> bool:
+        key = frontier.canonicalize(url)
+        if urlparse(key).netloc != base_domain:
+            return False
+        if respect_robots and not robots.can_fetch(CRAWLER_USER_AGENT, url):
+            logger.debug(f"{url} is disallowed by robots.txt, skipping.")
+            return False
+        return frontier.add(url, key)
+
+    async def crawl_one(client: httpx.AsyncClient, url: str) -> tuple:
+        host = urlparse(url).netloc
+        if host not in limiters:
+            max_rate = DEFAULT_HOST_RATE
+            if crawl_delay and host == base_domain:
+                max_rate = min(max_rate, 1 / crawl_delay)
+            limiters[host] = HostRateLimiter(max_rate, max_connections_per_host)
+
+        key = frontier.canonicalize(url)
+        previous = store.get_page(company_name, key) if incremental else None
+        if attachment_extension(url):
+            result = await download_attachment(
+                client,
+                url,
+                limiters[host],
+                company_name,
+                validators,
+                key,
+                previous,
+                workspace.attachments_dir,
+                on_attachment=attachment_saved,
+            )
+            return result
+
+        started = time.perf_counter()
+        response = await fetch_url(
+            client, url, limiters[host], headers=conditional_headers(previous)
+        )
+        # The fetch is timed from the request being sent, the time spent waiting for
+        # the host's rate limiter before that is reported apart
+        fetch_seconds = response.elapsed.total_seconds()
+        latencies.append(fetch_seconds)
+        queue_waits.append(max(0.0, time.perf_counter() - started - fetch_seconds))
+        if response.status_code == 403:
+            return [], "failed"
+        if response.status_code == 304 and previous:
+            logger.info(f"{url} not modified since the previous crawl.")
+            return previous["links"], "unchanged"
+        return await process_response(
+            url, response, key, previous, duplicates, writer, validators, boilerplate
+        )
+
+    async def stop_in_flight():
+        for task in in_flight:
+            task.cancel()
+        if in_flight:
+            await asyncio.wait(in_flight.keys())
+
+    loop = asyncio.get_running_loop()
+    last_checkpoint = last_progress = loop.time()
+
+    try:
+        async with contextlib.AsyncExitStack() as stack:
+            client = await stack.enter_async_context(create_http_client(concurrency))
+            # Runs before the client closes, so no request outlives a cancelled crawl
+            stack.push_async_callback(stop_in_flight)
+            if respect_robots or use_sitemaps:
+                robots = await fetch_robots(client, start_url)
+            if respect_robots:
+                crawl_delay = robots.crawl_delay(CRAWLER_USER_AGENT)
+
+            # A resumed crawl already holds the seeds in its restored frontier
+            if not checkpoint:
+                if not enqueue(start_url):
+                    logger.warning(
+                        f"Start URL {start_url} is disallowed by robots.txt."
+                    )
+                if use_sitemaps:
+                    sitemap_urls = await discover_sitemap_urls(
+                        client, start_url, robots
+                    )
+                    seeded = sum(enqueue(url) for url in sitemap_urls)
+                    logger.info(f"Seeded the frontier with {seeded} sitemap URLs.")
+
+            while frontier.has_pending or in_flight:
+                next_due = frontier.release_due()
+                while frontier and len(in_flight) < concurrency:
+                    url = frontier.pop()
+                    if url not in attempts:
+                        if stats["pages_visited"] >= max_pages:
+                            continue
+                        stats["pages_visited"] += 1
+                        attempts[url] = 0
+                    in_flight[asyncio.create_task(crawl_one(client, url))] = url
+
+                if not in_flight:
+                    if next_due is None:
+                        break
+                    await asyncio.sleep(next_due)
+                    continue
+
+                done, _ = await asyncio.wait(
+                    in_flight.keys(),
+                    timeout=next_due,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    url = in_flight.pop(task)
+                    try:
+                        links, outcome = task.result()
+                    except RetryLater as e:
+                        attempts[url] += 1
+                        if attempts[url] >= max_retries:
+                            logger.error(
+                                f"Failed to fetch {url} after {max_retries} retries. Skipping."
+                            )
+                            stats["pages_failed"] += 1
+                            results.append((url, "failed"))
+                            continue
+                        backoff_time = e.retry_after or min(
+                            60, (2 ** attempts[url]) + random.uniform(0, 1)
+                        )
+                        logger.info(
+                            f"Retrying ({attempts[url]}/{max_retries}) for URL: {url} after {backoff_time:.2f} seconds: {e}"
+                        )
+                        frontier.defer(url, backoff_time)
+                        continue
+                    except Exception as e:
+                        logger.error(f"Unexpected error while processing {url}: {e}")
+                        stats["pages_failed"] += 1
+                        results.append((url, "failed"))
+                        continue
+
+                    if f"pages_{outcome}" in stats:
+                        stats[f"pages_{outcome}"] += 1
+                    results.append((url, outcome))
+
+                    new_urls = sum(enqueue(joined_url) for joined_url in links)
+                    logger.info(f"Found {new_urls} new URLs on {url}.")
+
+                if (
+                    len(results) >= CHECKPOINT_PAGES
+                    or loop.time() - last_checkpoint >= CHECKPOINT_SECONDS
+                ):
+                    save_checkpoint()
+                    last_checkpoint = loop.time()
+                if on_progress and loop.time() - last_progress >= PROGRESS_SECONDS:
+                    on_progress(dict(stats))
+                    last_progress = loop.time()
+
+        store.save_results(company_name, crawl_key, results)
+        store.clear_checkpoint(company_name, crawl_key)
+    except asyncio.CancelledError:
+        logger.info(f"Crawl of {start_url} cancelled, saving a final checkpoint.")
+        save_checkpoint()
+        raise
+    finally:
+        # The reports and pages of a crawl that did not complete are handed over
+        # as well
+        await writer.close()
+        save_validators()
+        store.close()
+
+    parsed_pages = sum(
+        stats[f"pages_{outcome}"]
+        for outcome in ("new", "changed", "unchanged", "duplicate")
+    )
+    stats["dedup_ratio"] = (
+        round(stats["pages_duplicate"] / parsed_pages, 4) if parsed_pages else 0.0
+    )
+    stats["boilerplate_blocks_dropped"] = (
+        boilerplate.blocks_dropped if boilerplate else 0
+    )
+    stats["boilerplate_bytes_dropped"] = boilerplate.bytes_dropped if boilerplate else 0
+    stats["fetch_latency_p50_ms"] = round(percentile(latencies, 50) * 1000, 1)
+    stats["fetch_latency_p99_ms"] = round(percentile(latencies, 99) * 1000, 1)
+    stats["queue_wait_p50_ms"] = round(percentile(queue_waits, 50) * 1000, 1)
+    stats["queue_wait_p99_ms"] = round(percentile(queue_waits, 99) * 1000, 1)
+    logger.info(f"Crawl of {start_url} finished: {stats}")
+    return stats
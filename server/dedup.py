@@ -0,0 +1,103 @@
+import hashlib
+import os
+import re
+from collections import Counter
+from typing import Optional
+
+SIMHASH_BITS = 64
+# Pages whose SimHash similarity (1 - hamming distance / 64) reaches this are duplicates
+DEFAULT_SIMILARITY_THRESHOLD = float(os.getenv("DEDUP_SIMILARITY_THRESHOLD", "0.95"))
+SHINGLE_SIZE = 3
+
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def simhash(text: str, shingle_size: int = SHINGLE_SIZE) -> Optional[int]:
+    """
+    Computes the 64-bit SimHash of a text over its word shingles.
+
+    Args:
+        text (str): Text to fingerprint.
+        shingle_size (int, optional): Number of consecutive words per shingle.
+
+    Returns:
+        Optional[int]: The fingerprint, or None if the text has no words.
+    """
+    words = WORD_PATTERN.findall(text.lower())
+    if not words:
+        return None
+
+    shingle_count = max(1, len(words) - shingle_size + 1)
+    shingles = Counter(
+        " ".join(words[i : i + shingle_size]) for i in range(shingle_count)
+    )
+
+    weights = [0] * SIMHASH_BITS
+    for shingle, count in shingles.items():
+        digest = hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "big")
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += count if value >> bit & 1 else -count
+
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+class NearDuplicateIndex:
+    """
+    Set of SimHash fingerprints answering "is there one within k bits of this?".
+
+    Fingerprints are split into k + 1 blocks; by the pigeonhole principle two
+    fingerprints at most k bits apart share at least one identical block, so only
+    fingerprints sharing a block have to be compared.
+    """
+
+    def __init__(self, similarity_threshold: float = DEFAULT_SIMILARITY_THRESHOLD):
+        if not 0.5 <= similarity_threshold <= 1:
+            raise ValueError("Similarity threshold must be between 0.5 and 1")
+
+        self.max_distance = int((1 - similarity_threshold) * SIMHASH_BITS)
+        block_count = self.max_distance + 1
+        block_size = SIMHASH_BITS // block_count
+        self.blocks = [
+            (i * block_size, (i + 1) * block_size) for i in range(block_count - 1)
+        ]
+        self.blocks.append(((block_count - 1) * block_size, SIMHASH_BITS))
+        self.buckets = {}
+        self.fingerprints = []
+
+    def block_keys(self, fingerprint: int) -> list:
+        return [
+            (start, fingerprint >> start & ((1 << (end - start)) - 1))
+            for start, end in self.blocks
+        ]
+
+    def find(self, fingerprint: int) -> Optional[int]:
+        """Return a stored fingerprint within the distance threshold, if any."""
+        for key in self.block_keys(fingerprint):
+            for candidate in self.buckets.get(key, ()):
+                if bin(candidate ^ fingerprint).count("1") <= self.max_distance:
+                    return candidate
+        return None
+
+    def add(self, fingerprint: int):
+        self.fingerprints.append(fingerprint)
+        for key in self.block_keys(fingerprint):
+            self.buckets.setdefault(key, []).append(fingerprint)
+
+    def is_duplicate(self, text: str) -> bool:
+        """
+        Checks a text against the index, adding it when it is not a near-duplicate.
+
+        Args:
+            text (str): Body text of a page.
+
+        Returns:
+            bool: True if a near-duplicate text was seen before.
+        """
+        fingerprint = simhash(text)
+        if fingerprint is None:
+            return False
+        if self.find(fingerprint) is not None:
+            return True
+        self.add(fingerprint)
+        return False
@@ -0,0 +1,217 @@
+import asyncio
+import os
+import zlib
+from datetime import datetime
+from typing import Optional
+from urllib.parse import urlsplit, urljoin
+from urllib.robotparser import RobotFileParser
+
+import httpx
+from lxml import etree
+
+from utils import logger
+
+# Name the crawler identifies with, both in requests and when matching robots.txt rules
+CRAWLER_USER_AGENT = os.getenv("CRAWLER_USER_AGENT", "ConvoAIBot")
+# Upper bounds protecting the crawl from huge or endlessly nested sitemap indexes
+MAX_SITEMAPS = int(os.getenv("CRAWL_MAX_SITEMAPS", "50"))
+MAX_SITEMAP_URLS = int(os.getenv("CRAWL_MAX_SITEMAP_URLS", "50000"))
+# Largest sitemap accepted, downloaded or once decompressed (the protocol allows 50 MB)
+MAX_SITEMAP_BYTES = int(os.getenv("CRAWL_MAX_SITEMAP_BYTES", str(50 * 1024 * 1024)))
+# Sitemaps fetched at the same time
+SITEMAP_CONCURRENCY = int(os.getenv("CRAWL_SITEMAP_CONCURRENCY", "8"))
+
+GZIP_MAGIC = b"\x1f\x8b"
+SITEMAP_PARSER = etree.XMLParser(
+    recover=True, resolve_entities=False, no_network=True, huge_tree=False
+)
+
+
+def site_root(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+async def fetch_robots(client: httpx.AsyncClient, url: str) -> RobotFileParser:
+    """
+    Fetches and parses the robots.txt of the site hosting `url`.
+
+    A missing or unreachable robots.txt allows everything, a 401/403 disallows
+    everything, mirroring `RobotFileParser.read`.
+
+    Args:
+        client (httpx.AsyncClient): Shared crawl client.
+        url (str): Any URL of the site.
+
+    Returns:
+        RobotFileParser: Parsed robots.txt rules.
+    """
+    robots = RobotFileParser(urljoin(site_root(url), "/robots.txt"))
+    try:
+        response = await client.get(robots.url, follow_redirects=True)
+    except httpx.HTTPError as e:
+        logger.info(f"Could not fetch {robots.url}, crawling without it: {e}")
+        robots.allow_all = True
+        return robots
+
+    if response.status_code in (401, 403):
+        robots.disallow_all = True
+    elif response.status_code >= 400:
+        robots.allow_all = True
+    else:
+        robots.parse(response.text.splitlines())
+        logger.info(f"Loaded robots.txt rules from {robots.url}")
+    return robots
+
+
+def parse_lastmod(value: Optional[str]) -> float:
+    if not value:
+        return 0.0
+    try:
+        return datetime.fromisoformat(value.strip()).timestamp()
+    except (ValueError, OverflowError, OSError):
+        return 0.0
+
+
+def parse_priority(value: Optional[str]) -> float:
+    try:
+        return float(value) if value else 0.5
+    except ValueError:
+        return 0.5
+
+
+def decompress_sitemap(content: bytes, max_bytes: int = MAX_SITEMAP_BYTES) -> bytes:
+    """
+    Gunzips a sitemap, refusing to inflate it past `max_bytes`.
+
+    Raises:
+        ValueError: If the decompressed sitemap is larger than `max_bytes`.
+        zlib.error: If the content is not valid gzip data.
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    content = decompressor.decompress(content, max_bytes)
+    if decompressor.unconsumed_tail:
+        raise ValueError(f"Decompressed sitemap exceeds {max_bytes} bytes")
+    return content
+
+
+def parse_sitemap(content: bytes) -> tuple:
+    """
+    Parses a sitemap or a sitemap index, plain or gzipped.
+
+    Args:
+        content (bytes): Body of the sitemap response.
+
+    Returns:
+        tuple: Nested sitemap URLs (for an index), and the page entries as dicts
+            with `url`, `lastmod` (timestamp) and `priority`.
+
+    Raises:
+        ValueError: If the gzipped sitemap inflates past `MAX_SITEMAP_BYTES`.
+    """
+    if content.startswith(GZIP_MAGIC):
+        content = decompress_sitemap(content)
+
+    root = etree.fromstring(content, parser=SITEMAP_PARSER)
+    if root is None:
+        return [], []
+
+    nested_sitemaps = []
+    entries = []
+    for element in root:
+        if not isinstance(element.tag, str):
+            continue
+        fields = {
+            etree.QName(child).localname: (child.text or "").strip()
+            for child in element
+            if isinstance(child.tag, str)
+        }
+        if not fields.get("loc"):
+            continue
+        if etree.QName(element).localname == "sitemap":
+            nested_sitemaps.append(fields["loc"])
+        else:
+            entries.append(
+                {
+                    "url": fields["loc"],
+                    "lastmod": parse_lastmod(fields.get("lastmod")),
+                    "priority": parse_priority(fields.get("priority")),
+                }
+            )
+    return nested_sitemaps, entries
+
+
+async def fetch_sitemap(client: httpx.AsyncClient, sitemap_url: str) -> tuple:
+    """Download and parse a sitemap, see `parse_sitemap`.
+
+    Raises:
+        ValueError: If the sitemap is larger than `MAX_SITEMAP_BYTES`.
+    """
+    async with client.stream("GET", sitemap_url, follow_redirects=True) as response:
+        response.raise_for_status()
+        content = bytearray()
+        async for chunk in response.aiter_bytes():
+            content.extend(chunk)
+            if len(content) > MAX_SITEMAP_BYTES:
+                raise ValueError(f"Sitemap exceeds {MAX_SITEMAP_BYTES} bytes")
+    return await asyncio.to_thread(parse_sitemap, bytes(content))
+
+
+async def discover_sitemap_urls(
+    client: httpx.AsyncClient, start_url: str, robots: RobotFileParser
+) -> list:
+    """
+    Collects the page URLs listed in the sitemaps of a site.
+
+    Sitemaps declared in robots.txt are used, falling back to /sitemap.xml. Sitemap
+    indexes are followed up to `MAX_SITEMAPS` sitemaps in total, each level of the
+    index fetched `SITEMAP_CONCURRENCY` sitemaps at a time.
+
+    Args:
+        client (httpx.AsyncClient): Shared crawl client.
+        start_url (str): Any URL of the site.
+        robots (RobotFileParser): Parsed robots.txt of the site.
+
+    Returns:
+        list: Page URLs, most important first (by `priority`, then `lastmod`).
+    """
+    pending = list(
+        robots.site_maps() or [urljoin(site_root(start_url), "/sitemap.xml")]
+    )
+    fetched = set()
+    entries = []
+    parallel_fetches = asyncio.Semaphore(SITEMAP_CONCURRENCY)
+
+    async def fetch(sitemap_url: str) -> Optional[tuple]:
+        async with parallel_fetches:
+            try:
+                return await fetch_sitemap(client, sitemap_url)
+            except (
+                httpx.HTTPError,
+                etree.XMLSyntaxError,
+                ValueError,
+                zlib.error,
+            ) as e:
+                logger.info(f"Skipping sitemap {sitemap_url}: {e}")
+                return None
+
+    while pending and len(fetched) < MAX_SITEMAPS and len(entries) < MAX_SITEMAP_URLS:
+        level = []
+        for sitemap_url in pending:
+            if sitemap_url not in fetched and len(fetched) < MAX_SITEMAPS:
+                fetched.add(sitemap_url)
+                level.append(sitemap_url)
+
+        pending = []
+        for sitemap_url, sitemap in zip(
+            level, await asyncio.gather(*(fetch(url) for url in level))
+        ):
+            if sitemap is None:
+                continue
+            nested_sitemaps, sitemap_entries = sitemap
+            pending.extend(nested_sitemaps)
+            entries.extend(sitemap_entries)
+            logger.info(f"Found {len(sitemap_entries)} URLs in sitemap {sitemap_url}")
+
+    entries.sort(key=lambda entry: (entry["priority"], entry["lastmod"]), reverse=True)
+    return [entry["url"] for entry in entries[:MAX_SITEMAP_URLS]]
@@ -0,0 +1,182 @@
+import heapq
+import itertools
+import time
+from collections import deque
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import posixpath
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# Query parameters that only track the visitor and never change the page content
+TRACKING_QUERY_PARAMS = [
+    "utm_source",
+    "utm_medium",
+    "utm_campaign",
+    "utm_term",
+    "utm_content",
+    "gclid",
+    "fbclid",
+]
+
+DEFAULT_NORMALIZATION_RULES = {
+    "lowercase_host": True,
+    "strip_fragment": True,
+    "strip_default_port": True,
+    "strip_trailing_slash": True,
+    "remove_dot_segments": True,
+    "sort_query": True,
+    "drop_query_params": TRACKING_QUERY_PARAMS,
+}
+
+
+def canonicalize_url(url: str, rules: Optional[dict] = None) -> str:
+    """
+    Reduces a URL to a canonical form so that variants of the same page compare equal.
+
+    Args:
+        url (str): Absolute URL to canonicalize.
+        rules (Optional[dict]): Normalization rules overriding
+            `DEFAULT_NORMALIZATION_RULES` key by key.
+
+    Returns:
+        str: The canonical URL.
+    """
+    rules = {**DEFAULT_NORMALIZATION_RULES, **(rules or {})}
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+
+    netloc = parts.netloc
+    if rules["lowercase_host"]:
+        netloc = netloc.lower()
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if rules["strip_default_port"] and port is not None:
+        if DEFAULT_PORTS.get(scheme) == port:
+            netloc = netloc.rsplit(":", 1)[0]
+
+    path = parts.path or "/"
+    if rules["remove_dot_segments"] and ("/." in path):
+        trailing = path.endswith("/")
+        path = posixpath.normpath(path)
+        if path.startswith("//"):
+            path = path[1:]
+        if trailing and path != "/":
+            path += "/"
+    if rules["strip_trailing_slash"] and path != "/":
+        path = path.rstrip("/") or "/"
+
+    query = parts.query
+    if query and (rules["sort_query"] or rules["drop_query_params"]):
+        params = [
+            (key, value)
+            for key, value in parse_qsl(query, keep_blank_values=True)
+            if key not in rules["drop_query_params"]
+        ]
+        if rules["sort_query"]:
+            params.sort()
+        query = urlencode(params)
+
+    fragment = "" if rules["strip_fragment"] else parts.fragment
+    return urlunsplit((scheme, netloc, path, query, fragment))
+
+
+class CrawlFrontier:
+    """
+    FIFO queue of URLs waiting to be crawled, de-duplicated on canonical URLs.
+
+    Every URL ever added is remembered in a seen-set keyed on its canonical form,
+    so enqueueing and membership checks are O(1) and variants of an already known
+    page (fragments, trailing slashes, default ports, reordered queries) are dropped.
+
+    URLs that have to be retried are deferred: they wait in a heap ordered by the
+    time they become due and rejoin the queue once that time has passed.
+    """
+
+    def __init__(self, normalization_rules: Optional[dict] = None):
+        self.normalization_rules = {
+            **DEFAULT_NORMALIZATION_RULES,
+            **(normalization_rules or {}),
+        }
+        self._queue = deque()
+        self._seen = set()
+        self._deferred = []
+        self._counter = itertools.count()
+
+    def canonicalize(self, url: str) -> str:
+        return canonicalize_url(url, self.normalization_rules)
+
+    def add(self, url: str, key: Optional[str] = None) -> bool:
+        """Enqueue a URL unless it (or a variant of it) was seen before.
+
+        Args:
+            url (str): Absolute URL to enqueue.
+            key (Optional[str]): Canonical form of the URL, if already computed.
+
+        Returns:
+            bool: True if the URL was enqueued.
+        """
+        key = key or self.canonicalize(url)
+        if key in self._seen:
+            return False
+        self._seen.add(key)
+        # Fragments never reach the server, everything else is fetched as linked
+        self._queue.append(urlsplit(url)._replace(fragment="").geturl())
+        return True
+
+    def pop(self) -> str:
+        """Remove and return the oldest queued URL."""
+        return self._queue.popleft()
+
+    def defer(self, url: str, delay: float):
+        """Re-queue an already seen URL once `delay` seconds have passed."""
+        heapq.heappush(
+            self._deferred, (time.monotonic() + delay, next(self._counter), url)
+        )
+
+    def release_due(self) -> Optional[float]:
+        """Move deferred URLs that are due into the queue.
+
+        Returns:
+            Optional[float]: Seconds until the next deferred URL is due, or None if
+                nothing is deferred anymore.
+        """
+        now = time.monotonic()
+        while self._deferred and self._deferred[0][0] <= now:
+            self._queue.append(heapq.heappop(self._deferred)[2])
+        if not self._deferred:
+            return None
+        return self._deferred[0][0] - now
+
+    def snapshot(self, in_flight: tuple = ()) -> dict:
+        """Serializable state of the frontier.
+
+        Args:
+            in_flight (tuple): URLs popped but not completed; they are queued first
+                when the frontier is restored.
+        """
+        deferred = [url for _, _, url in sorted(self._deferred)]
+        return {
+            "queue": [*in_flight, *deferred, *self._queue],
+            "seen": list(self._seen),
+        }
+
+    @classmethod
+    def restore(
+        cls, snapshot: dict, normalization_rules: Optional[dict] = None
+    ) -> "CrawlFrontier":
+        """Rebuild a frontier from `snapshot()`."""
+        frontier = cls(normalization_rules)
+        frontier._queue.extend(snapshot["queue"])
+        frontier._seen.update(snapshot["seen"])
+        return frontier
+
+    @property
+    def has_pending(self) -> bool:
+        """Whether URLs are queued or deferred."""
+        return bool(self._queue or self._deferred)
+
+    def __len__(self) -> int:
+        return len(self._queue)
@@ -5,44 +5,86 @@ from fastapi import (
     Response,
     Form,
     UploadFile,
-    BackgroundTasks,
     HTTPException,
     File,
     Body,
+    Header,
 )
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from utils import (
-    create_vector_store,
     create_assistant,
     validate_website,
-    scrap_website,
     process_stream_event,
-    scraping_status,
     session_manager,
-    upload_pdf_to_vector_store,
-    convert_docx_to_pdf,
-    convert_markdown_to_pdf,
-    convert_markdown_to_pdf_vs,
     delete_assistant_and_vs,
     fetch_or_upload_logo,
     logger,
     fetch_logo,
+    get_openai_client,
 )
-from openai import Client
+from conversion import converter
+from retrieval import RETRIEVAL_TOP_K, SearchHit, question_with_context, retrieval_for
+from page_search import page_search
+from office import OFFICE_EXTENSIONS
+from job_events import JobEventHub, SubscriberOverflow
+from job_queue import COMPLETED, FAILED, JobQueue
+from scrape_jobs import WORKER_JOBS, process_jobs
+from scrape_pool import ScrapeWorkerPool
 from dotenv import load_dotenv
 from pocketbase.client import ClientResponseError, FileUpload
 from typing import Optional, List
 from datetime import datetime
+from contextlib import asynccontextmanager
 import uvicorn
 import asyncio
 from queue import Queue
-from multiprocessing import Process, Queue
+import json
 import os
+import socket
+import time
 from pocketbase.client import FileUpload
 from pydantic import BaseModel
 
 load_dotenv()
-app = FastAPI()
+
+job_queue = JobQueue()
+# Whether the API process also runs scraping jobs, next to any `worker.py`
+EMBEDDED_SCRAPE_WORKER = os.getenv("EMBEDDED_SCRAPE_WORKER", "true").lower() == "true"
+job_wakeup = asyncio.Event()
+job_events = JobEventHub(job_queue)
+# Seconds of silence after which an event stream gets a keep-alive comment
+SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
+# Best matching scraped pages added to the question sent to the assistant, 0 for none
+ASK_SEARCH_PAGES = int(os.getenv("ASK_SEARCH_PAGES", "3"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if not EMBEDDED_SCRAPE_WORKER:
+        yield
+        await ai.close()
+        return
+
+    # Warm the scrape workers up before the first request needs them
+    scrape_pool = ScrapeWorkerPool()
+    scrape_pool.start()
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-api"
+    workers = [
+        asyncio.create_task(
+            process_jobs(job_queue, scrape_pool, f"{worker_id}-{slot}", job_wakeup)
+        )
+        for slot in range(WORKER_JOBS)
+    ]
+    yield
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    await scrape_pool.shutdown()
+    await ai.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # ? Creating Temporary Folders
 markdown_folder = os.path.join(os.getcwd(), "temp", "markdown")
@@ -55,8 +97,7 @@ os.makedirs(converted_pdfs_folder, exist_ok=True)
 # ?
 
 
-ai = Client()
-total_scraped_companies = 0
+ai = get_openai_client()
 
 origins = [
     "http://localhost:5173",
@@ -71,171 +112,34 @@ app.add_middleware(
 )
 
 
-def scrap_website_process(url, company_name, result_queue):
-    try:
-
-        start_time = datetime.now()
-        logger.info(f"Started scraping {url} for {company_name} at {start_time}")
-
-        scrap_website(url, company_name)
-
-        end_time = datetime.now()
-        time_taken = (end_time - start_time).total_seconds()
-        logger.info(
-            f"Completed scraping {url} for {company_name} at {end_time}, time taken: {time_taken} seconds"
-        )
-
-        result_queue.put(("Completed", time_taken))
-    except Exception as e:
-        logger.error(f"Error scraping {url} for {company_name}: {e}")
-        result_queue.put((f"Failed: {str(e)}", None))
-
-
-async def run_scraping_task(
-    company_name: str, websites: list[str], vector_store_id: str, timeout_seconds: int
-):
-    global total_scraped_companies
-    total_scraped_companies = 0
-    scraping_status[company_name] = {}
-    logger.info(f"Starting Scraping Session with Timeout at {timeout_seconds} seconds")
-
-    for url in websites:
-        start_time = datetime.now()
-        logger.info(f"Task started for {url} at {start_time}")
-
-        try:
-            scraping_status[company_name][url] = {
-                "status": "In Progress",
-                "start_time": start_time,
-                "elapsed": 0,
-            }
-
-            result_queue = Queue()
-            process = Process(
-                target=scrap_website_process, args=(url, company_name, result_queue)
-            )
-            process.start()
-
-            for _ in range(timeout_seconds):
-                if process.is_alive():
-                    await asyncio.sleep(1)
-                else:
-                    break
-            else:
-                if process.is_alive():
-                    logger.info(
-                        f"Attempting to terminate process with PID {process.pid}"
-                    )
-                    process.terminate()
-                    process.join(timeout=1)
-
-                if process.is_alive():
-                    logger.info(f"Force killing process with PID {process.pid}")
-                    process.kill()
-
-                scraping_status[company_name][url]["status"] = "Timed Out"
-                total_scraped_companies += 1
-                end_time = datetime.now()
-                scraping_status[company_name][url]["end_time"] = end_time
-                time_taken = (end_time - start_time).total_seconds()
-                scraping_status[company_name][url]["elapsed"] = time_taken
-                logger.info(
-                    f"Scraping {url} for {company_name} timed out after {timeout_seconds} seconds"
-                )
-
-            process.join()
-            if not result_queue.empty():
-                result, child_time_taken = result_queue.get()
-                if result == "Completed":
-                    scraping_status[company_name][url]["status"] = "Completed"
-                    total_scraped_companies += 1
-                    time_taken = (
-                        child_time_taken
-                        if child_time_taken is not None
-                        else (datetime.now() - start_time).total_seconds()
-                    )
-                    scraping_status[company_name][url]["elapsed"] = time_taken
-                    logger.info(
-                        f"Scraping {url} for {company_name} completed in {time_taken} seconds"
-                    )
-                else:
-                    scraping_status[company_name][url]["status"] = result
-                    time_taken = (datetime.now() - start_time).total_seconds()
-                    scraping_status[company_name][url]["elapsed"] = time_taken
-                    logger.error(
-                        f"Scraping {url} for {company_name} failed after {time_taken} seconds: {result}"
-                    )
-            else:
-                scraping_status[company_name][url]["status"] = "Failed: No result"
-                time_taken = (datetime.now() - start_time).total_seconds()
-                scraping_status[company_name][url]["elapsed"] = time_taken
-                logger.error(
-                    f"Scraping {url} for {company_name} failed with no result after {time_taken} seconds"
-                )
-        except Exception as e:
-            scraping_status[company_name][url]["status"] = f"Failed: {str(e)}"
-            time_taken = (datetime.now() - start_time).total_seconds()
-            scraping_status[company_name][url]["elapsed"] = time_taken
-            logger.error(f"Error in task for {url} for {company_name}: {e}")
-        finally:
-            if "elapsed" not in scraping_status[company_name][url]:
-                time_taken = (datetime.now() - start_time).total_seconds()
-                scraping_status[company_name][url]["elapsed"] = time_taken
-                logger.info(
-                    f"Task for {url} for {company_name} finished, time taken: {time_taken} seconds"
-                )
-
-    logger.info("Starting conversion of parsed report from markdown to PDF")
-    input_dir = os.path.join("temp", "markdown")
-    scraped_pdfs_to_upload = []
-    for filename in os.listdir(input_dir):
-        if filename.endswith(".md"):
-            input_path = os.path.join(input_dir, filename)
-            pdf_path = convert_markdown_to_pdf(input_path)
-            scraped_pdfs_to_upload.append(pdf_path)
-
-    if len(scraped_pdfs_to_upload) != 0:
-        logger.info(
-            f"Conversion of report completed and uploaded to vector store with id {vector_store_id}"
-        )
-        upload_pdf_to_vector_store(ai, vector_store_id, scraped_pdfs_to_upload)
-        logger.info(f"Removing Markdown file generated for {company_name}")
-    else:
-        logger.info(
-            f"No PDF found from scrapped session, something went wrong.... Skipping upload"
-        )
-
-    for filename in os.listdir(input_dir):
-        if filename.endswith(".md"):
-            input_path = os.path.join(input_dir, filename)
-            try:
-                os.remove(input_path)
-            except OSError:
-                logger.info("File not found for deletion, skipping...")
-                pass
+async def process_files(file_paths: list[str]) -> list[str]:
+    """Process files and return converted PDF paths.
 
-
-def process_files(file_paths: list[str]) -> list[str]:
-    """Process files and return converted PDF paths."""
-    pdf_files = []
+    Conversions run concurrently on the shared conversion process pool, and files
+    converted before are taken from the conversion cache.
+    """
+    conversions = []
     for path in file_paths:
-        filename = os.path.splitext(os.path.basename(path))[0] + ".pdf"
-        pdf_path = os.path.join(converted_pdfs_folder, filename)
         if path.endswith(".pdf"):
-            pdf_files.append(path)
-        elif path.endswith(".docx"):
-            convert_docx_to_pdf(path, pdf_path)
-            pdf_files.append(pdf_path)
+            conversions.append(asyncio.sleep(0, path))
+        elif path.rsplit(".", 1)[-1].lower() in OFFICE_EXTENSIONS:
+            conversions.append(
+                asyncio.to_thread(
+                    converter.convert, "office_pdf", path, converted_pdfs_folder
+                )
+            )
         elif path.endswith(".md"):
-            convert_markdown_to_pdf_vs(path)
-            pdf_files.append(pdf_path)
-    return pdf_files
+            conversions.append(
+                asyncio.to_thread(
+                    converter.convert, "markdown_pdf", path, converted_pdfs_folder
+                )
+            )
+    return list(await asyncio.gather(*conversions))
 
 
 @app.post("/scrap")
 async def scrap(
     response: Response,
-    background_tasks: BackgroundTasks,
     company_name: str = Form(...),
     company_url: Optional[str] = Form(None),
     instructions: Optional[str] = Form(""),
@@ -283,8 +187,8 @@ async def scrap(
         f"Creating vector store and assistant id for new company: {company_name}"
     )
 
-    vector_store_id = create_vector_store(client=ai, company_name=company_name)
-    assistant_id = create_assistant(
+    vector_store_id = await retrieval_for().create_store(company_name)
+    assistant_id = await create_assistant(
         client=ai,
         vector_store_id=vector_store_id,
         company_name=company_name,
@@ -292,10 +196,10 @@ async def scrap(
     )
 
     logger.info("Converting attachments to PDF format")
-    pdf_files = process_files(pdf_files)
+    pdf_files = await process_files(pdf_files)
     if len(pdf_files) != 0:
         logger.info(f"Uploading attachments to vector store to ID {vector_store_id}")
-        upload_pdf_to_vector_store(ai, vector_store_id, pdf_files)
+        await retrieval_for(vector_store_id).add_files(vector_store_id, pdf_files)
     else:
         logger.info("No attachments found! Skipping upload step")
 
@@ -327,22 +231,18 @@ async def scrap(
         if additional_websites:
             websites_to_scrape.extend(additional_websites.split(","))
 
-        scraping_status[company_name] = {}
-
-        for url in websites_to_scrape:
-            scraping_status[company_name][url] = {
-                "status": "Pending",
-                "elapsed": 0,
-            }
-
-        logger.info("Starting Scraping task on background thread")
-        background_tasks.add_task(
-            run_scraping_task,
+        logger.info("Queueing scraping job")
+        await asyncio.to_thread(
+            job_queue.enqueue,
             company_name,
+            {
+                "websites": websites_to_scrape,
+                "vector_store_id": vector_store_id,
+                "timeout_seconds": timeout_seconds,
+            },
             websites_to_scrape,
-            vector_store_id,
-            timeout_seconds,
         )
+        job_wakeup.set()
         logger.info("Sending scraping begun response to client")
 
         response.status_code = status.HTTP_201_CREATED
@@ -365,44 +265,190 @@ async def scrap(
         return {"error": f"An unexpected error occurred: {str(e)}"}
 
 
-@app.get("/scraping_status/{company_name}")
-async def get_scraping_status(company_name: str):
-    status = scraping_status.get(company_name)
-    if status is None:
-        return {"status": "Not Found", "company_name": company_name}
+@app.post("/refresh/{company_name}")
+async def refresh(
+    company_name: str,
+    response: Response,
+    timeout_seconds: Optional[int] = Form(60),
+    resume: Optional[bool] = Form(False),
+):
+    """Re-crawl the websites of an already scraped company, uploading only new or
+    changed pages and attachments to its vector store. With `resume`, crawls cut
+    short by the timeout of a previous run continue from their last checkpoint."""
+    company_name = company_name.lower().strip().replace(" ", "_")
+    try:
+        company = db.collection("companies").get_first_list_item(
+            f"company_name='{company_name}'"
+        )
+    except ClientResponseError:
+        response.status_code = status.HTTP_404_NOT_FOUND
+        return {"message": "Requested company not found!"}
+
+    websites_to_refresh = []
+    if company.company_url:
+        websites_to_refresh.append(company.company_url)
+    if company.additional_websites:
+        websites_to_refresh.extend(company.additional_websites.split(","))
+
+    if not websites_to_refresh:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {"message": "This company has no website to refresh"}
+
+    logger.info(f"Queueing incremental refresh of {company_name}")
+    await asyncio.to_thread(
+        job_queue.enqueue,
+        company_name,
+        {
+            "websites": websites_to_refresh,
+            "vector_store_id": company.vector_store_id,
+            "timeout_seconds": timeout_seconds,
+            "incremental": True,
+            "resume": resume,
+        },
+        websites_to_refresh,
+    )
+    job_wakeup.set()
+
+    response.status_code = status.HTTP_202_ACCEPTED
+    return {"message": "Refresh started", "company_name": company_name}
 
-    response_data = {"total_scraped": total_scraped_companies, "companies": {}}
+
+def scraping_status(job: dict) -> dict:
+    """Summarize a job returned by `JobQueue.latest_job` for the client."""
+    response_data = {"total_scraped": 0, "companies": {}}
 
     overall_elapsed = 0
-    all_completed = True
+    pages_fetched = 0
 
-    for url, status_data in status.items():
+    for url, status_data in job["urls"].items():
 
         if status_data["status"] == "In Progress":
             status_data["elapsed"] = (
-                datetime.now() - status_data["start_time"]
+                datetime.now() - datetime.fromisoformat(status_data["start_time"])
             ).total_seconds()
-            all_completed = False
+        elif status_data["status"] in ("Completed", "Timed Out"):
+            response_data["total_scraped"] += 1
 
         response_data["companies"][url] = {
             "status": status_data["status"],
-            "start_time": status_data["start_time"].isoformat(),
+            "start_time": status_data["start_time"],
             "elapsed": status_data["elapsed"],
         }
 
-        if "end_time" in status_data:
-            response_data["companies"][url]["end_time"] = status_data[
-                "end_time"
-            ].isoformat()
+        if status_data["end_time"]:
+            response_data["companies"][url]["end_time"] = status_data["end_time"]
+
+        if status_data["stats"]:
+            response_data["companies"][url]["stats"] = status_data["stats"]
+            response_data["companies"][url]["dedup_ratio"] = status_data["stats"].get(
+                "dedup_ratio"
+            )
+            pages_fetched += status_data["stats"]["pages_visited"]
 
         overall_elapsed += status_data["elapsed"]
 
-    response_data["status"] = "Completed" if all_completed else "In Progress"
+    # Queued and running jobs, including failed attempts waiting for a retry, are
+    # in progress
+    response_data["status"] = {COMPLETED: "Completed", FAILED: "Failed"}.get(
+        job["status"], "In Progress"
+    )
+    response_data["job"] = {
+        "id": job["id"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "error": job["error"],
+    }
+    response_data["progress"] = {"pages_fetched": pages_fetched, **job["progress"]}
     response_data["overall_elapsed"] = overall_elapsed
 
     return response_data
 
 
+@app.get("/scraping_status/{company_name}")
+async def get_scraping_status(company_name: str):
+    job = await asyncio.to_thread(job_queue.latest_job, company_name)
+    if job is None:
+        return {"status": "Not Found", "company_name": company_name}
+    return scraping_status(job)
+
+
+@app.get("/scraping_events/{company_name}")
+async def stream_scraping_events(
+    company_name: str, last_event_id: Optional[int] = Header(None)
+):
+    """
+    Streams the progress of a company's scraping jobs as server-sent events.
+
+    A new stream starts with a `snapshot` event holding the `/scraping_status`
+    payload. It is followed by `job` (job state), `url` (status and crawl
+    statistics of a website) and `progress` (reports written, converted and
+    uploaded) events as they happen. Browsers reconnect with the `Last-Event-ID`
+    header and get the events they missed.
+    """
+
+    async def events():
+        stream = job_events.subscribe(company_name, last_event_id)
+        # Not cancelled by the keep-alive timeout, which would close the stream
+        pending = None
+        try:
+            while True:
+                pending = pending or asyncio.ensure_future(anext(stream))
+                done, _ = await asyncio.wait({pending}, timeout=SSE_KEEPALIVE_SECONDS)
+                if not done:
+                    # Keeps proxies from closing an idle stream
+                    yield ": keep-alive\n\n"
+                    continue
+                try:
+                    event = pending.result()
+                except (StopAsyncIteration, SubscriberOverflow):
+                    pending = None
+                    return
+                pending = None
+
+                data = event.get("data", {})
+                if event["kind"] == "snapshot":
+                    job = await asyncio.to_thread(job_queue.latest_job, company_name)
+                    data = (
+                        scraping_status(job)
+                        if job
+                        else {"status": "Not Found", "company_name": company_name}
+                    )
+                else:
+                    data = {"job_id": event["job_id"], **data}
+                yield f"id: {event['id']}\nevent: {event['kind']}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            if pending:
+                pending.cancel()
+                await asyncio.gather(pending, return_exceptions=True)
+            await stream.aclose()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/search/{company_name}")
+async def search_pages(company_name: str, q: str, k: int = 10):
+    company_name = company_name.lower().strip().replace(" ", "_")
+    start = time.perf_counter()
+    results = await asyncio.to_thread(page_search.search, company_name, q, k)
+    return {
+        "query": q,
+        "results": [
+            {
+                "url": result.url,
+                "title": result.title,
+                "score": result.score,
+                "snippet": result.snippet,
+            }
+            for result in results
+        ],
+        "took_ms": round((time.perf_counter() - start) * 1000, 2),
+    }
+
+
 @app.get("/companies/{company_name}")
 async def get_company(company_name: str):
     try:
@@ -433,7 +479,10 @@ async def delete_company(company_name: str):
 
         if company:
             # Delete the assistant and vector store associated with the company
-            delete_assistant_and_vs(ai, company.assistant_id, company.vector_store_id)
+            await delete_assistant_and_vs(
+                ai, company.assistant_id, company.vector_store_id
+            )
+            page_search.delete(company_name)
 
             # Now delete the company from the database
             db.collection("companies").delete(company.id)
@@ -523,62 +572,170 @@ async def edit_company(
         raise HTTPException(status_code=500, detail=f"Error updating company: {str(e)}")
 
 
+async def open_session(company_name: str, persona: str) -> dict:
+    """Assistant, vector store and thread of a persona of a company, created on first use."""
+    key = f"{company_name}<SEP>{persona}"
+    if key not in session_manager:
+        company = db.collection("companies").get_first_list_item(
+            f"company_name='{company_name}'"
+        )
+        session_manager[key] = {
+            "assistant_id": company.assistant_id,
+            "vector_store_id": company.vector_store_id,
+            "thread_id": (await ai.beta.threads.create()).id,
+        }
+    return session_manager[key]
+
+
+async def start_run(company_name: str, session: dict, prompt: str):
+    """
+    Post a question to the thread of a session, with the excerpts found for it,
+    and start the streamed run of the assistant answering it.
+    """
+    hits = []
+    vector_store_id = session["vector_store_id"]
+    retrieval = retrieval_for(vector_store_id)
+    if retrieval.searchable:
+        hits += await retrieval.search(vector_store_id, prompt, RETRIEVAL_TOP_K)
+    if ASK_SEARCH_PAGES:
+        pages = await asyncio.to_thread(
+            page_search.search, company_name, prompt, ASK_SEARCH_PAGES
+        )
+        hits += [SearchHit(page.score, page.url, page.snippet) for page in pages]
+    content = question_with_context(prompt, hits)
+
+    await ai.beta.threads.messages.create(
+        thread_id=session["thread_id"], role="user", content=content
+    )
+    return await ai.beta.threads.runs.create(
+        thread_id=session["thread_id"],
+        assistant_id=session["assistant_id"],
+        stream=True,
+    )
+
+
+def log_answer(answer: str, start: float, first_text: Optional[float]):
+    ttft = f"{(first_text - start) * 1000:.0f} ms" if first_text else "no text"
+    logger.info(
+        f"Generated Answer: {answer}\nTime to first token : {ttft},"
+        f" total : {(time.perf_counter() - start) * 1000:.0f} ms"
+    )
+
+
 @app.post("/ask")
 async def ask_query(
     company_name: str = Body(...), persona: str = Body(...), prompt: str = Body(...)
 ):
+    start = time.perf_counter()
     logger.info(
         f"\nQuestion : {prompt}\nCompany Name : {company_name}\nPersona : {persona}\n\n"
     )
     company_name = company_name.strip().lower().replace(" ", "_")
-    key = f"{company_name}<SEP>{persona}"
-    if key in session_manager:
-        value = session_manager[key]
-        assistant_id = value["assistant_id"]
-        thread_id = value["thread_id"]
-        vector_store_id = value["vector_store_id"]
-
-    else:
-        try:
-            company = db.collection("companies").get_first_list_item(
-                f"company_name='{company_name}'"
-            )
-            assistant_id = company.assistant_id
-            vector_store_id = company.vector_store_id
-            thread_id = ai.beta.threads.create().id
-            session_manager[key] = {
-                "assistant_id": assistant_id,
-                "vector_store_id": vector_store_id,
-                "thread_id": thread_id,
-            }
-        except Exception as e:
-            return {"message": "Requested company not found!", "error": e}
+    try:
+        session = await open_session(company_name, persona)
+    except Exception as e:
+        return {"message": "Requested company not found!", "error": e}
 
     try:
         sentence_queue = Queue()
         buffer_dict = {"buffer": ""}
-
-        ai.beta.threads.messages.create(
-            thread_id=thread_id, role="user", content=prompt
-        )
-
         assistant_reply_parts = []
-        run = ai.beta.threads.runs.create(
-            thread_id=thread_id, assistant_id=assistant_id, stream=True
-        )
+        first_text = None
+        run = await start_run(company_name, session, prompt)
 
-        for event in run:
+        async for event in run:
             process_stream_event(
                 event, assistant_reply_parts, sentence_queue, buffer_dict
             )
+            if first_text is None and assistant_reply_parts:
+                first_text = time.perf_counter()
 
         assistant_reply = "".join(assistant_reply_parts)
-        logger.info(f"Generated Answer: {assistant_reply}")
+        log_answer(assistant_reply, start, first_text)
         return {"answer": assistant_reply}
 
     except Exception as e:
         return {"message": "Something went wrong while generating response", "error": e}
 
 
+@app.post("/ask/stream")
+async def ask_query_stream(
+    company_name: str = Body(...),
+    persona: str = Body(...),
+    prompt: str = Body(...),
+    unit: str = Body("delta"),
+):
+    """
+    Streams the answer to a question as server-sent events while it is generated.
+
+    With `unit` "delta" the answer comes in `delta` events holding the text as the
+    assistant writes it, citation marks removed; with "sentence" it comes in
+    `sentence` events holding whole sentences. A `done` event with the full
+    `answer` ends the stream, or an `error` event when the run fails.
+    """
+    start = time.perf_counter()
+    logger.info(
+        f"\nQuestion : {prompt}\nCompany Name : {company_name}\nPersona : {persona}\n\n"
+    )
+    if unit not in ("delta", "sentence"):
+        raise HTTPException(status_code=422, detail="unit must be delta or sentence")
+    company_name = company_name.strip().lower().replace(" ", "_")
+    try:
+        session = await open_session(company_name, persona)
+    except Exception as e:
+        return {"message": "Requested company not found!", "error": e}
+
+    def event(kind: str, data: dict) -> str:
+        return f"event: {kind}\ndata: {json.dumps(data)}\n\n"
+
+    async def events():
+        sentence_queue = Queue()
+        buffer_dict = {"buffer": ""}
+        assistant_reply_parts = []
+        first_text = None
+        run = None
+        try:
+            run = await start_run(company_name, session, prompt)
+            async for stream_event in run:
+                parts = len(assistant_reply_parts)
+                process_stream_event(
+                    stream_event, assistant_reply_parts, sentence_queue, buffer_dict
+                )
+                if first_text is None and assistant_reply_parts:
+                    first_text = time.perf_counter()
+                if unit == "delta":
+                    for part in assistant_reply_parts[parts:]:
+                        yield event("delta", {"text": part})
+                else:
+                    while not sentence_queue.empty():
+                        yield event("sentence", {"text": sentence_queue.get()})
+            if unit == "sentence" and buffer_dict["buffer"].strip():
+                # Last words of an answer not ending with a punctuation mark
+                yield event("sentence", {"text": buffer_dict["buffer"].strip()})
+
+            assistant_reply = "".join(assistant_reply_parts)
+            log_answer(assistant_reply, start, first_text)
+            yield event("done", {"answer": assistant_reply})
+        except Exception as e:
+            logger.error(f"Streaming the answer to {prompt!r} failed: {e}")
+            yield event(
+                "error",
+                {
+                    "message": "Something went wrong while generating response",
+                    "error": str(e),
+                },
+            )
+        finally:
+            # Stops the run's stream when the client goes away before the end
+            if run is not None:
+                await run.close()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 if __name__ == "__main__":
     uvicorn.run("index:app", port=8000, host="0.0.0.0")
@@ -0,0 +1,123 @@
+import asyncio
+import os
+from typing import AsyncIterator, Optional
+
+from job_queue import JobQueue
+from utils import logger
+
+# Seconds between two reads of the job events while someone is watching
+EVENT_POLL_SECONDS = float(os.getenv("JOB_EVENT_POLL_SECONDS", "0.5"))
+# Events buffered for a slow watcher before its stream is closed
+SUBSCRIBER_BUFFER = int(os.getenv("JOB_EVENT_SUBSCRIBER_BUFFER", "1000"))
+
+
+class SubscriberOverflow(Exception):
+    """The watcher fell too far behind, it should reconnect from its last event."""
+
+
+class Subscriber:
+    """Events of a company waiting to be streamed to one watcher."""
+
+    def __init__(self, company_name: str):
+        self.company_name = company_name
+        self.events = asyncio.Queue(maxsize=SUBSCRIBER_BUFFER)
+        # Set once an event did not fit, the stream ends after the buffered ones
+        self.overflowed = False
+
+
+class JobEventHub:
+    """
+    Fans the progress events of the job queue out to the streams watching them.
+
+    Jobs may run in this process or in standalone workers, so events are read back
+    from the shared queue database. A single task tails it for the whole process,
+    and only while at least one stream is open, however many operators watch.
+    """
+
+    def __init__(self, queue: JobQueue, poll_seconds: float = EVENT_POLL_SECONDS):
+        self.queue = queue
+        self.poll_seconds = poll_seconds
+        self.subscribers: set[Subscriber] = set()
+        self.cursor = 0
+        self.tail_task: Optional[asyncio.Task] = None
+        # Held while reading the cursor the tail starts from
+        self.starting = asyncio.Lock()
+
+    async def subscribe(
+        self, company_name: str, last_event_id: Optional[int] = None
+    ) -> AsyncIterator[dict]:
+        """
+        Yields the events of a company's jobs as they are recorded.
+
+        Args:
+            company_name (str): Company whose jobs are watched.
+            last_event_id (Optional[int]): Last event received before a reconnect,
+                the events recorded since are replayed first. When None, the
+                stream starts with a `snapshot` event holding the id to resume from.
+
+        Yields:
+            dict: Events as returned by `JobQueue.events_since`.
+
+        Raises:
+            SubscriberOverflow: If the watcher did not keep up with its events.
+        """
+        async with self.starting:
+            if self.tail_task is None:
+                self.cursor = await asyncio.to_thread(self.queue.last_event_id)
+                self.tail_task = asyncio.create_task(self.tail())
+
+        subscriber = Subscriber(company_name)
+        self.subscribers.add(subscriber)
+        # Everything after `cursor` reaches `events`, the rest is replayed
+        cursor = self.cursor
+        try:
+            if last_event_id is None:
+                yield {"id": cursor, "kind": "snapshot", "company_name": company_name}
+            else:
+                while last_event_id < cursor:
+                    replayed = await asyncio.to_thread(
+                        self.queue.events_since, last_event_id
+                    )
+                    for event in replayed:
+                        if event["id"] > cursor:
+                            break
+                        if event["company_name"] == company_name:
+                            yield event
+                    last_event_id = replayed[-1]["id"] if replayed else cursor
+
+            while True:
+                if subscriber.overflowed and subscriber.events.empty():
+                    raise SubscriberOverflow(
+                        f"Event stream of {company_name} fell behind, closing it"
+                    )
+                yield await subscriber.events.get()
+        finally:
+            self.subscribers.discard(subscriber)
+            if not self.subscribers and self.tail_task:
+                self.tail_task.cancel()
+                self.tail_task = None
+
+    async def tail(self):
+        while True:
+            try:
+                for event in await asyncio.to_thread(
+                    self.queue.events_since, self.cursor
+                ):
+                    self.cursor = event["id"]
+                    self.publish(event)
+            except Exception as e:
+                logger.error(f"Error reading job events: {e}")
+            await asyncio.sleep(self.poll_seconds)
+
+    def publish(self, event: dict):
+        for subscriber in self.subscribers:
+            if (
+                subscriber.overflowed
+                or subscriber.company_name != event["company_name"]
+            ):
+                continue
+            if subscriber.events.full():
+                # Ends the stream, the client reconnects with its last event id
+                subscriber.overflowed = True
+                continue
+            subscriber.events.put_nowait(event)
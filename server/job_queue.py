@@ -0,0 +1,439 @@
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional
+
+DEFAULT_JOB_DB = os.getenv(
+    "JOB_QUEUE_DB", os.path.join(os.getcwd(), "state", "jobs.sqlite3")
+)
+# A claimed job goes back to the queue if its worker stops renewing the lease
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Delay before a failed job is retried, multiplied by the attempts made so far
+JOB_RETRY_DELAY_SECONDS = float(os.getenv("JOB_RETRY_DELAY_SECONDS", "30"))
+# Progress events older than this are dropped when a new job is queued
+JOB_EVENTS_RETENTION_SECONDS = float(
+    os.getenv("JOB_EVENTS_RETENTION_SECONDS", str(24 * 3600))
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    company_name TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    available_at REAL NOT NULL,
+    lease_owner TEXT,
+    lease_expires REAL,
+    error TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, available_at);
+CREATE INDEX IF NOT EXISTS jobs_by_company ON jobs (company_name, created_at);
+CREATE TABLE IF NOT EXISTS job_urls (
+    job_id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    start_time TEXT,
+    end_time TEXT,
+    elapsed REAL NOT NULL DEFAULT 0,
+    stats TEXT,
+    PRIMARY KEY (job_id, url)
+);
+CREATE TABLE IF NOT EXISTS job_progress (
+    job_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (job_id, stage)
+);
+CREATE TABLE IF NOT EXISTS job_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    company_name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS job_events_by_time ON job_events (created_at);
+"""
+
+# Job states; queued and running jobs are still in progress
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+def locked(method):
+    """Run a `JobQueue` method holding the lock of its connection."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+class JobQueue:
+    """
+    Durable queue of scraping jobs and the per-URL status of each job.
+
+    Backed by a SQLite database shared by the API and any number of worker
+    processes. A worker claims a job with a lease and keeps renewing it while the
+    job runs; a job whose lease expires, because its worker crashed or was
+    restarted, is claimed again by another worker until it runs out of attempts.
+
+    Every method may block on the database write lock for up to 30 seconds, so the
+    event loop calls them with `asyncio.to_thread`; they hold a lock of their own
+    so that the threads take turns on the connection.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or DEFAULT_JOB_DB
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Used by one thread at a time, the one holding `lock`
+        self.connection = sqlite3.connect(
+            self.path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self.lock = threading.RLock()
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    @locked
+    def enqueue(
+        self,
+        company_name: str,
+        payload: dict,
+        urls: list[str],
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+    ) -> str:
+        """Add a scraping job, its URLs starting out as "Pending".
+
+        Args:
+            company_name (str): Company the job scrapes.
+            payload (dict): JSON serializable arguments of the job.
+            urls (list[str]): Websites the job scrapes, reported by `latest_job`.
+            max_attempts (int, optional): Claims allowed before the job fails.
+
+        Returns:
+            str: Id of the new job.
+        """
+        job_id = uuid.uuid4().hex
+        now = datetime.now().isoformat()
+        with self.transaction():
+            self.connection.execute(
+                "DELETE FROM job_events WHERE created_at < ?",
+                (time.time() - JOB_EVENTS_RETENTION_SECONDS,),
+            )
+            self.connection.execute(
+                "INSERT INTO jobs (id, company_name, payload, status, max_attempts,"
+                " available_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job_id,
+                    company_name,
+                    json.dumps(payload),
+                    QUEUED,
+                    max_attempts,
+                    time.time(),
+                    now,
+                    now,
+                ),
+            )
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO job_urls (job_id, url, position, status)"
+                " VALUES (?, ?, ?, 'Pending')",
+                [(job_id, url, position) for position, url in enumerate(urls)],
+            )
+            self.add_event(job_id, "job", {"status": QUEUED, "urls": urls})
+        return job_id
+
+    @locked
+    def claim(
+        self, worker_id: str, lease_seconds: float = JOB_LEASE_SECONDS
+    ) -> Optional[dict]:
+        """Lease the oldest runnable job to `worker_id`.
+
+        Runnable jobs are queued jobs that are due, and running jobs whose lease
+        expired. Expired jobs without attempts left are failed instead.
+
+        Returns:
+            Optional[dict]: The job `id`, `company_name`, `payload` and `attempts`
+                (including this one), or None if no job is runnable.
+        """
+        now = time.time()
+        with self.transaction():
+            expired = self.connection.execute(
+                "UPDATE jobs SET status = ?, error = 'Lease expired', lease_owner = NULL,"
+                " updated_at = ? WHERE status = ? AND lease_expires < ?"
+                " AND attempts >= max_attempts RETURNING id",
+                (FAILED, datetime.now().isoformat(), RUNNING, now),
+            ).fetchall()
+            for (job_id,) in expired:
+                self.add_event(
+                    job_id, "job", {"status": FAILED, "error": "Lease expired"}
+                )
+            row = self.connection.execute(
+                "SELECT id, company_name, payload, attempts FROM jobs"
+                " WHERE (status = ? AND available_at <= ?)"
+                " OR (status = ? AND lease_expires < ?)"
+                " ORDER BY created_at LIMIT 1",
+                (QUEUED, now, RUNNING, now),
+            ).fetchone()
+            if row is None:
+                return None
+            # The counters of an attempt start over, as its files are handed over again
+            self.connection.execute(
+                "DELETE FROM job_progress WHERE job_id = ?", (row[0],)
+            )
+            self.connection.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_owner = ?,"
+                " lease_expires = ?, updated_at = ? WHERE id = ?",
+                (
+                    RUNNING,
+                    worker_id,
+                    now + lease_seconds,
+                    datetime.now().isoformat(),
+                    row[0],
+                ),
+            )
+            self.add_event(row[0], "job", {"status": RUNNING, "attempts": row[3] + 1})
+        return {
+            "id": row[0],
+            "company_name": row[1],
+            "payload": json.loads(row[2]),
+            "attempts": row[3] + 1,
+        }
+
+    @locked
+    def renew_lease(
+        self, job_id: str, worker_id: str, lease_seconds: float = JOB_LEASE_SECONDS
+    ) -> bool:
+        """Extend the lease of a running job, False if the worker lost it."""
+        cursor = self.connection.execute(
+            "UPDATE jobs SET lease_expires = ? WHERE id = ? AND lease_owner = ?"
+            " AND status = ?",
+            (time.time() + lease_seconds, job_id, worker_id, RUNNING),
+        )
+        return cursor.rowcount == 1
+
+    @locked
+    def complete(self, job_id: str, worker_id: str):
+        self.finish(job_id, worker_id, COMPLETED)
+
+    @locked
+    def fail(self, job_id: str, worker_id: str, error: str) -> bool:
+        """Record a failed attempt, queueing the job again if it has attempts left.
+
+        Returns:
+            bool: True if the job will be retried.
+        """
+        row = self.connection.execute(
+            "SELECT attempts, max_attempts FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None or row[0] >= row[1]:
+            self.finish(job_id, worker_id, FAILED, error)
+            return False
+
+        cursor = self.connection.execute(
+            "UPDATE jobs SET status = ?, error = ?, lease_owner = NULL,"
+            " available_at = ?, updated_at = ? WHERE id = ? AND lease_owner = ?",
+            (
+                QUEUED,
+                error,
+                time.time() + JOB_RETRY_DELAY_SECONDS * row[0],
+                datetime.now().isoformat(),
+                job_id,
+                worker_id,
+            ),
+        )
+        if cursor.rowcount:
+            self.add_event(job_id, "job", {"status": QUEUED, "error": error})
+        return True
+
+    @locked
+    def finish(
+        self, job_id: str, worker_id: str, status: str, error: Optional[str] = None
+    ):
+        cursor = self.connection.execute(
+            "UPDATE jobs SET status = ?, error = ?, lease_owner = NULL, updated_at = ?"
+            " WHERE id = ? AND lease_owner = ?",
+            (status, error, datetime.now().isoformat(), job_id, worker_id),
+        )
+        if cursor.rowcount:
+            self.add_event(job_id, "job", {"status": status, "error": error})
+
+    @locked
+    def update_url(
+        self,
+        job_id: str,
+        url: str,
+        status: str,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        elapsed: Optional[float] = None,
+        stats: Optional[dict] = None,
+    ):
+        """Record the status of one URL of a job, leaving unset fields unchanged."""
+        row = self.connection.execute(
+            "UPDATE job_urls SET status = ?,"
+            " start_time = COALESCE(?, start_time), end_time = COALESCE(?, end_time),"
+            " elapsed = COALESCE(?, elapsed), stats = COALESCE(?, stats)"
+            " WHERE job_id = ? AND url = ?"
+            " RETURNING status, start_time, end_time, elapsed, stats",
+            (
+                status,
+                start_time.isoformat() if start_time else None,
+                end_time.isoformat() if end_time else None,
+                elapsed,
+                json.dumps(stats) if stats is not None else None,
+                job_id,
+                url,
+            ),
+        ).fetchone()
+        if row:
+            self.add_event(
+                job_id,
+                "url",
+                {
+                    "url": url,
+                    "status": row[0],
+                    "start_time": row[1],
+                    "end_time": row[2],
+                    "elapsed": row[3],
+                    "stats": json.loads(row[4]) if row[4] else None,
+                },
+            )
+
+    @locked
+    def add_progress(self, job_id: str, stage: str, amount: int = 1):
+        """Add `amount` to the counter of a pipeline stage of a job, e.g. the
+        reports converted or uploaded so far."""
+        (count,) = self.connection.execute(
+            "INSERT INTO job_progress (job_id, stage, count) VALUES (?, ?, ?)"
+            " ON CONFLICT (job_id, stage) DO UPDATE SET count = count + excluded.count"
+            " RETURNING count",
+            (job_id, stage, amount),
+        ).fetchone()
+        self.add_event(job_id, "progress", {"stage": stage, "count": count})
+
+    @locked
+    def add_event(self, job_id: str, kind: str, data: dict):
+        """Append a progress event of a job, read back by `events_since`."""
+        self.connection.execute(
+            "INSERT INTO job_events (job_id, company_name, kind, data, created_at)"
+            " SELECT id, company_name, ?, ?, ? FROM jobs WHERE id = ?",
+            (kind, json.dumps(data), time.time(), job_id),
+        )
+
+    @locked
+    def events_since(self, event_id: int, limit: int = 500) -> list[dict]:
+        """Return the events recorded after `event_id`, oldest first.
+
+        Args:
+            event_id (int): Id of the last event already seen, 0 for all of them.
+            limit (int, optional): Most events returned.
+
+        Returns:
+            list[dict]: Events with their `id`, `job_id`, `company_name`, `kind`
+                ("job", "url" or "progress") and `data`.
+        """
+        return [
+            {
+                "id": row[0],
+                "job_id": row[1],
+                "company_name": row[2],
+                "kind": row[3],
+                "data": json.loads(row[4]),
+            }
+            for row in self.connection.execute(
+                "SELECT id, job_id, company_name, kind, data FROM job_events"
+                " WHERE id > ? ORDER BY id LIMIT ?",
+                (event_id, limit),
+            )
+        ]
+
+    @locked
+    def last_event_id(self) -> int:
+        (event_id,) = self.connection.execute(
+            "SELECT COALESCE(MAX(id), 0) FROM job_events"
+        ).fetchone()
+        return event_id
+
+    @locked
+    def latest_job(self, company_name: str) -> Optional[dict]:
+        """Return the most recent job of a company along with its URLs.
+
+        Returns:
+            Optional[dict]: The job `id`, `status`, `attempts` and `error`,
+                `urls` mapping each URL to its `status`, `start_time`, `end_time`,
+                `elapsed` and `stats`, and `progress` mapping each pipeline stage
+                to its counter. None if the company never had a job.
+        """
+        row = self.connection.execute(
+            "SELECT id, status, attempts, error FROM jobs WHERE company_name = ?"
+            " ORDER BY created_at DESC LIMIT 1",
+            (company_name,),
+        ).fetchone()
+        if row is None:
+            return None
+
+        urls = {}
+        for (
+            url,
+            status,
+            start_time,
+            end_time,
+            elapsed,
+            stats,
+        ) in self.connection.execute(
+            "SELECT url, status, start_time, end_time, elapsed, stats FROM job_urls"
+            " WHERE job_id = ? ORDER BY position",
+            (row[0],),
+        ):
+            urls[url] = {
+                "status": status,
+                "start_time": start_time,
+                "end_time": end_time,
+                "elapsed": elapsed,
+                "stats": json.loads(stats) if stats else None,
+            }
+        progress = dict(
+            self.connection.execute(
+                "SELECT stage, count FROM job_progress WHERE job_id = ?", (row[0],)
+            ).fetchall()
+        )
+        return {
+            "id": row[0],
+            "status": row[1],
+            "attempts": row[2],
+            "error": row[3],
+            "urls": urls,
+            "progress": progress,
+        }
+
+    @contextmanager
+    def transaction(self):
+        """Run the block in an immediate transaction, taking the write lock up front
+        so that two workers never claim the same job."""
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    @locked
+    def close(self):
+        self.connection.close()
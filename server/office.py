@@ -0,0 +1,228 @@
+import atexit
+import os
+import queue
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Optional
+from xmlrpc.client import ServerProxy, Transport
+
+from utils import logger
+
+# Long-lived headless office processes converting documents to PDF
+OFFICE_WORKERS = int(os.getenv("OFFICE_WORKERS", "2"))
+# Python interpreter able to `import uno`, usually the system one on Linux
+OFFICE_PYTHON = os.getenv("OFFICE_PYTHON", "python3")
+OFFICE_STARTUP_SECONDS = float(os.getenv("OFFICE_STARTUP_SECONDS", "30"))
+# A conversion taking longer is abandoned and its office process restarted
+OFFICE_TIMEOUT_SECONDS = float(os.getenv("OFFICE_TIMEOUT_SECONDS", "60"))
+# Office processes are recycled after this many conversions, 0 to never recycle
+OFFICE_MAX_CONVERSIONS = int(os.getenv("OFFICE_MAX_CONVERSIONS", "200"))
+
+OFFICE_EXTENSIONS = ("doc", "docx", "ppt", "pptx", "xls", "xlsx")
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+class TimeoutTransport(Transport):
+    """XML-RPC transport whose connections give up after `timeout` seconds."""
+
+    def __init__(self, timeout: float):
+        super().__init__()
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        connection = super().make_connection(host)
+        connection.timeout = self.timeout
+        return connection
+
+
+class OfficeTimeout(Exception):
+    """The document did not convert in time, its office process was restarted."""
+
+
+class OfficeServer:
+    """
+    One `unoserver` process, keeping a headless LibreOffice warm between documents.
+
+    Each server gets its own free ports and LibreOffice profile, so several of them
+    can run side by side, in any number of processes. The process runs in its own
+    session, and stopping it takes the LibreOffice instance it started down with it.
+    """
+
+    def __init__(self):
+        self.port: Optional[int] = None
+        self.process: Optional[subprocess.Popen] = None
+        self.profile_dir: Optional[str] = None
+        self.client = None
+        self.conversions = 0
+
+    @property
+    def running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        from unoserver.client import UnoClient
+
+        self.port = free_port()
+        self.profile_dir = tempfile.mkdtemp(prefix="office_profile_")
+        self.process = subprocess.Popen(
+            [
+                OFFICE_PYTHON,
+                "-m",
+                "unoserver.server",
+                "--interface",
+                "127.0.0.1",
+                "--port",
+                str(self.port),
+                "--uno-port",
+                str(free_port()),
+                "--user-installation",
+                self.profile_dir,
+                # Lets the server give up on a hung document on its own as well
+                "--conversion-timeout",
+                str(int(OFFICE_TIMEOUT_SECONDS)),
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        self.client = UnoClient("127.0.0.1", str(self.port))
+        self.conversions = 0
+
+        deadline = time.monotonic() + OFFICE_STARTUP_SECONDS
+        while time.monotonic() < deadline:
+            if not self.running:
+                break
+            try:
+                # Answered once LibreOffice accepts UNO connections, a server stuck
+                # before that is given up on at the deadline
+                transport = TimeoutTransport(max(deadline - time.monotonic(), 0.1))
+                with ServerProxy(
+                    f"http://127.0.0.1:{self.port}", transport=transport
+                ) as proxy:
+                    proxy.info()
+                logger.info(f"Office converter started on port {self.port}")
+                return
+            except OSError:
+                time.sleep(0.5)
+        self.stop()
+        raise RuntimeError(f"Office converter on port {self.port} failed to start")
+
+    def stop(self):
+        if self.process is not None:
+            try:
+                os.killpg(self.process.pid, signal.SIGTERM)
+                self.process.wait(5)
+            except ProcessLookupError:
+                pass
+            except subprocess.TimeoutExpired:
+                os.killpg(self.process.pid, signal.SIGKILL)
+                self.process.wait()
+            self.process = None
+        if self.profile_dir:
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+            self.profile_dir = None
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def convert(self, input_path: str, output_path: str, timeout: float):
+        if not self.running or (
+            OFFICE_MAX_CONVERSIONS and self.conversions >= OFFICE_MAX_CONVERSIONS
+        ):
+            # Recycling bounds the memory LibreOffice accumulates across documents
+            self.restart()
+
+        self.conversions += 1
+        # The RPC has no timeout of its own, a hung one ends when the server is stopped
+        result = {}
+
+        def call():
+            try:
+                self.client.convert(
+                    inpath=input_path, outpath=output_path, convert_to="pdf"
+                )
+            except Exception as e:
+                result["error"] = e
+
+        caller = threading.Thread(target=call, daemon=True)
+        caller.start()
+        caller.join(timeout)
+        if caller.is_alive():
+            logger.error(
+                f"Converting {input_path} took over {timeout} seconds, restarting the"
+                f" office converter on port {self.port}"
+            )
+            self.stop()
+            raise OfficeTimeout(f"Converting {input_path} timed out")
+        if "error" in result:
+            raise result["error"]
+
+
+class OfficeConverterPool:
+    """
+    Converts office documents to PDF on a pool of persistent `OfficeServer`s.
+
+    Documents are handed to the next idle server, so conversions called from
+    several threads are spread across the pool and every server converts one
+    document at a time. Servers start on first use; a server that hangs on a
+    document is killed, and restarted for the next one.
+    """
+
+    def __init__(
+        self,
+        workers: int = OFFICE_WORKERS,
+        timeout_seconds: float = OFFICE_TIMEOUT_SECONDS,
+    ):
+        self.servers = [OfficeServer() for _ in range(workers)]
+        self.timeout_seconds = timeout_seconds
+        self.idle = queue.Queue()
+        for server in self.servers:
+            self.idle.put(server)
+        # Servers run in their own session and would outlive this process
+        atexit.register(self.shutdown)
+
+    def convert(self, input_path: str, output_path: str) -> str:
+        """
+        Convert a doc, docx, ppt, pptx, xls or xlsx file to PDF.
+
+        Blocks until a server is idle and the document is converted.
+
+        Args:
+            input_path (str): Document to convert.
+            output_path (str): Path of the PDF to write.
+
+        Returns:
+            str: `output_path`.
+
+        Raises:
+            OfficeTimeout: If the conversion took longer than `timeout_seconds`.
+        """
+        server = self.idle.get()
+        try:
+            server.convert(
+                os.path.abspath(input_path),
+                os.path.abspath(output_path),
+                self.timeout_seconds,
+            )
+        finally:
+            self.idle.put(server)
+        logger.info(f"Converted {input_path} to PDF at {output_path}")
+        return output_path
+
+    def shutdown(self):
+        for server in self.servers:
+            server.stop()
+
+
+office_converter = OfficeConverterPool()
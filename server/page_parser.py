@@ -0,0 +1,92 @@
+import os
+from typing import Optional
+from urllib.parse import urljoin
+
+import lxml.html
+from bs4 import BeautifulSoup
+from lxml.etree import ParserError
+
+# "lxml" walks the raw lxml tree, "bs4" goes through BeautifulSoup (slower, more forgiving)
+PARSER_BACKENDS = ("lxml", "bs4")
+DEFAULT_PARSER_BACKEND = os.getenv("PAGE_PARSER_BACKEND", "lxml")
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+def empty_page() -> dict:
+    return {
+        "title": "No Title Found",
+        "description": "No Description Found",
+        "body_text": "",
+        "links": [],
+    }
+
+
+def extract_page_lxml(content: bytes, url: str) -> dict:
+    """Extract page fields from a single lxml parse."""
+    page = empty_page()
+    try:
+        document = lxml.html.fromstring(content)
+    except (ParserError, ValueError):
+        return page
+
+    titles = document.xpath("//title")
+    if titles:
+        title = normalize_text(titles[0].text_content())
+        if title:
+            page["title"] = title
+
+    descriptions = document.xpath("//meta[@name='description']/@content")
+    if descriptions and descriptions[0].strip():
+        page["description"] = descriptions[0].strip()
+
+    paragraphs = (normalize_text(p.text_content()) for p in document.iter("p"))
+    page["body_text"] = "\n".join(p for p in paragraphs if p)
+    page["links"] = [urljoin(url, href) for href in document.xpath("//a/@href")]
+    return page
+
+
+def extract_page_bs4(content: bytes, url: str) -> dict:
+    """Extract page fields from a single BeautifulSoup parse."""
+    page = empty_page()
+    soup = BeautifulSoup(content, "lxml")
+
+    if soup.title:
+        title = normalize_text(soup.title.get_text())
+        if title:
+            page["title"] = title
+
+    description_meta = soup.find("meta", attrs={"name": "description"})
+    if description_meta and description_meta.get("content", "").strip():
+        page["description"] = description_meta["content"].strip()
+
+    paragraphs = (normalize_text(p.get_text()) for p in soup.find_all("p"))
+    page["body_text"] = "\n".join(p for p in paragraphs if p)
+    page["links"] = [urljoin(url, a["href"]) for a in soup.find_all("a", href=True)]
+    return page
+
+
+def extract_page(content: bytes, url: str, backend: Optional[str] = None) -> dict:
+    """
+    Extracts everything the crawler needs from an HTML page in one parse.
+
+    Args:
+        content (bytes): HTML content of the webpage.
+        url (str): The webpage URL, used to resolve relative links.
+        backend (Optional[str]): One of `PARSER_BACKENDS`. Defaults to the
+            `PAGE_PARSER_BACKEND` environment variable, then "lxml".
+
+    Returns:
+        dict: The page `title`, `description`, `body_text` (one paragraph per line)
+            and the absolute outbound `links`.
+    """
+    backend = backend or DEFAULT_PARSER_BACKEND
+    if backend == "lxml":
+        return extract_page_lxml(content, url)
+    if backend == "bs4":
+        return extract_page_bs4(content, url)
+    raise ValueError(
+        f"Unknown parser backend {backend}, expected one of {PARSER_BACKENDS}"
+    )
@@ -0,0 +1,374 @@
+import copy
+import fcntl
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from utils import logger
+
+SEARCH_INDEX_DIR = os.getenv(
+    "SEARCH_INDEX_DIR", os.path.join(os.getcwd(), "state", "search")
+)
+# Pages a crawl indexes in memory before writing them out as a segment
+SEARCH_SEGMENT_PAGES = int(os.getenv("SEARCH_SEGMENT_PAGES", "1000"))
+# Segments of a company merged into one past this number
+SEARCH_MAX_SEGMENTS = int(os.getenv("SEARCH_MAX_SEGMENTS", "8"))
+SNIPPET_CHARS = int(os.getenv("SEARCH_SNIPPET_CHARS", "240"))
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from has have how i if in is it its me"
+    " my of on or our so that the their them there these they this to was we what"
+    " when where which who why will with you your".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    return [
+        token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS
+    ]
+
+
+@dataclass
+class PageResult:
+    """A page matching a search, with an excerpt around the words found."""
+
+    url: str
+    title: str
+    score: float
+    snippet: str
+
+
+def load_array(path: str, dtype) -> np.ndarray:
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+
+def write_segment(directory: str, pages: list[tuple[str, str, str]]):
+    """
+    Write `(url, title, text)` pages as a segment in `directory`.
+
+    The segment is written next to it and renamed in place once complete, so
+    searches never see part of one.
+    """
+    postings: dict[str, list[tuple[int, int]]] = {}
+    lengths = []
+    for doc, (url, title, text) in enumerate(pages):
+        counts = Counter(tokenize(f"{title}\n{text}"))
+        lengths.append(sum(counts.values()))
+        for term, count in counts.items():
+            postings.setdefault(term, []).append((doc, min(count, 65535)))
+
+    scratch = os.path.join(
+        os.path.dirname(directory), f".tmp-{os.path.basename(directory)}"
+    )
+    os.makedirs(scratch)
+    terms = {}
+    doc_ids, tfs = [], []
+    for term in sorted(postings):
+        terms[term] = [len(doc_ids), len(postings[term])]
+        for doc, count in postings[term]:
+            doc_ids.append(doc)
+            tfs.append(count)
+    np.asarray(doc_ids, dtype=np.uint32).tofile(os.path.join(scratch, "doc_ids.u32"))
+    np.asarray(tfs, dtype=np.uint16).tofile(os.path.join(scratch, "tfs.u16"))
+    np.asarray(lengths, dtype=np.uint32).tofile(
+        os.path.join(scratch, "doc_lengths.u32")
+    )
+    with open(os.path.join(scratch, "terms.json"), "w") as f:
+        json.dump(terms, f, separators=(",", ":"))
+
+    offsets = []
+    with open(os.path.join(scratch, "docs.jsonl"), "wb") as f:
+        for url, title, text in pages:
+            offsets.append(f.tell())
+            f.write(json.dumps({"url": url, "title": title, "text": text}).encode())
+            f.write(b"\n")
+    np.asarray(offsets, dtype=np.uint64).tofile(os.path.join(scratch, "offsets.u64"))
+    with open(os.path.join(scratch, "urls.txt"), "w", encoding="utf-8") as f:
+        f.writelines(f"{url}\n" for url, _, _ in pages)
+    with open(os.path.join(scratch, "meta.json"), "w") as f:
+        json.dump({"docs": len(pages), "length": sum(lengths)}, f)
+    os.rename(scratch, directory)
+
+
+class Segment:
+    """One immutable segment of a page index, its postings memory-mapped."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.name = os.path.basename(directory)
+        with open(self.file("meta.json")) as f:
+            meta = json.load(f)
+        self.docs = meta["docs"]
+        self.length = meta["length"]
+        with open(self.file("terms.json")) as f:
+            self.terms = json.load(f)
+        with open(self.file("urls.txt"), encoding="utf-8") as f:
+            self.urls = f.read().splitlines()
+        self.doc_ids = load_array(self.file("doc_ids.u32"), np.uint32)
+        self.tfs = load_array(self.file("tfs.u16"), np.uint16)
+        self.doc_lengths = load_array(self.file("doc_lengths.u32"), np.uint32)
+        self.offsets = load_array(self.file("offsets.u64"), np.uint64)
+        # Kept open, so the pages stay readable if the segment is merged away
+        self.documents = open(self.file("docs.jsonl"), "rb")
+        self.documents_size = os.fstat(self.documents.fileno()).st_size
+        # Pages indexed again by a newer segment, left out of the results. Set on a
+        # copy of the segment for every snapshot of the index, searches running on
+        # an older snapshot keep theirs
+        self.superseded = np.zeros(self.docs, dtype=bool)
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def document(self, doc: int) -> dict:
+        start = int(self.offsets[doc])
+        end = int(self.offsets[doc + 1]) if doc + 1 < self.docs else self.documents_size
+        return json.loads(os.pread(self.documents.fileno(), end - start, start))
+
+
+class PageIndex:
+    """
+    BM25 index of the pages scraped for one company, searchable while it grows.
+
+    Crawls add pages in immutable segments: sorted postings of every term, as
+    document ids and term frequencies in flat arrays that are memory-mapped, and
+    the text of the pages for the snippets. A page indexed again, by a later
+    crawl, is only returned from its newest segment. Past `SEARCH_MAX_SEGMENTS`
+    segments, the segments are merged into one without the superseded pages.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.segments: list[Segment] = []
+        self.lock = threading.Lock()
+
+    def segment_names(self) -> list[str]:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(name for name in names if name[0].isdigit())
+
+    def refresh(self) -> list[Segment]:
+        """Open the segments written since the last search, oldest first."""
+        with self.lock:
+            names = self.segment_names()
+            if names != [segment.name for segment in self.segments]:
+                opened = {segment.name: segment for segment in self.segments}
+                segments = []
+                for name in names:
+                    try:
+                        segments.append(
+                            opened.get(name)
+                            or Segment(os.path.join(self.directory, name))
+                        )
+                    except FileNotFoundError:
+                        # Merged away in the meantime
+                        continue
+                seen = set()
+                snapshot = []
+                for segment in reversed(segments):
+                    # Shares the postings and pages of the segment
+                    view = copy.copy(segment)
+                    view.superseded = np.fromiter(
+                        (url in seen for url in segment.urls),
+                        dtype=bool,
+                        count=segment.docs,
+                    )
+                    seen.update(segment.urls)
+                    snapshot.append(view)
+                self.segments = snapshot[::-1]
+            return self.segments
+
+    def add_segment(self, pages: list[tuple[str, str, str]]):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+        write_segment(os.path.join(self.directory, name), pages)
+
+    def compact(self):
+        """Merge the segments into one, unless another process is already at it."""
+        with open(os.path.join(self.directory, "lock"), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            segments = [
+                Segment(os.path.join(self.directory, name))
+                for name in self.segment_names()
+            ]
+            seen = set()
+            pages = []
+            for segment in reversed(segments):
+                for doc, url in enumerate(segment.urls):
+                    if url not in seen:
+                        seen.add(url)
+                        document = segment.document(doc)
+                        pages.append((url, document["title"], document["text"]))
+            # Sorts right after the newest segment merged, before any written since
+            write_segment(
+                os.path.join(self.directory, f"{segments[-1].name}-merged"), pages
+            )
+            for segment in segments:
+                shutil.rmtree(segment.directory, ignore_errors=True)
+            logger.info(
+                f"Merged {len(segments)} segments of {self.directory},"
+                f" {len(pages)} pages"
+            )
+
+    def search(self, query: str, k: int = 10) -> list[PageResult]:
+        """
+        Rank the pages of the index against a query with BM25.
+
+        Args:
+            query (str): Words to look for.
+            k (int): Most pages returned.
+
+        Returns:
+            list[PageResult]: Best matches first.
+        """
+        terms = set(tokenize(query))
+        segments = self.refresh()
+        docs = sum(segment.docs for segment in segments)
+        if not terms or not docs or k <= 0:
+            return []
+
+        average_length = sum(segment.length for segment in segments) / docs
+        idf = {}
+        for term in terms:
+            df = sum(segment.terms.get(term, (0, 0))[1] for segment in segments)
+            if df:
+                idf[term] = math.log(1 + (docs - df + 0.5) / (df + 0.5))
+
+        candidates = []
+        for segment in segments:
+            scores = np.zeros(segment.docs, dtype=np.float32)
+            for term, weight in idf.items():
+                if term not in segment.terms:
+                    continue
+                start, count = segment.terms[term]
+                doc_ids = segment.doc_ids[start : start + count]
+                tfs = segment.tfs[start : start + count].astype(np.float32)
+                lengths = segment.doc_lengths[doc_ids] / average_length
+                scores[doc_ids] += (
+                    weight
+                    * tfs
+                    * (BM25_K1 + 1)
+                    / (tfs + BM25_K1 * (1 - BM25_B + BM25_B * lengths))
+                )
+            scores[segment.superseded] = 0
+            top = np.flatnonzero(scores)
+            if len(top) > k:
+                top = top[np.argpartition(scores[top], -k)[-k:]]
+            candidates.extend((float(scores[doc]), segment, int(doc)) for doc in top)
+
+        results = []
+        for score, segment, doc in sorted(candidates, key=lambda c: -c[0])[:k]:
+            document = segment.document(doc)
+            results.append(
+                PageResult(
+                    document["url"],
+                    document["title"],
+                    round(score, 4),
+                    snippet(document["text"], terms),
+                )
+            )
+        return results
+
+
+def snippet(text: str, terms: set, length: int = SNIPPET_CHARS) -> str:
+    """Excerpt of `text` around the first of `terms` it contains."""
+    lowered = text.lower()
+    positions = [
+        match.start()
+        for term in terms
+        if (match := re.search(rf"\b{re.escape(term)}\b", lowered))
+    ]
+    start = max(0, min(positions, default=0) - length // 4)
+    if start:
+        # Starts on a word
+        start = text.find(" ", start) + 1 or start
+    excerpt = " ".join(text[start : start + length].split())
+    prefix = "…" if start else ""
+    suffix = "…" if start + length < len(text) else ""
+    return f"{prefix}{excerpt}{suffix}"
+
+
+class PageIndexWriter:
+    """
+    Indexes the pages of a crawl as they are scraped.
+
+    Pages are held in memory and written out as a segment every
+    `SEARCH_SEGMENT_PAGES` pages, and on `close`. Past `SEARCH_MAX_SEGMENTS`
+    segments, they are merged on a background thread while the crawl keeps
+    adding pages. Several crawls of a company, in any number of processes, can
+    write at the same time.
+    """
+
+    def __init__(self, company_name: str, root: Optional[str] = None):
+        self.index = PageIndex(company_directory(company_name, root))
+        self.pages: list[tuple[str, str, str]] = []
+        self.compaction: Optional[threading.Thread] = None
+
+    def add(self, url: str, title: str, text: str):
+        self.pages.append((url, title, text))
+        if len(self.pages) >= SEARCH_SEGMENT_PAGES:
+            self.flush()
+
+    def flush(self):
+        if self.pages:
+            self.index.add_segment(self.pages)
+            self.pages = []
+        if len(self.index.segment_names()) > SEARCH_MAX_SEGMENTS and not (
+            self.compaction and self.compaction.is_alive()
+        ):
+            self.compaction = threading.Thread(
+                target=self.index.compact, name="search-compaction", daemon=True
+            )
+            self.compaction.start()
+
+    def close(self):
+        self.flush()
+        if self.compaction:
+            self.compaction.join()
+
+
+def company_directory(company_name: str, root: Optional[str] = None) -> str:
+    return os.path.join(
+        root or SEARCH_INDEX_DIR, re.sub(r"[^\w.-]", "_", company_name) or "_"
+    )
+
+
+class PageSearch:
+    """The page indexes of every company, opened on first search."""
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root
+        self.indexes: dict[str, PageIndex] = {}
+
+    def search(self, company_name: str, query: str, k: int = 10) -> list[PageResult]:
+        if company_name not in self.indexes:
+            self.indexes[company_name] = PageIndex(
+                company_directory(company_name, self.root)
+            )
+        return self.indexes[company_name].search(query, k)
+
+    def delete(self, company_name: str):
+        self.indexes.pop(company_name, None)
+        shutil.rmtree(company_directory(company_name, self.root), ignore_errors=True)
+
+
+page_search = PageSearch()
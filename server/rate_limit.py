@@ -0,0 +1,118 @@
+import asyncio
+import os
+from typing import Optional
+
+# Requests per second allowed against a host while it responds normally
+DEFAULT_HOST_RATE = float(os.getenv("CRAWL_HOST_RATE", "10"))
+# Lowest rate a throttling host can push the crawler down to
+MIN_HOST_RATE = float(os.getenv("CRAWL_MIN_HOST_RATE", "0.2"))
+# Share of the maximum rate and concurrency a host gets back per successful response
+RECOVERY_STEP = float(os.getenv("CRAWL_RECOVERY_STEP", "0.05"))
+
+
+class HostRateLimiter:
+    """
+    Token bucket with adaptive (AIMD) concurrency for a single host.
+
+    Requests take a token from a bucket refilled at `rate` tokens per second and a
+    slot out of `limit` concurrent requests. When the host signals overload (429,
+    503, timeouts) both the rate and the concurrency limit are halved and new
+    requests pause for the Retry-After period. Every successful response raises
+    them again by a fixed `recovery_step` of the configured maximums, so a host
+    recovers from any backoff within about `1 / recovery_step` responses.
+    """
+
+    def __init__(
+        self,
+        max_rate: float = DEFAULT_HOST_RATE,
+        max_concurrency: int = 6,
+        min_rate: float = MIN_HOST_RATE,
+        recovery_step: float = RECOVERY_STEP,
+    ):
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.max_concurrency = max_concurrency
+        self.recovery_step = recovery_step
+        self.rate = max_rate
+        self.limit = float(max_concurrency)
+        self.tokens = 1.0
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.updated_at = None
+        # Futures of the requests waiting for a token or a slot
+        self.waiters: list[asyncio.Future] = []
+
+    def refill(self, now: float):
+        if self.updated_at is not None:
+            burst = max(1.0, self.rate)
+            self.tokens = min(burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, now: float) -> Optional[float]:
+        """Seconds until a request may start, or None if it has to wait for a slot."""
+        if self.in_flight >= int(self.limit):
+            return None
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        return 0.0
+
+    async def acquire(self):
+        # The state is only touched from the event loop, so no lock is needed, and a
+        # cancelled request never has to take one back on its way out
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            self.refill(now)
+            delay = self.wait_time(now)
+            if delay == 0:
+                self.tokens -= 1
+                self.in_flight += 1
+                return
+
+            waiter = loop.create_future()
+            self.waiters.append(waiter)
+            timer = (
+                loop.call_later(delay, wake_up, waiter) if delay is not None else None
+            )
+            try:
+                await waiter
+            finally:
+                if timer:
+                    timer.cancel()
+                self.waiters.remove(waiter)
+
+    def release(self):
+        self.in_flight -= 1
+        for waiter in self.waiters:
+            wake_up(waiter)
+
+    def on_success(self):
+        """Additive increase by `recovery_step` of the maximum rate and concurrency."""
+        self.rate = min(self.max_rate, self.rate + self.recovery_step * self.max_rate)
+        self.limit = min(
+            self.max_concurrency,
+            self.limit + self.recovery_step * self.max_concurrency,
+        )
+
+    def on_throttle(self, retry_after: Optional[float] = None):
+        """Multiplicative decrease, pausing the host for `retry_after` seconds if given."""
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.limit = max(1.0, self.limit / 2)
+        self.tokens = min(self.tokens, 0.0)
+        if retry_after:
+            loop = asyncio.get_running_loop()
+            self.paused_until = max(self.paused_until, loop.time() + retry_after)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+def wake_up(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
@@ -0,0 +1,88 @@
+import os
+import uuid
+from typing import Callable, Optional
+
+# Size at which a markdown report is closed and handed over for conversion
+REPORT_BATCH_BYTES = int(os.getenv("REPORT_BATCH_BYTES", str(512 * 1024)))
+PART_SUFFIX = ".part"
+
+
+class ReportBatcher:
+    """
+    Splits the reports of a crawl into markdown documents of about `target_bytes`.
+
+    Page reports are appended to an open `<domain>-<id>-<n>.md.part` file per domain.
+    Once it reaches the target size the file is sealed, renamed to `.md`, and
+    `on_batch` is called with its path, so that it can be converted and uploaded
+    while the crawl goes on. A page report is never split across two batches: each
+    page stays one section opening with its title and URL, wherever the batch ends.
+    """
+
+    def __init__(
+        self,
+        reports_dir: str,
+        target_bytes: int = REPORT_BATCH_BYTES,
+        on_batch: Optional[Callable[[str], None]] = None,
+    ):
+        self.reports_dir = reports_dir
+        self.target_bytes = target_bytes
+        self.on_batch = on_batch
+        # Keeps the batches of concurrent crawls writing to one directory apart
+        self.batch_id = uuid.uuid4().hex[:6]
+        self.open_batches = {}
+        self.batch_counts = {}
+        os.makedirs(reports_dir, exist_ok=True)
+
+    def add(self, domain_name: str, report_content: str) -> str:
+        """Append a page report to the open batch of its domain, returning its path."""
+        if domain_name not in self.open_batches:
+            count = self.batch_counts.get(domain_name, 0) + 1
+            self.batch_counts[domain_name] = count
+            path = os.path.join(
+                self.reports_dir, f"{domain_name}-{self.batch_id}-{count}.md"
+            )
+            self.open_batches[domain_name] = path
+
+        path = self.open_batches[domain_name]
+        part_path = path + PART_SUFFIX
+        with open(part_path, "a", encoding="utf-8", errors="ignore") as report_file:
+            report_file.write(report_content)
+            size = report_file.tell()
+
+        if size >= self.target_bytes:
+            self.seal(domain_name)
+        return path
+
+    def seal(self, domain_name: str):
+        path = self.open_batches.pop(domain_name)
+        os.replace(path + PART_SUFFIX, path)
+        if self.on_batch:
+            self.on_batch(path)
+
+    def close(self):
+        """Seal the batches still open, at the end of the crawl."""
+        for domain_name in list(self.open_batches):
+            self.seal(domain_name)
+
+
+def seal_leftover_batches(reports_dir: str) -> list[str]:
+    """
+    Seals the batches a crawl left open because it was stopped before the end.
+
+    Args:
+        reports_dir (str): Report directory shared by the crawls of a job.
+
+    Returns:
+        list[str]: Paths of the sealed markdown reports.
+    """
+    if not os.path.isdir(reports_dir):
+        return []
+
+    sealed = []
+    for name in sorted(os.listdir(reports_dir)):
+        if name.endswith(".md" + PART_SUFFIX):
+            part_path = os.path.join(reports_dir, name)
+            path = part_path[: -len(PART_SUFFIX)]
+            os.replace(part_path, path)
+            sealed.append(path)
+    return sealed
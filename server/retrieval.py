@@ -0,0 +1,428 @@
+import asyncio
+import fcntl
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import uuid
+import zlib
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from page_search import STOPWORDS, TOKEN_PATTERN
+from uploader import UploadRegistry, UploadResult, file_hash, vector_store_uploader
+from utils import create_vector_store, get_openai_client, logger
+
+# Where new companies keep their documents, "openai" vector stores or "local"
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "openai").lower()
+RETRIEVAL_INDEX_DIR = os.getenv(
+    "RETRIEVAL_INDEX_DIR", os.path.join(os.getcwd(), "state", "retrieval")
+)
+# "hashing", or the name of a sentence-transformers model, for new local stores
+RETRIEVAL_EMBEDDER = os.getenv("RETRIEVAL_EMBEDDER", "hashing")
+RETRIEVAL_DIMENSIONS = int(os.getenv("RETRIEVAL_DIMENSIONS", "4096"))
+# Chunks of text given to the assistant along with each question
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+CHUNK_WORDS = int(os.getenv("RETRIEVAL_CHUNK_WORDS", "200"))
+CHUNK_OVERLAP_WORDS = int(os.getenv("RETRIEVAL_CHUNK_OVERLAP_WORDS", "40"))
+# Vectors scored at a time, bounding the memory a search needs
+SEARCH_BLOCK_ROWS = 4096
+
+LOCAL_STORE_PREFIX = "local_"
+# Header `utils.generate_page_report` gives the report of every page
+PAGE_URL_PATTERN = re.compile(r"^##### URL: \[(.+?)\]", re.M)
+
+
+@dataclass
+class SearchHit:
+    """A chunk of a document matching a query."""
+
+    score: float
+    source: str
+    text: str
+
+
+class HashingEmbedder:
+    """
+    Embeds text by hashing its words and word pairs into a fixed number of
+    dimensions, with a sign from the hash to cancel collisions out on average.
+    Stopwords are left out.
+
+    Needs no model and no training, so documents are embedded one at a time as
+    they arrive, offline.
+    """
+
+    def __init__(self, dimensions: int = RETRIEVAL_DIMENSIONS):
+        self.dimensions = dimensions
+        self.name = "hashing"
+
+    def features(self, text: str) -> dict:
+        tokens = [
+            token
+            for token in TOKEN_PATTERN.findall(text.lower())
+            if token not in STOPWORDS
+        ]
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for first, second in zip(tokens, tokens[1:]):
+            pair = f"{first} {second}"
+            counts[pair] = counts.get(pair, 0) + 1
+        return counts
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, count in self.features(text).items():
+                digest = zlib.crc32(feature.encode("utf-8"))
+                sign = 1.0 if digest & 1 else -1.0
+                vectors[row, (digest >> 1) % self.dimensions] += sign * (
+                    1.0 + math.log(count)
+                )
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class SentenceTransformerEmbedder:
+    """Embeds text with a local sentence-transformers model, if installed."""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name)
+        self.dimensions = self.model.get_sentence_embedding_dimension()
+        self.name = model_name
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        return self.model.encode(
+            texts, normalize_embeddings=True, convert_to_numpy=True
+        ).astype(np.float32)
+
+
+def create_embedder(name: str, dimensions: int = RETRIEVAL_DIMENSIONS):
+    if name == "hashing":
+        return HashingEmbedder(dimensions)
+    return SentenceTransformerEmbedder(name)
+
+
+def read_document(path: str) -> list[tuple[str, str]]:
+    """
+    Read the text of a document as `(source, text)` sections.
+
+    Markdown reports are split into their pages, with the page URL as the source.
+    PDFs are read with PyMuPDF; any other file is read as text.
+    """
+    name = os.path.basename(path)
+    if path.lower().endswith(".pdf"):
+        import fitz
+
+        with fitz.open(path) as document:
+            return [(name, "\n".join(page.get_text() for page in document))]
+
+    with open(path, encoding="utf-8", errors="ignore") as f:
+        text = f.read()
+
+    sections = []
+    source = name
+    # Every page report ends with a horizontal rule
+    for part in text.split("\n---\n"):
+        header = PAGE_URL_PATTERN.search(part)
+        if header:
+            source = header.group(1)
+        if part.strip():
+            sections.append((source, part))
+    return sections
+
+
+def chunk_text(
+    text: str, words: int = CHUNK_WORDS, overlap: int = CHUNK_OVERLAP_WORDS
+) -> list[str]:
+    """Split text into windows of `words` words, `overlap` of them shared."""
+    tokens = text.split()
+    step = max(1, words - overlap)
+    return [
+        " ".join(tokens[start : start + words])
+        for start in range(0, max(1, len(tokens) - overlap), step)
+        if tokens[start : start + words]
+    ]
+
+
+class LocalIndex:
+    """
+    Chunks and vectors of the documents of one local store, in a directory.
+
+    Three append-only files hold the index: `chunks.jsonl` with the text and source
+    of every chunk, `offsets.u64` with the position of each of them in it, and
+    `vectors.f32` with their embeddings. They are memory-mapped for searches and
+    only grow, so readers in other processes see the rows appended since they
+    last looked. One process appends at a time, under a file lock.
+
+    `df.u32` counts the chunks using every dimension. Queries are weighted by the
+    inverse of these counts, so that words found everywhere, such as the
+    boilerplate of a website, weigh less than the rare ones. Dense embeddings use
+    every dimension in every chunk and are left unweighted.
+    """
+
+    def __init__(self, path: str, embedder_name: str = RETRIEVAL_EMBEDDER):
+        self.path = path
+        meta_path = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_path):
+            os.makedirs(path, exist_ok=True)
+            with open(meta_path + ".tmp", "w") as f:
+                json.dump(
+                    {"embedder": embedder_name, "dimensions": RETRIEVAL_DIMENSIONS}, f
+                )
+            os.replace(meta_path + ".tmp", meta_path)
+        with open(meta_path) as f:
+            meta = json.load(f)
+        # The embedder the store was created with, whatever the current default
+        self.embedder = create_embedder(meta["embedder"], meta["dimensions"])
+        self.dimensions = self.embedder.dimensions
+        self.vectors: Optional[np.memmap] = None
+        self.offsets: Optional[np.memmap] = None
+        self.query_weights: Optional[np.ndarray] = None
+        self.rows = 0
+        self.lock = threading.Lock()
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def add(self, sections: list[tuple[str, str]]) -> int:
+        """Chunk, embed and append sections of text, returning the chunks added."""
+        chunks = [
+            {"source": source, "text": chunk}
+            for source, text in sections
+            for chunk in chunk_text(text)
+        ]
+        if not chunks:
+            return 0
+        vectors = self.embedder.embed([chunk["text"] for chunk in chunks])
+
+        with open(self.file("lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Chunks go first: a row has both its offset and vector once visible
+            with open(self.file("chunks.jsonl"), "ab") as f:
+                offsets = []
+                for chunk in chunks:
+                    offsets.append(f.tell())
+                    f.write(json.dumps(chunk).encode("utf-8") + b"\n")
+            with open(self.file("offsets.u64"), "ab") as f:
+                f.write(np.asarray(offsets, dtype=np.uint64).tobytes())
+            with open(self.file("vectors.f32"), "ab") as f:
+                f.write(vectors.astype(np.float32).tobytes())
+
+            counts = (vectors != 0).sum(axis=0).astype(np.uint32)
+            if os.path.exists(self.file("df.u32")):
+                counts += np.fromfile(self.file("df.u32"), dtype=np.uint32)
+            counts.tofile(self.file("df.u32.tmp"))
+            os.replace(self.file("df.u32.tmp"), self.file("df.u32"))
+        return len(chunks)
+
+    def refresh(self):
+        """Map the rows appended since the last search."""
+        try:
+            rows = min(
+                os.path.getsize(self.file("vectors.f32")) // (4 * self.dimensions),
+                os.path.getsize(self.file("offsets.u64")) // 8,
+            )
+        except FileNotFoundError:
+            rows = 0
+        if rows != self.rows:
+            self.vectors = np.memmap(
+                self.file("vectors.f32"),
+                dtype=np.float32,
+                mode="r",
+                shape=(rows, self.dimensions),
+            )
+            self.offsets = np.memmap(
+                self.file("offsets.u64"), dtype=np.uint64, mode="r", shape=(rows,)
+            )
+            counts = np.fromfile(self.file("df.u32"), dtype=np.uint32)
+            self.query_weights = (
+                np.log((rows + 1) / (counts.astype(np.float32) + 1)) + 1
+            ).astype(np.float32)
+            self.rows = rows
+
+    def search(self, query: str, k: int = RETRIEVAL_TOP_K) -> list[SearchHit]:
+        """
+        Find the chunks closest to a query, by cosine similarity.
+
+        Args:
+            query (str): Text to look for.
+            k (int): Most chunks returned.
+
+        Returns:
+            list[SearchHit]: Best matches first.
+        """
+        with self.lock:
+            self.refresh()
+            vectors, offsets, rows = self.vectors, self.offsets, self.rows
+            query_weights = self.query_weights
+        if not rows or k <= 0:
+            return []
+
+        query_vector = self.embedder.embed([query])[0] * query_weights
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for first in range(0, rows, SEARCH_BLOCK_ROWS):
+            scores = vectors[first : first + SEARCH_BLOCK_ROWS] @ query_vector
+            if len(scores) > k:
+                top = np.argpartition(scores, -k)[-k:]
+            else:
+                top = np.arange(len(scores))
+            best_rows = np.concatenate([best_rows, top + first])
+            best_scores = np.concatenate([best_scores, scores[top]])
+            if len(best_scores) > k:
+                keep = np.argpartition(best_scores, -k)[-k:]
+                best_rows, best_scores = best_rows[keep], best_scores[keep]
+
+        hits = []
+        with open(self.file("chunks.jsonl"), "rb") as f:
+            for position in np.argsort(-best_scores):
+                f.seek(int(offsets[best_rows[position]]))
+                chunk = json.loads(f.readline())
+                hits.append(
+                    SearchHit(
+                        float(best_scores[position]), chunk["source"], chunk["text"]
+                    )
+                )
+        return hits
+
+
+class OpenAIRetrieval:
+    """Documents in OpenAI vector stores, searched by the assistant's file_search."""
+
+    searchable = False
+
+    async def create_store(self, company_name: str) -> str:
+        return await create_vector_store(get_openai_client(), company_name)
+
+    async def add_files(self, store_id: str, paths: list[str]) -> UploadResult:
+        return await vector_store_uploader.upload(store_id, paths)
+
+    async def search(self, store_id: str, query: str, k: int) -> list[SearchHit]:
+        return []
+
+    async def delete_store(self, store_id: str):
+        await get_openai_client().beta.vector_stores.delete(store_id)
+        vector_store_uploader.forget(store_id)
+
+    def assistant_tools(self, store_id: str) -> dict:
+        return {
+            "tools": [{"type": "file_search"}],
+            "tool_resources": {"file_search": {"vector_store_ids": [store_id]}},
+        }
+
+
+class LocalRetrieval:
+    """
+    Documents indexed on this machine, in a `LocalIndex` per store.
+
+    Searches need no network, and their results are given to the assistant along
+    with the question instead of through file_search. Files already indexed in a
+    store are skipped, by content hash.
+    """
+
+    searchable = True
+
+    def __init__(
+        self, root: str = RETRIEVAL_INDEX_DIR, registry: Optional[UploadRegistry] = None
+    ):
+        self.root = root
+        self.registry = registry
+        self.indexes: dict[str, LocalIndex] = {}
+
+    def index(self, store_id: str) -> LocalIndex:
+        if store_id not in self.indexes:
+            self.indexes[store_id] = LocalIndex(os.path.join(self.root, store_id))
+        return self.indexes[store_id]
+
+    def get_registry(self) -> UploadRegistry:
+        if self.registry is None:
+            self.registry = UploadRegistry()
+        return self.registry
+
+    async def create_store(self, company_name: str) -> str:
+        store_id = f"{LOCAL_STORE_PREFIX}{uuid.uuid4().hex}"
+        await asyncio.to_thread(self.index, store_id)
+        logger.info(f"Local store {store_id} created for {company_name}")
+        return store_id
+
+    def add_file(self, store_id: str, path: str) -> Optional[int]:
+        """Index a file, returning its chunks, or None if it was indexed before."""
+        content_hash = file_hash(path)
+        if self.get_registry().contains(store_id, content_hash):
+            return None
+        chunks = self.index(store_id).add(read_document(path))
+        self.get_registry().add(
+            store_id, content_hash, f"chunks:{chunks}", os.path.basename(path)
+        )
+        return chunks
+
+    async def add_files(self, store_id: str, paths: list[str]) -> UploadResult:
+        result = UploadResult()
+        chunks = 0
+        for path in paths:
+            try:
+                added = await asyncio.to_thread(self.add_file, store_id, path)
+            except Exception as e:
+                logger.error(f"Error indexing {path} in local store {store_id}: {e}")
+                result.failed.append(path)
+                continue
+            if added is None:
+                result.skipped.append(path)
+            else:
+                result.uploaded.append(path)
+                chunks += added
+        logger.info(
+            f"Indexed {len(result.uploaded)} files ({chunks} chunks) in local store"
+            f" {store_id}, {len(result.skipped)} already there"
+        )
+        return result
+
+    async def search(
+        self, store_id: str, query: str, k: int = RETRIEVAL_TOP_K
+    ) -> list[SearchHit]:
+        return await asyncio.to_thread(self.index(store_id).search, query, k)
+
+    async def delete_store(self, store_id: str):
+        self.indexes.pop(store_id, None)
+        await asyncio.to_thread(shutil.rmtree, os.path.join(self.root, store_id), True)
+        self.get_registry().forget(store_id)
+        logger.info(f"Local store {store_id} deleted")
+
+    def assistant_tools(self, store_id: str) -> dict:
+        return {}
+
+
+openai_retrieval = OpenAIRetrieval()
+local_retrieval = LocalRetrieval()
+
+
+def retrieval_for(store_id: Optional[str] = None):
+    """
+    Backend holding a store, from its id; the `RETRIEVAL_BACKEND` one for a new store.
+
+    Companies keep the backend they were created with, so both kinds of stores can
+    be served side by side.
+    """
+    if store_id is None:
+        return local_retrieval if RETRIEVAL_BACKEND == "local" else openai_retrieval
+    if store_id.startswith(LOCAL_STORE_PREFIX):
+        return local_retrieval
+    return openai_retrieval
+
+
+def question_with_context(question: str, hits: list[SearchHit]) -> str:
+    """Prefix a question with the excerpts found for it, citing their sources."""
+    if not hits:
+        return question
+    excerpts = "\n\n".join(f"[{hit.source}]\n{hit.text}" for hit in hits)
+    return (
+        "Answer the question using these excerpts of the company's documents:\n\n"
+        f"{excerpts}\n\nQuestion: {question}"
+    )
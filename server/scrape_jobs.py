@@ -0,0 +1,429 @@
+import asyncio
+import hashlib
+import os
+from datetime import datetime
+from typing import Optional
+
+from conversion import (
+    CONVERSION_WORKERS,
+    prepare_attachment_for_upload,
+    prepare_report_for_upload,
+)
+from crawl_store import CrawlStore
+from job_queue import JOB_LEASE_SECONDS, JobQueue
+from report_batches import seal_leftover_batches
+from scrape_pool import SCRAPE_WORKERS, ScrapeTimeout, ScrapeWorkerPool
+from retrieval import retrieval_for
+from uploader import UPLOAD_BATCH_FILES
+from utils import logger
+from workspace import JobWorkspace
+
+# Websites of one company scraped at the same time, bounded by the pool size
+SCRAPE_SITE_PARALLELISM = int(os.getenv("SCRAPE_SITE_PARALLELISM", str(SCRAPE_WORKERS)))
+# Seconds between two looks at the job queue when it is empty
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))
+# Jobs run at the same time by one worker process, sharing its scrape pool
+WORKER_JOBS = int(os.getenv("WORKER_JOBS", "2"))
+# Reports waiting between two pipeline stages before the earlier stage is held back
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))
+
+
+class LeaseLost(Exception):
+    """The lease of a running job expired and another worker may have claimed it."""
+
+
+async def run_scraping_task(
+    queue: JobQueue,
+    job_id: str,
+    pool: ScrapeWorkerPool,
+    company_name: str,
+    websites: list[str],
+    vector_store_id: str,
+    timeout_seconds: int,
+    incremental: bool = False,
+    resume: bool = False,
+):
+    """Scrape the websites of a company and upload the reports to its vector store.
+
+    Args:
+        queue (JobQueue): Queue receiving the per-URL status of the job.
+        job_id (str): Id of the job in `queue`.
+        pool (ScrapeWorkerPool): Pool running the scrapes.
+        company_name (str): Company the websites belong to.
+        websites (list[str]): Websites to scrape.
+        vector_store_id (str): Vector store of the company.
+        timeout_seconds (int): Time allowed for the scrape of each website.
+        incremental (bool, optional): Only upload new or changed content.
+        resume (bool, optional): Continue the last checkpointed crawls.
+    """
+    logger.info(f"Starting Scraping Session with Timeout at {timeout_seconds} seconds")
+
+    workspace = JobWorkspace.create(f"{company_name}-{job_id[:8]}")
+    try:
+        await scrape_and_upload(
+            queue,
+            job_id,
+            pool,
+            company_name,
+            websites,
+            vector_store_id,
+            timeout_seconds,
+            workspace,
+            incremental,
+            resume,
+        )
+    finally:
+        workspace.cleanup()
+
+
+async def scrape_and_upload(
+    queue: JobQueue,
+    job_id: str,
+    pool: ScrapeWorkerPool,
+    company_name: str,
+    websites: list[str],
+    vector_store_id: str,
+    timeout_seconds: int,
+    workspace: JobWorkspace,
+    incremental: bool,
+    resume: bool,
+):
+    """
+    Scrape `websites` into `workspace` while uploading the reports and attachments
+    of the job.
+
+    The crawls, the conversion and the upload run as a pipeline: every report batch
+    a crawl completes is converted to the `INGEST_FORMAT`, and every attachment it
+    saves to PDF, then uploaded while the crawls go on. Up to `CONVERSION_WORKERS`
+    files are converted at once. The stages are connected by bounded queues, so a
+    slow stage holds the ones before it back instead of piling files up.
+
+    Progress is recorded in `queue` as it happens: the crawl statistics of every
+    URL, the reports written and the attachments downloaded, and how many of them
+    were converted, uploaded, skipped as already uploaded, or failed.
+
+    The validators of the pages in a file are only committed once the file is
+    uploaded, see `CrawlStore.promote_pages`; those of files that failed are
+    dropped, so the next incremental crawl fetches their pages again.
+    """
+    parallel_sites = asyncio.Semaphore(SCRAPE_SITE_PARALLELISM)
+    # Documents converted at once, the next ones wait in `documents`
+    parallel_conversions = asyncio.Semaphore(CONVERSION_WORKERS)
+    # ("reports" or "attachments", path) of the files to convert, then
+    # (kind, path, converted path) of the files to upload
+    documents = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    converted = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    announced = set()
+    store = CrawlStore()
+
+    def prepare_for_upload(kind: str, input_path: str) -> str:
+        if kind == "reports":
+            return prepare_report_for_upload(input_path, workspace.pdf_dir)
+        # Keeps the PDFs of "guide.docx" and "guide.pptx" apart
+        output_dir = os.path.join(
+            workspace.pdf_dir,
+            "attachments",
+            hashlib.sha1(input_path.encode("utf-8")).hexdigest()[:12],
+        )
+        return prepare_attachment_for_upload(input_path, output_dir)
+
+    async def convert_document(kind: str, input_path: str):
+        try:
+            upload_path = await asyncio.to_thread(prepare_for_upload, kind, input_path)
+            await asyncio.to_thread(queue.add_progress, job_id, f"{kind}_converted")
+            await converted.put((kind, input_path, upload_path))
+        except Exception as e:
+            logger.error(f"Error converting {input_path}: {e}")
+            await asyncio.to_thread(queue.add_progress, job_id, f"{kind}_failed")
+        finally:
+            parallel_conversions.release()
+
+    async def convert_documents():
+        conversions = set()
+        try:
+            while (document := await documents.get()) is not None:
+                await parallel_conversions.acquire()
+                conversion = asyncio.create_task(convert_document(*document))
+                conversions.add(conversion)
+                conversion.add_done_callback(conversions.discard)
+            if conversions:
+                await asyncio.wait(conversions)
+        finally:
+            for conversion in conversions:
+                conversion.cancel()
+        await converted.put(None)
+
+    async def upload_documents() -> int:
+        uploaded = 0
+        while (document := await converted.get()) is not None:
+            # Whatever else got converted meanwhile goes in the same upload
+            batch = [document]
+            while len(batch) < UPLOAD_BATCH_FILES and not converted.empty():
+                document = converted.get_nowait()
+                if document is None:
+                    converted.put_nowait(None)
+                    break
+                batch.append(document)
+
+            kinds = {upload_path: kind for kind, _, upload_path in batch}
+            sources = {upload_path: source for _, source, upload_path in batch}
+            result = await retrieval_for(vector_store_id).add_files(
+                vector_store_id, list(kinds)
+            )
+            uploaded += len(result.uploaded)
+            store.promote_pages(
+                [sources[path] for path in result.uploaded + result.skipped]
+            )
+            for outcome, paths in (
+                ("uploaded", result.uploaded),
+                ("skipped", result.skipped),
+                ("failed", result.failed),
+            ):
+                for kind in ("reports", "attachments"):
+                    count = sum(kinds[path] == kind for path in paths)
+                    if count:
+                        await asyncio.to_thread(
+                            queue.add_progress, job_id, f"{kind}_{outcome}", count
+                        )
+            logger.info(
+                f"Uploaded {uploaded} files of {company_name} to vector store with id {vector_store_id}"
+            )
+        return uploaded
+
+    # A file is only announced once queued, the sweep at the end picks up the
+    # ones whose hand-over was cut off by the scrape deadline
+    async def report_written(input_path: str):
+        await documents.put(("reports", input_path))
+        announced.add(input_path)
+        await asyncio.to_thread(queue.add_progress, job_id, "reports_written")
+
+    async def attachment_saved(input_path: str):
+        await documents.put(("attachments", input_path))
+        announced.add(input_path)
+        await asyncio.to_thread(queue.add_progress, job_id, "attachments_downloaded")
+
+    async def scrape_site(url: str):
+        async with parallel_sites:
+            start_time = datetime.now()
+            logger.info(f"Task started for {url} at {start_time}")
+
+            try:
+                await asyncio.to_thread(
+                    queue.update_url,
+                    job_id,
+                    url,
+                    "In Progress",
+                    start_time=start_time,
+                    elapsed=0,
+                )
+
+                async def crawl_progress(stats: dict):
+                    elapsed = (datetime.now() - start_time).total_seconds()
+                    await asyncio.to_thread(
+                        queue.update_url,
+                        job_id,
+                        url,
+                        "In Progress",
+                        elapsed=elapsed,
+                        stats=stats,
+                    )
+
+                try:
+                    result, child_time_taken, stats = await pool.scrape(
+                        url,
+                        company_name,
+                        timeout_seconds,
+                        incremental,
+                        resume,
+                        workspace,
+                        report_written,
+                        attachment_saved,
+                        crawl_progress,
+                    )
+                except ScrapeTimeout:
+                    end_time = datetime.now()
+                    time_taken = (end_time - start_time).total_seconds()
+                    await asyncio.to_thread(
+                        queue.update_url,
+                        job_id,
+                        url,
+                        "Timed Out",
+                        end_time=end_time,
+                        elapsed=time_taken,
+                    )
+                    logger.info(
+                        f"Scraping {url} for {company_name} timed out after {timeout_seconds} seconds"
+                    )
+                    return
+
+                if result == "Completed":
+                    time_taken = (
+                        child_time_taken
+                        if child_time_taken is not None
+                        else (datetime.now() - start_time).total_seconds()
+                    )
+                    await asyncio.to_thread(
+                        queue.update_url,
+                        job_id,
+                        url,
+                        "Completed",
+                        end_time=datetime.now(),
+                        elapsed=time_taken,
+                        stats=stats,
+                    )
+                    logger.info(
+                        f"Scraping {url} for {company_name} completed in {time_taken} seconds"
+                    )
+                else:
+                    time_taken = (datetime.now() - start_time).total_seconds()
+                    await asyncio.to_thread(
+                        queue.update_url, job_id, url, result, elapsed=time_taken
+                    )
+                    logger.error(
+                        f"Scraping {url} for {company_name} failed after {time_taken} seconds: {result}"
+                    )
+            except Exception as e:
+                time_taken = (datetime.now() - start_time).total_seconds()
+                await asyncio.to_thread(
+                    queue.update_url,
+                    job_id,
+                    url,
+                    f"Failed: {str(e)}",
+                    elapsed=time_taken,
+                )
+                logger.error(f"Error in task for {url} for {company_name}: {e}")
+
+    try:
+        # A failed stage cancels the others, instead of leaving the crawls blocked
+        # on a queue nobody reads anymore
+        async with asyncio.TaskGroup() as stages:
+            stages.create_task(convert_documents())
+            uploader = stages.create_task(upload_documents())
+            await asyncio.gather(*(scrape_site(url) for url in websites))
+
+            # Files of crawls killed before they could hand them over
+            for input_path in seal_leftover_batches(workspace.markdown_dir):
+                await report_written(input_path)
+            for input_path in workspace.markdown_files():
+                if input_path not in announced:
+                    await report_written(input_path)
+            for input_path in workspace.attachment_files():
+                if input_path not in announced:
+                    await attachment_saved(input_path)
+            await documents.put(None)
+        uploaded = uploader.result()
+    except ExceptionGroup as group:
+        # Fails the job with the error of the stage that failed first
+        raise group.exceptions[0]
+    finally:
+        discarded = store.discard_pending_pages(workspace.root)
+        store.close()
+        if discarded:
+            logger.warning(
+                f"{discarded} pages of {company_name} were not uploaded, they will"
+                " be fetched again by the next refresh"
+            )
+
+    if uploaded != 0:
+        logger.info(f"All {uploaded} files of {company_name} uploaded")
+    elif incremental:
+        logger.info(
+            f"No new or changed pages found while refreshing {company_name}, skipping upload"
+        )
+    else:
+        logger.info(
+            "No report found from scrapped session, something went wrong.... Skipping upload"
+        )
+
+
+async def run_job(queue: JobQueue, job: dict, pool: ScrapeWorkerPool):
+    """Run a job claimed from `queue`, see `JobQueue.claim`."""
+    payload = job["payload"]
+    # A retried job picks the crawls of the failed attempt up where they stopped
+    resume = payload.get("resume", False) or job["attempts"] > 1
+    await run_scraping_task(
+        queue,
+        job["id"],
+        pool,
+        job["company_name"],
+        payload["websites"],
+        payload["vector_store_id"],
+        payload["timeout_seconds"],
+        payload.get("incremental", False),
+        resume,
+    )
+
+
+async def keep_lease(queue: JobQueue, job_id: str, worker_id: str):
+    """Renew the lease of a running job until cancelled.
+
+    Raises:
+        LeaseLost: If the lease could not be renewed.
+    """
+    while True:
+        await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+        if not await asyncio.to_thread(queue.renew_lease, job_id, worker_id):
+            raise LeaseLost(f"Worker {worker_id} lost the lease of job {job_id}")
+
+
+async def process_jobs(
+    queue: JobQueue,
+    pool: ScrapeWorkerPool,
+    worker_id: str,
+    wakeup: Optional[asyncio.Event] = None,
+):
+    """
+    Claims and runs jobs from `queue` until cancelled.
+
+    A failed job is queued again until it runs out of attempts. A cancelled job
+    keeps its lease until it expires, after which another worker claims it. A job
+    whose lease is lost is cancelled, the worker that claims it next owns it.
+
+    Args:
+        queue (JobQueue): Queue to claim jobs from.
+        pool (ScrapeWorkerPool): Pool running the scrapes.
+        worker_id (str): Lease owner, unique across every worker of the queue.
+        wakeup (Optional[asyncio.Event]): Set by an in-process producer to skip the
+            wait when the queue was empty.
+    """
+    while True:
+        job = await asyncio.to_thread(queue.claim, worker_id)
+        if job is None:
+            if wakeup is None:
+                await asyncio.sleep(JOB_POLL_SECONDS)
+                continue
+            try:
+                await asyncio.wait_for(wakeup.wait(), JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            wakeup.clear()
+            continue
+
+        logger.info(
+            f"Worker {worker_id} claimed job {job['id']} for {job['company_name']}"
+            f" (attempt {job['attempts']})"
+        )
+        running = asyncio.create_task(run_job(queue, job, pool))
+        lease = asyncio.create_task(keep_lease(queue, job["id"], worker_id))
+        try:
+            await asyncio.wait({running, lease}, return_when=asyncio.FIRST_COMPLETED)
+            if not running.done():
+                running.cancel()
+                await asyncio.wait({running})
+                lease.result()
+            running.result()
+            await asyncio.to_thread(queue.complete, job["id"], worker_id)
+            logger.info(f"Job {job['id']} for {job['company_name']} completed")
+        except LeaseLost as e:
+            logger.warning(f"{e}, job for {job['company_name']} cancelled")
+        except Exception as e:
+            retrying = await asyncio.to_thread(queue.fail, job["id"], worker_id, str(e))
+            logger.error(
+                f"Job {job['id']} for {job['company_name']} failed: {e}"
+                + (", retrying later" if retrying else "")
+            )
+        finally:
+            lease.cancel()
+            if not running.done():
+                running.cancel()
+                await asyncio.wait({running})
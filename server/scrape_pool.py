@@ -0,0 +1,309 @@
+import asyncio
+import contextlib
+import os
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+from utils import logger, process_context
+from workspace import JobWorkspace
+
+# Persistent scrape processes shared by every scraping task
+SCRAPE_WORKERS = int(os.getenv("SCRAPE_WORKERS", "4"))
+# Seconds a timed out scrape process gets to checkpoint its crawl before being killed
+TERMINATE_GRACE_SECONDS = float(os.getenv("SCRAPE_TERMINATE_GRACE_SECONDS", "5"))
+
+
+class ScrapeTimeout(Exception):
+    """The scrape did not finish in time, its worker was replaced."""
+
+
+def worker_main(connection):
+    """
+    Runs scrape jobs received on `connection` until it is closed.
+
+    Each job is a `(url, company_name, incremental, resume, workspace)` tuple. While
+    it runs, a `("batch", path)` message announces every report batch completed by
+    the crawl, an `("attachment", path)` message every attachment it saved, and
+    `("progress", stats)` messages report the crawl statistics so far. The job
+    ends with a `("result", (result, time_taken, stats))` message.
+    """
+    # Imported once per worker, every job after the first one starts warm
+    import utils
+
+    while True:
+        try:
+            job = connection.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+
+        url, company_name, incremental, resume, workspace = job
+
+        try:
+            start_time = datetime.now()
+            logger.info(f"Started scraping {url} for {company_name} at {start_time}")
+
+            stats = utils.scrap_website(
+                url,
+                company_name,
+                incremental=incremental,
+                resume=resume,
+                workspace=workspace,
+                on_batch=lambda path: connection.send(("batch", path)),
+                on_attachment=lambda path: connection.send(("attachment", path)),
+                on_progress=lambda stats: connection.send(("progress", stats)),
+            )
+
+            end_time = datetime.now()
+            time_taken = (end_time - start_time).total_seconds()
+            logger.info(
+                f"Completed scraping {url} for {company_name} at {end_time}, time taken: {time_taken} seconds"
+            )
+            connection.send(("result", ("Completed", time_taken, stats)))
+        except asyncio.CancelledError:
+            logger.info(
+                f"Scraping {url} for {company_name} stopped, crawl checkpointed"
+            )
+            break
+        except Exception as e:
+            logger.error(f"Error scraping {url} for {company_name}: {e}")
+            connection.send(("result", (f"Failed: {str(e)}", None, None)))
+
+
+async def wait_readable(fds: list, timeout: Optional[float] = None) -> bool:
+    """
+    Waits on the event loop for one of `fds` to become readable.
+
+    Args:
+        fds (list): File descriptors, e.g. a pipe and a process sentinel.
+        timeout (Optional[float]): Seconds to wait, None to wait forever.
+
+    Returns:
+        bool: False if the timeout expired first.
+    """
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+
+    def on_readable():
+        if not ready.done():
+            ready.set_result(None)
+
+    for fd in fds:
+        loop.add_reader(fd, on_readable)
+    try:
+        await asyncio.wait_for(ready, timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        for fd in fds:
+            loop.remove_reader(fd)
+
+
+class ScrapeWorker:
+    """A warm scrape process and the parent end of its pipe."""
+
+    def __init__(self):
+        context = process_context()
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=worker_main, args=(child_connection,), daemon=True
+        )
+        self.process.start()
+        child_connection.close()
+
+    async def wait_exit(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the process to exit without blocking the event loop."""
+        if await wait_readable([self.process.sentinel], timeout):
+            # The process has exited, this only reaps it
+            self.process.join()
+            return True
+        return False
+
+    async def stop(self, grace_seconds: float = TERMINATE_GRACE_SECONDS) -> list:
+        """
+        Stop the process, giving it `grace_seconds` to exit on its own.
+
+        Returns:
+            list: Messages the process sent that were not read yet, e.g. the last
+                report batches of a crawl it checkpointed before exiting.
+        """
+        if self.process.is_alive():
+            logger.info(f"Attempting to terminate process with PID {self.process.pid}")
+            # SIGTERM lets the crawl write a checkpoint before exiting
+            self.process.terminate()
+            await self.wait_exit(grace_seconds)
+        if self.process.is_alive():
+            logger.info(f"Force killing process with PID {self.process.pid}")
+            self.process.kill()
+        await self.wait_exit()
+        messages = []
+        with contextlib.suppress(EOFError, OSError):
+            while self.connection.poll():
+                messages.append(self.connection.recv())
+        self.connection.close()
+        return messages
+
+
+class ScrapeWorkerPool:
+    """
+    Fixed set of persistent scrape processes.
+
+    Workers stay alive between scrapes so that a scrape does not pay for starting a
+    process and importing the scraping modules. A worker whose scrape times out, is
+    cancelled or that dies is stopped and replaced by a fresh one.
+    """
+
+    def __init__(self, size: int = SCRAPE_WORKERS):
+        if size <= 0:
+            raise ValueError("Pool size must be a positive integer")
+        self.size = size
+        self.idle: Optional[asyncio.Queue] = None
+        # Stops of the workers taken out of the pool in the middle of a scrape
+        self.retiring: set[asyncio.Task] = set()
+
+    def start(self):
+        self.idle = asyncio.Queue()
+        for _ in range(self.size):
+            self.idle.put_nowait(ScrapeWorker())
+        logger.info(f"Started {self.size} scrape workers")
+
+    async def shutdown(self):
+        while self.idle and not self.idle.empty():
+            worker = self.idle.get_nowait()
+            try:
+                worker.connection.send(None)
+            except OSError:
+                pass
+            await worker.wait_exit(TERMINATE_GRACE_SECONDS)
+            await worker.stop()
+        if self.retiring:
+            await asyncio.wait(self.retiring)
+
+    def retire(self, worker: ScrapeWorker):
+        """Stop a worker in the background, its messages are not read anymore."""
+        task = asyncio.create_task(worker.stop())
+        self.retiring.add(task)
+        task.add_done_callback(self.retiring.discard)
+
+    async def scrape(
+        self,
+        url: str,
+        company_name: str,
+        timeout_seconds: int,
+        incremental: bool = False,
+        resume: bool = False,
+        workspace: Optional[JobWorkspace] = None,
+        on_batch: Optional[Callable[[str], Awaitable]] = None,
+        on_attachment: Optional[Callable[[str], Awaitable]] = None,
+        on_progress: Optional[Callable[[dict], Awaitable]] = None,
+    ) -> tuple:
+        """
+        Scrapes a website on the next idle worker.
+
+        Args:
+            url (str): Website to scrape.
+            company_name (str): Company the website belongs to.
+            timeout_seconds (int): Time allowed for the scrape.
+            incremental (bool, optional): Only report new or changed content.
+            resume (bool, optional): Continue the last checkpointed crawl of `url`.
+            workspace (Optional[JobWorkspace]): Scratch workspace of the scrape job.
+            on_batch (Optional[Callable[[str], Awaitable]]): Awaited with the path of
+                each report batch as soon as the crawl completes it. The worker's
+                messages are not read while it is pending, which holds the worker
+                back once the pipe is full.
+            on_attachment (Optional[Callable[[str], Awaitable]]): Awaited with the
+                path of each attachment saved by the crawl, like `on_batch`.
+            on_progress (Optional[Callable[[dict], Awaitable]]): Awaited with the
+                crawl statistics reported while the scrape runs.
+
+            The time spent awaiting the callbacks counts towards `timeout_seconds`.
+
+        Returns:
+            tuple: "Completed" or "Failed: <reason>", the time taken by the scrape
+                in seconds and the crawl statistics.
+
+        Raises:
+            ScrapeTimeout: If the scrape did not finish within `timeout_seconds`.
+        """
+        if self.idle is None:
+            self.start()
+
+        async def hand_over(kind: str, body):
+            if kind == "batch" and on_batch:
+                await on_batch(body)
+            elif kind == "attachment" and on_attachment:
+                await on_attachment(body)
+            elif kind == "progress" and on_progress:
+                await on_progress(body)
+
+        async def hand_over_files(messages: list):
+            for kind, body in messages:
+                if kind in ("batch", "attachment"):
+                    await hand_over(kind, body)
+
+        worker = await self.idle.get()
+        busy = False
+        try:
+            worker.connection.send((url, company_name, incremental, resume, workspace))
+            busy = True
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + timeout_seconds
+            while True:
+                # Wakes up as soon as a message arrives or the worker dies
+                remaining = deadline - loop.time()
+                finished = remaining > 0 and await wait_readable(
+                    [worker.connection.fileno(), worker.process.sentinel], remaining
+                )
+                if finished:
+                    try:
+                        if not worker.connection.poll():
+                            break
+                        kind, body = worker.connection.recv()
+                    except (EOFError, OSError):
+                        break
+
+                    if kind == "result":
+                        busy = False
+                        return body
+                    try:
+                        await asyncio.wait_for(
+                            hand_over(kind, body), max(0.0, deadline - loop.time())
+                        )
+                    except asyncio.TimeoutError:
+                        # A file cut off here is swept up by the scrape job
+                        finished = False
+
+                if not finished:
+                    # The stopped crawl hands its last report batches over on exit
+                    messages = await worker.stop()
+                    worker = ScrapeWorker()
+                    busy = False
+                    try:
+                        # Bounded like the crawl's own exit, the scrape job sweeps
+                        # up the files not handed over by then
+                        await asyncio.wait_for(
+                            hand_over_files(messages), TERMINATE_GRACE_SECONDS
+                        )
+                    except asyncio.TimeoutError:
+                        logger.warning(
+                            f"Last files of the crawl of {url} left to the job sweep"
+                        )
+                    raise ScrapeTimeout(
+                        f"Scraping {url} timed out after {timeout_seconds} seconds"
+                    )
+
+            logger.error(f"Scrape worker for {url} exited without a result")
+            await worker.stop()
+            worker = ScrapeWorker()
+            busy = False
+            return "Failed: No result", None, None
+        except BaseException:
+            if busy:
+                # Cancelled or failed while its crawl still runs, it cannot be reused
+                self.retire(worker)
+                worker = ScrapeWorker()
+            raise
+        finally:
+            self.idle.put_nowait(worker)
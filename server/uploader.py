@@ -0,0 +1,291 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+from openai import AsyncOpenAI
+
+from utils import get_openai_client, logger
+
+DEFAULT_UPLOAD_REGISTRY = os.getenv(
+    "UPLOAD_REGISTRY_DB", os.path.join(os.getcwd(), "state", "uploads.sqlite3")
+)
+# Files attached to the vector store in one file batch
+UPLOAD_BATCH_FILES = int(os.getenv("UPLOAD_BATCH_FILES", "10"))
+# Files open and uploading at the same time
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+# Attempts of a file before it is reported as failed
+UPLOAD_MAX_ATTEMPTS = int(os.getenv("UPLOAD_MAX_ATTEMPTS", "3"))
+UPLOAD_POLL_SECONDS = float(os.getenv("UPLOAD_POLL_SECONDS", "1"))
+# Seconds a file batch may stay in progress before it is cancelled
+UPLOAD_BATCH_TIMEOUT_SECONDS = float(os.getenv("UPLOAD_BATCH_TIMEOUT_SECONDS", "600"))
+HASH_CHUNK_BYTES = 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS vector_store_files (
+    vector_store_id TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    uploaded_at TEXT NOT NULL,
+    PRIMARY KEY (vector_store_id, content_hash)
+);
+"""
+
+
+class UploadRegistry:
+    """
+    Local record of the files each vector store already holds, by content hash.
+
+    Backed by a SQLite database shared by the API and the scrape workers.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or DEFAULT_UPLOAD_REGISTRY
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.connection = sqlite3.connect(
+            self.path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def contains(self, vector_store_id: str, content_hash: str) -> bool:
+        return (
+            self.connection.execute(
+                "SELECT 1 FROM vector_store_files"
+                " WHERE vector_store_id = ? AND content_hash = ?",
+                (vector_store_id, content_hash),
+            ).fetchone()
+            is not None
+        )
+
+    def add(self, vector_store_id: str, content_hash: str, file_id: str, filename: str):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO vector_store_files"
+            " (vector_store_id, content_hash, file_id, filename, uploaded_at)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (
+                vector_store_id,
+                content_hash,
+                file_id,
+                filename,
+                datetime.now().isoformat(),
+            ),
+        )
+
+    def forget(self, vector_store_id: str):
+        """Drop the record of a deleted vector store."""
+        self.connection.execute(
+            "DELETE FROM vector_store_files WHERE vector_store_id = ?",
+            (vector_store_id,),
+        )
+
+
+@dataclass
+class UploadResult:
+    """Paths of the files uploaded, already in the store, and failed for good."""
+
+    uploaded: list[str] = field(default_factory=list)
+    skipped: list[str] = field(default_factory=list)
+    failed: list[str] = field(default_factory=list)
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_BYTES):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class VectorStoreUploader:
+    """
+    Uploads files to vector stores in bounded batches on the async OpenAI client.
+
+    Files whose content the registry already records for the target store are
+    skipped. At most `concurrency` files are open at a time, and each batch of
+    `batch_files` is attached to the store and polled without blocking the event
+    loop. Files that fail to upload or to process are retried on their own, up to
+    `max_attempts` times. A batch still processing after `batch_timeout` seconds is
+    cancelled, and its files that were not processed by then are failed for good.
+    """
+
+    def __init__(
+        self,
+        client: Optional[AsyncOpenAI] = None,
+        registry: Optional[UploadRegistry] = None,
+        batch_files: int = UPLOAD_BATCH_FILES,
+        concurrency: int = UPLOAD_CONCURRENCY,
+        max_attempts: int = UPLOAD_MAX_ATTEMPTS,
+        poll_seconds: float = UPLOAD_POLL_SECONDS,
+        batch_timeout: float = UPLOAD_BATCH_TIMEOUT_SECONDS,
+    ):
+        self.client = client
+        self.registry = registry
+        self.batch_files = batch_files
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.poll_seconds = poll_seconds
+        self.batch_timeout = batch_timeout
+
+    async def upload(self, vector_store_id: str, paths: list[str]) -> UploadResult:
+        """
+        Upload files to a vector store, skipping the ones it already holds.
+
+        Args:
+            vector_store_id (str): Target vector store.
+            paths (list[str]): Files to upload, PDF, markdown or text.
+
+        Returns:
+            UploadResult: What happened to each file. Failures are logged as well.
+        """
+        if self.client is None:
+            self.client = get_openai_client()
+
+        result = UploadResult()
+        # Content hash of the files left to upload, by path
+        pending = {}
+        pending_hashes = set()
+        for path in paths:
+            content_hash = await asyncio.to_thread(file_hash, path)
+            if content_hash in pending_hashes or self.get_registry().contains(
+                vector_store_id, content_hash
+            ):
+                result.skipped.append(path)
+            else:
+                pending[path] = content_hash
+                pending_hashes.add(content_hash)
+
+        attempt = 0
+        while pending and attempt < self.max_attempts:
+            attempt += 1
+            if attempt > 1:
+                logger.info(
+                    f"Retrying {len(pending)} failed uploads to vector store"
+                    f" {vector_store_id} (attempt {attempt}/{self.max_attempts})"
+                )
+                await asyncio.sleep(self.poll_seconds * 2**attempt)
+
+            batch_paths = list(pending)
+            for first in range(0, len(batch_paths), self.batch_files):
+                batch = batch_paths[first : first + self.batch_files]
+                processed, timed_out = await self.upload_batch(
+                    vector_store_id, batch, pending
+                )
+                for path in processed:
+                    result.uploaded.append(path)
+                    del pending[path]
+                for path in timed_out:
+                    result.failed.append(path)
+                    del pending[path]
+
+        result.failed.extend(pending)
+        if result.failed:
+            logger.error(
+                f"Failed to upload {len(result.failed)} files to vector store"
+                f" {vector_store_id} after {attempt} attempts: {result.failed}"
+            )
+        logger.info(
+            f"Uploaded {len(result.uploaded)} files to vector store {vector_store_id},"
+            f" {len(result.skipped)} already there"
+        )
+        return result
+
+    def get_registry(self) -> UploadRegistry:
+        if self.registry is None:
+            self.registry = UploadRegistry()
+        return self.registry
+
+    def forget(self, vector_store_id: str):
+        """Drop the registry entries of a deleted vector store."""
+        self.get_registry().forget(vector_store_id)
+
+    async def upload_batch(
+        self, vector_store_id: str, paths: list[str], hashes: dict
+    ) -> tuple[list[str], list[str]]:
+        """Upload and attach one batch.
+
+        Returns:
+            tuple[list[str], list[str]]: Paths processed successfully, and paths of
+                a batch cancelled after `batch_timeout` that were not processed.
+        """
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def create_file(path: str) -> Optional[str]:
+            async with slots:
+                try:
+                    with open(path, "rb") as f:
+                        created = await self.client.files.create(
+                            file=f, purpose="assistants"
+                        )
+                    return created.id
+                except Exception as e:
+                    logger.error(f"Error uploading {path}: {e}")
+                    return None
+
+        file_ids = await asyncio.gather(*(create_file(path) for path in paths))
+        uploaded = {file_id: path for path, file_id in zip(paths, file_ids) if file_id}
+        if not uploaded:
+            return [], []
+
+        timed_out = False
+        # Recorded in the registry as soon as the store lists them as completed
+        processed = []
+        try:
+            batch = await self.client.beta.vector_stores.file_batches.create(
+                vector_store_id, file_ids=list(uploaded)
+            )
+            deadline = asyncio.get_running_loop().time() + self.batch_timeout
+            while batch.status == "in_progress":
+                if asyncio.get_running_loop().time() >= deadline:
+                    logger.error(
+                        f"File batch {batch.id} of vector store {vector_store_id}"
+                        f" still in progress after {self.batch_timeout} seconds,"
+                        " cancelling it"
+                    )
+                    timed_out = True
+                    batch = await self.client.beta.vector_stores.file_batches.cancel(
+                        batch.id, vector_store_id=vector_store_id
+                    )
+                    break
+                await asyncio.sleep(self.poll_seconds)
+                batch = await self.client.beta.vector_stores.file_batches.retrieve(
+                    batch.id, vector_store_id=vector_store_id
+                )
+
+            async for (
+                vector_store_file
+            ) in self.client.beta.vector_stores.file_batches.list_files(
+                batch.id, vector_store_id=vector_store_id, filter="completed"
+            ):
+                path = uploaded.get(vector_store_file.id)
+                if path:
+                    self.get_registry().add(
+                        vector_store_id,
+                        hashes[path],
+                        vector_store_file.id,
+                        os.path.basename(path),
+                    )
+                    del uploaded[vector_store_file.id]
+                    processed.append(path)
+        except Exception as e:
+            logger.error(
+                f"Error attaching files to vector store {vector_store_id}: {e}"
+            )
+
+        # Files that did not make it into the store are uploaded again if retried
+        for file_id, path in uploaded.items():
+            logger.warning(
+                f"{path} was not processed by vector store {vector_store_id}"
+            )
+            try:
+                await self.client.files.delete(file_id)
+            except Exception as e:
+                logger.error(f"Error deleting unprocessed file {file_id}: {e}")
+        return processed, list(uploaded.values()) if timed_out else []
+
+
+vector_store_uploader = VectorStoreUploader()
@@ -1,33 +1,54 @@
-from openai import Client
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 from markdown_pdf import MarkdownPdf, Section
 import os
 import logging
-import subprocess
+import multiprocessing
+import signal
 import openai
-from urllib.parse import urlparse, urlsplit, urljoin, quote_plus
-from bs4 import BeautifulSoup
+from urllib.parse import urlsplit
 import httpx
 from dotenv import load_dotenv
 import re
-import logging
-from docx2pdf import convert
-import time
+import asyncio
 from icrawler.builtin import GoogleImageCrawler
-import random
-from typing import Optional
+from typing import Callable, Optional
 from fastapi import UploadFile
 import aiohttp
 from pocketbase.client import FileUpload
+from report_batches import ReportBatcher
+from workspace import JobWorkspace
 
 load_dotenv()
 
 attachment_extensions = ["pdf", "doc", "docx", "xls", "xlsx", "ppt", "pptx"]
 
+# Format scraped reports are uploaded to the vector store in. "markdown" and "text"
+# upload the reports as written, "pdf" renders them with MarkdownPdf first.
+INGEST_FORMATS = ("markdown", "text", "pdf")
+INGEST_FORMAT = os.getenv("INGEST_FORMAT", "markdown").lower()
+
+# Seconds an OpenAI request may wait for the next bytes of its response
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
+OPENAI_CONNECT_TIMEOUT_SECONDS = float(os.getenv("OPENAI_CONNECT_TIMEOUT_SECONDS", "5"))
+# Connections to the OpenAI API shared by every request of the process
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+
+# How the scrape and conversion processes are started. Forking a process that runs an
+# event loop and threads copies their locks in whatever state they are in, so a
+# fresh interpreter is started instead.
+PROCESS_START_METHOD = os.getenv(
+    "PROCESS_START_METHOD",
+    (
+        "forkserver"
+        if "forkserver" in multiprocessing.get_all_start_methods()
+        else "spawn"
+    ),
+)
+
 # Local Cache
-markdown_files = []
-attachment_files = []
-scraping_status = dict()
 session_manager = dict()
+openai_client: Optional[AsyncOpenAI] = None
 
 
 def create_logger():
@@ -49,6 +70,11 @@ def create_logger():
 logger = create_logger()
 
 
+def process_context() -> multiprocessing.context.BaseContext:
+    """Multiprocessing context starting processes with `PROCESS_START_METHOD`."""
+    return multiprocessing.get_context(PROCESS_START_METHOD)
+
+
 async def fetch_or_upload_logo(
     company_name: str, logo: Optional[UploadFile]
 ) -> Optional[str]:
@@ -128,47 +154,76 @@ async def fetch_logo(
         raise Exception(f"Error fetching logo: {str(e)}")
 
 
-def create_vector_store(client: Client, company_name: str):
+def get_openai_client() -> AsyncOpenAI:
+    """
+    Returns the async OpenAI client of the process, created on first use.
+
+    Every OpenAI call of the process goes through it, and so through one pool of
+    connections. Its timeouts and retries come from the `OPENAI_*` environment
+    variables.
+    """
+    global openai_client
+    if openai_client is None:
+        openai_client = AsyncOpenAI(
+            timeout=httpx.Timeout(
+                OPENAI_TIMEOUT_SECONDS, connect=OPENAI_CONNECT_TIMEOUT_SECONDS
+            ),
+            max_retries=OPENAI_MAX_RETRIES,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+                )
+            ),
+        )
+    return openai_client
+
+
+async def create_vector_store(client: AsyncOpenAI, company_name: str):
     """Create a vector store for company
 
     Args:
-        client (Client): OpenAI Client
+        client (AsyncOpenAI): OpenAI Client
         company_name (str): Name of the company for which vector store will be generated (will be used to name the vector store)
     """
-    vector_store = client.beta.vector_stores.create(name=company_name)
+    vector_store = await client.beta.vector_stores.create(name=company_name)
     logger.info(f"Vector ID generated for {company_name}")
     return vector_store.id
 
 
-def create_assistant(
-    client: Client, vector_store_id: str, company_name: str, instructions: str
+async def create_assistant(
+    client: AsyncOpenAI, vector_store_id: str, company_name: str, instructions: str
 ):
     """Create assistant of a company using it's previously generated vector store and company name.
 
     Args:
-        client (Client): OpenAI Client
+        client (AsyncOpenAI): OpenAI Client
         vector_store_id (str): Vector Store ID generated for the company
         company_name (str): Name of the company for which assistant needs to be generated
 
     Returns:
         str: Assistant ID of the generated assistant for company
     """
-    assistant = client.beta.assistants.create(
+    from retrieval import retrieval_for
+
+    assistant = await client.beta.assistants.create(
         name=company_name,
         instructions=instructions,
         model="gpt-4o-mini",
-        tools=[{"type": "file_search"}],
-        tool_resources={"file_search": {"vector_store_ids": [vector_store_id]}},
+        # Searches OpenAI vector stores itself, local ones are searched by `/ask`
+        **retrieval_for(vector_store_id).assistant_tools(vector_store_id),
     )
     logger.info(f"Assistant ID generated for {company_name}")
     return assistant.id
 
 
-def delete_assistant_and_vs(client: Client, assistant_id: str, vector_store_id: str):
+async def delete_assistant_and_vs(
+    client: AsyncOpenAI, assistant_id: str, vector_store_id: str
+):
     """Delete the assistant and its corresponding vector store.
 
     Args:
-        client (Client): OpenAI Client
+        client (AsyncOpenAI): OpenAI Client
         assistant_id (str): ID of the assistant to delete
         vector_store_id (str): ID of the vector store to delete
 
@@ -177,11 +232,13 @@ def delete_assistant_and_vs(client: Client, assistant_id: str, vector_store_id:
     """
     try:
         # Delete the assistant
-        client.beta.assistants.delete(assistant_id)
+        await client.beta.assistants.delete(assistant_id)
         logger.info(f"Assistant with ID {assistant_id} deleted.")
 
-        # Delete the vector store
-        client.beta.vector_stores.delete(vector_store_id)
+        # Delete the vector store, or the local store taking its place
+        from retrieval import retrieval_for
+
+        await retrieval_for(vector_store_id).delete_store(vector_store_id)
         logger.info(f"Vector store with ID {vector_store_id} deleted.")
 
         return {"detail": "Assistant and vector store successfully deleted."}
@@ -193,69 +250,59 @@ def delete_assistant_and_vs(client: Client, assistant_id: str, vector_store_id:
         }
 
 
-def save_extensions(
-    url: str, content: bytes, folder: str, extensions: list[str], company_name: str
-):
-    """Saves content to a file if the URL's extension is in the specified list.
+def attachment_path(url: str, folder: str, company_name: str) -> str:
+    """Returns a free path to save the attachment at `url` under, suffixing a counter
+    to the file name if an attachment with the same name was saved before.
 
     Args:
         url (str): The URL of the file.
-        content (bytes): The content to save.
         folder (str): The folder where the file will be saved.
-        extensions (list[str]): List of allowed file extensions.
         company_name (str): The company name for folder organization.
 
     Returns:
-        None
+        str: Path of the file to create.
     """
-
     folder_dir = os.path.join(os.getcwd(), folder, company_name)
     os.makedirs(folder_dir, exist_ok=True)
 
-    file_extension = url.split(".")[-1].lower()
-    if file_extension in extensions:
-        file_name = url.split("/")[-1]
-        file_path = os.path.join(folder_dir, file_name)
+    file_name = url.split("/")[-1]
+    file_path = os.path.join(folder_dir, file_name)
 
-        if os.path.exists(file_path):
-            base_name, ext = os.path.splitext(file_name)
-            counter = 1
-            while os.path.exists(file_path):
-                file_path = os.path.join(folder_dir, f"{base_name}_{counter}{ext}")
-                counter += 1
+    if os.path.exists(file_path):
+        base_name, ext = os.path.splitext(file_name)
+        counter = 1
+        while os.path.exists(file_path):
+            file_path = os.path.join(folder_dir, f"{base_name}_{counter}{ext}")
+            counter += 1
 
-        with open(file_path, "wb") as file:
-            file.write(content)
+    return file_path
 
-        attachment_files.append(file_path)
-    logger.info(f"Saved the following attachements: {attachment_files}")
 
-
-def generate_page_report(url: str, content: bytes, company_name: str):
-    """Generates a Markdown report from webpage content.
+def generate_page_report(
+    url: str,
+    page: dict,
+    company_name: str,
+    reports_dir: Optional[str] = None,
+    batcher: Optional[ReportBatcher] = None,
+) -> Optional[str]:
+    """Generates a Markdown report from an extracted webpage.
 
     Args:
         url (str): The webpage URL.
-        content (bytes): HTML content of the webpage.
+        page (dict): Fields extracted by `page_parser.extract_page`.
         company_name (str): The company name for report organization.
+        reports_dir (Optional[str]): Directory of the reports, one per domain.
+            Defaults to "temp/markdown".
+        batcher (Optional[ReportBatcher]): Splits the reports into batches of a
+            target size instead, see `report_batches`.
 
     Returns:
-        None
+        Optional[str]: Path of the report the page was written to, None if the URL
+            has no domain.
     """
-
-    soup = BeautifulSoup(content, "lxml")
-    title = (
-        soup.title.string.strip()
-        if soup.title and soup.title.string
-        else "No Title Found"
-    )
-    description_meta = soup.find("meta", attrs={"name": "description"})
-    description = (
-        description_meta["content"].strip()
-        if description_meta and description_meta.get("content")
-        else "No Description Found"
-    )
-    body_text = "\n".join([p.get_text(strip=True) for p in soup.find_all("p")])
+    title = page["title"]
+    description = page["description"]
+    body_text = page["body_text"]
 
     report_content = f"""# {title}
 
@@ -273,14 +320,19 @@ def generate_page_report(url: str, content: bytes, company_name: str):
 
     url_domain = urlsplit(url).netloc
     if not url_domain:
-        return
+        return None
 
     domain_name = (
         url_domain.split(".")[-2]
         if len(url_domain.split(".")) > 2
         else url_domain.split(".")[0]
     )
-    reports_dir = os.path.join(os.getcwd(), "temp", "markdown")
+    if batcher:
+        report_filepath_md = batcher.add(domain_name, report_content)
+        logger.info(f"Markdown Report Generated for {url}")
+        return report_filepath_md
+
+    reports_dir = reports_dir or JobWorkspace.shared().markdown_dir
     os.makedirs(reports_dir, exist_ok=True)
 
     report_filename_md = f"{domain_name}.md"
@@ -291,25 +343,56 @@ def generate_page_report(url: str, content: bytes, company_name: str):
     ) as report_file:
         report_file.write(report_content)
 
-    if report_filepath_md not in markdown_files:
-        markdown_files.append(report_filepath_md)
-
     logger.info(f"Markdown Report Generated for {url}")
+    return report_filepath_md
 
 
 def scrape_entire_website(
-    start_url: str, company_name: str, max_pages: int = 1000, max_retries: int = 5
-) -> None:
+    start_url: str,
+    company_name: str,
+    max_pages: int = 1000,
+    max_retries: int = 5,
+    concurrency: Optional[int] = None,
+    max_connections_per_host: Optional[int] = None,
+    incremental: bool = False,
+    resume: bool = False,
+    workspace: Optional[JobWorkspace] = None,
+    on_batch: Optional[Callable[[str], None]] = None,
+    on_attachment: Optional[Callable[[str], None]] = None,
+    on_progress: Optional[Callable[[dict], None]] = None,
+) -> dict:
     """
     Scrapes a website starting from the given URL.
 
-    Iteratively fetches pages and saves attachments if their URLs match specified extensions.
-    Generates a report for HTML content found on the pages.
+    Runs the asyncio crawl engine from `crawler` to completion. Pages are fetched
+    concurrently over a shared keep-alive client, attachments are saved and a
+    report is generated for HTML content found on the pages. Terminating the process
+    with SIGTERM cancels the crawl, which saves a checkpoint before exiting.
 
     Args:
         start_url (str): The starting URL for scraping.
         company_name (str): The name of the company for organizing reports.
         max_pages (int, optional): Maximum number of pages to scrape. Defaults to 1000.
+        max_retries (int, optional): Attempts per URL before skipping it. Defaults to 5.
+        concurrency (Optional[int]): Number of URLs fetched in parallel.
+            Defaults to the `CRAWL_CONCURRENCY` environment variable.
+        max_connections_per_host (Optional[int]): Concurrent requests allowed per host.
+            Defaults to the `CRAWL_MAX_CONNECTIONS_PER_HOST` environment variable.
+        incremental (bool, optional): Only report pages and attachments that are new
+            or changed since the previous crawl of the company. Defaults to False.
+        resume (bool, optional): Continue the last checkpointed crawl of `start_url`
+            instead of starting over. Defaults to False.
+        workspace (Optional[JobWorkspace]): Where reports and attachments are
+            written. Defaults to the shared "temp" directory.
+        on_batch (Optional[Callable[[str], None]]): Called with the path of every
+            report batch completed during the crawl.
+        on_attachment (Optional[Callable[[str], None]]): Called with the path of
+            every attachment saved during the crawl.
+        on_progress (Optional[Callable[[dict], None]]): Called with the crawl
+            statistics while the crawl runs.
+
+    Returns:
+        dict: Crawl statistics, see `crawler.crawl_website`.
     """
     if not start_url:
         raise ValueError("Start URL cannot be empty")
@@ -320,90 +403,35 @@ def scrape_entire_website(
     if not isinstance(max_pages, int) or max_pages <= 0:
         raise ValueError("Max pages must be a positive integer")
 
-    SCRAPERAPI_KEY = os.getenv("SCRAPERAPI_KEY")
-    base_domain = urlparse(start_url).netloc
-    scraped_urls = set()
-    urls_to_scrape = [start_url]
-
-    while urls_to_scrape and len(scraped_urls) < max_pages:
-        url = urls_to_scrape.pop(0)
-        if url in scraped_urls:
-            continue
-
-        success = False
-        retries = 0
-
-        while not success and retries < max_retries:
-            try:
-                response = httpx.get(url, verify=False, timeout=5)
-
-                if response.status_code == 403:
-                    logger.info(f"Forbidden access for URL: {url}. Using ScraperAPI.")
-                    encoded_url = quote_plus(url)
-                    scraperapi_url = f"http://api.scraperapi.com?api_key={SCRAPERAPI_KEY}&url={encoded_url}"
-
-                    with httpx.Client(timeout=30) as client:
-                        response = client.get(scraperapi_url)
-                        response.raise_for_status()
-
-                success = True
-            except httpx.RequestError as e:
-                logger.error(f"Request error for {url}: {e}")
-            except httpx.HTTPStatusError as e:
-                logger.error(f"HTTP error for {url}: {e}")
-            except Exception as e:
-                logger.error(f"Unexpected error for {url}: {e}")
-
-            if not success:
-                retries += 1
-                backoff_time = min(60, (2**retries) + random.uniform(0, 1))
-                logger.info(
-                    f"Retrying ({retries}/{max_retries}) for URL: {url} after {backoff_time:.2f} seconds."
-                )
-                time.sleep(backoff_time)
+    # Imported here since the crawler builds on the helpers defined in this module
+    import crawler
 
-        if not success:
-            logger.error(
-                f"Failed to fetch {url} after {max_retries} retries. Skipping."
-            )
-            scraped_urls.add(url)
-            continue
-
-        scraped_urls.add(url)
-        content_type = response.headers.get("Content-Type", "").lower()
-
-        if any(url.lower().endswith(f".{ext}") for ext in attachment_extensions):
-            save_extensions(
-                url,
-                response.content,
-                os.path.join(os.getcwd(), "temp", "attachments"),
-                attachment_extensions,
-                company_name,
+    async def run_crawl():
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        except (ValueError, RuntimeError, NotImplementedError):
+            logger.debug(
+                "SIGTERM handler unavailable, crawl will not checkpoint on exit"
             )
-            continue
-
-        if "text/html" not in content_type:
-            logger.debug(f"Non-HTML content at {url}, skipping parsing.")
-            continue
-        else:
-            generate_page_report(url, response.content, company_name)
-
-        soup = BeautifulSoup(response.content, "lxml")
-        new_urls = set()
-        for a in soup.find_all("a", href=True):
-            href = a["href"]
-            joined_url = urljoin(url, href)
-            parsed_joined_url = urlparse(joined_url)
 
-            if (
-                parsed_joined_url.netloc == base_domain
-                and joined_url not in scraped_urls
-                and joined_url not in urls_to_scrape
-            ):
-                new_urls.add(joined_url)
+        return await crawler.crawl_website(
+            start_url,
+            company_name,
+            max_pages=max_pages,
+            max_retries=max_retries,
+            concurrency=concurrency or crawler.DEFAULT_CONCURRENCY,
+            max_connections_per_host=max_connections_per_host
+            or crawler.DEFAULT_MAX_CONNECTIONS_PER_HOST,
+            incremental=incremental,
+            resume=resume,
+            workspace=workspace,
+            on_batch=on_batch,
+            on_attachment=on_attachment,
+            on_progress=on_progress,
+        )
 
-        urls_to_scrape.extend(new_urls)
-        logger.info(f"Found {len(new_urls)} new URLs on {url}.")
+    return asyncio.run(run_crawl())
 
 
 def convert_markdown_to_pdf(
@@ -436,71 +464,50 @@ def convert_markdown_to_pdf(
     return output_path
 
 
-def convert_attachments_to_pdf():
-    """
-    Convert various attachment files (DOC, DOCX, PPT, PPTX) to PDF format.
-
-        This function processes a set of attachment file paths, converting supported
-        file types to PDF using LibreOffice. If a file is already in PDF format,
-        it logs this information. Unsupported file types are also logged.
-
-        Args:
-            None
-
-        Returns:
-            None
-    """
-    for file_path in set(attachment_files):
-        try:
-            file_extension = file_path.split(".")[-1].lower()
-            pdf_file_path = file_path.rsplit(".", 1)[0] + ".pdf"
-
-            if file_extension in ["doc", "docx", "pptx", "ppt"]:
-                result = subprocess.run(
-                    [
-                        "libreoffice",
-                        "--headless",
-                        "--convert-to",
-                        "pdf",
-                        "--outdir",
-                        os.path.dirname(file_path),
-                        file_path,
-                    ],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    timeout=30,
-                )
-                if result.returncode == 0:
-                    logger.info(f"Converted {file_path} to PDF at {pdf_file_path}")
-                else:
-                    logger.error(
-                        f"Failed to convert {file_path} to PDF. LibreOffice error: {result.stderr.decode()}"
-                    )
-            elif file_extension == "pdf":
-                logger.info(f"Attachment {file_path} is already a PDF.")
-            else:
-                logger.warning(
-                    f"Cannot convert {file_path} to PDF. Unsupported file type."
-                )
-
-        except Exception as e:
-            logger.error(f"Error converting attachment {file_path} to PDF: {e}")
-
-
-def scrap_website(company_url: str, company_name: str):
+def scrap_website(
+    company_url: str,
+    company_name: str,
+    incremental: bool = False,
+    resume: bool = False,
+    workspace: Optional[JobWorkspace] = None,
+    on_batch: Optional[Callable[[str], None]] = None,
+    on_attachment: Optional[Callable[[str], None]] = None,
+    on_progress: Optional[Callable[[dict], None]] = None,
+):
     """Recursively scrape the specified company URL and convert results.
 
     Args:
         company_url (str): The URL of the company to be scraped.
         company_name (str): The name of the company for reporting purposes.
+        incremental (bool, optional): Only report content changed since the
+            previous crawl. Defaults to False.
+        resume (bool, optional): Continue the last checkpointed crawl of the URL.
+            Defaults to False.
+        workspace (Optional[JobWorkspace]): Scratch workspace of the scrape job.
+        on_batch (Optional[Callable[[str], None]]): Called with the path of every
+            report batch completed during the crawl.
+        on_attachment (Optional[Callable[[str], None]]): Called with the path of
+            every attachment saved during the crawl.
+        on_progress (Optional[Callable[[dict], None]]): Called with the crawl
+            statistics while the crawl runs.
 
     Returns:
-        None
+        dict: Crawl statistics, see `crawler.crawl_website`.
     """
-    scrape_entire_website(company_url, company_name)
+    stats = scrape_entire_website(
+        company_url,
+        company_name,
+        incremental=incremental,
+        resume=resume,
+        workspace=workspace,
+        on_batch=on_batch,
+        on_attachment=on_attachment,
+        on_progress=on_progress,
+    )
 
     logging.info("Scraping completed.")
     logging.info("All conversions completed.")
+    return stats
 
 
 def validate_website(website: str) -> bool:
@@ -533,7 +540,8 @@ def extract_sentences(text):
     sentences = sentence_end_pattern.findall(text)
     buffer = sentence_end_pattern.sub("", text)
     sentences = [s.strip() for s in sentences if s.strip()]
-    buffer = buffer.strip()
+    # Keeps the space before a word of the next delta
+    buffer = buffer.lstrip()
     return sentences, buffer
 
 
@@ -549,7 +557,8 @@ def process_stream_event(event, assistant_reply_parts, sentence_queue, buffer_di
             from the assistant's replies.
         sentence_queue (Queue): A queue where processed and complete sentences are added.
         buffer_dict (dict): A dictionary holding the "buffer" key, where partially
-            complete sentence fragments are stored until fully formed.
+            complete sentence fragments are stored until fully formed, and the
+            "citation" key, set while a citation mark spans several deltas.
 
     """
     if isinstance(event, openai.types.beta.assistant_stream_event.ThreadMessageDelta):
@@ -560,14 +569,16 @@ def process_stream_event(event, assistant_reply_parts, sentence_queue, buffer_di
             new_content = event.data.delta.content[0].text.value
             cleaned_text = ""
             i = 0
+            in_citation = buffer_dict.get("citation", False)
             while i < len(new_content):
-                if new_content[i] != "【":
+                if in_citation:
+                    in_citation = new_content[i] != "】"
+                elif new_content[i] != "【":
                     cleaned_text += new_content[i]
-                elif new_content[i] == "【":
-                    i += 1
-                    while i < len(new_content) and new_content[i] != "】":
-                        i += 1
+                else:
+                    in_citation = True
                 i += 1
+            buffer_dict["citation"] = in_citation
 
             if cleaned_text:
                 assistant_reply_parts.append(cleaned_text)
@@ -579,38 +590,6 @@ def process_stream_event(event, assistant_reply_parts, sentence_queue, buffer_di
                     sentence_queue.put(sentence)
 
 
-def upload_pdf_to_vector_store(
-    client: Client, vector_store_id: str, pdf_files: list[str]
-):
-    """
-    Uploads a PDF file to a specified vector store.
-
-    Args:
-        client (Client): Client instance for interacting with the vector store service.
-        vector_store_id (str): Unique identifier of the target vector store.
-        pdf_files (list): List of pdf_files path.
-    """
-    file_streams = [open(pdf_path, "rb") for pdf_path in pdf_files]
-    try:
-        client.beta.vector_stores.file_batches.upload_and_poll(
-            vector_store_id=vector_store_id, files=file_streams
-        )
-
-        logger.info(
-            f"{pdf_files} got uploded to vector store with id {vector_store_id}"
-        )
-    except Exception as e:
-        logger.error(f"Caught an exception while uploading pdf to vector store : {e}")
-    finally:
-        for stream in file_streams:
-            stream.close()
-
-
-def convert_docx_to_pdf(docx_path: str, pdf_path: str):
-    """Convert DOCX to PDF."""
-    convert(docx_path, pdf_path)
-
-
 def convert_markdown_to_pdf_vs(path: str, output_dir: str = "converted_pdfs/"):
     """
     Convert a Markdown file to PDF format with a Table of Contents and CSS styling.
@@ -0,0 +1,64 @@
+"""
+Standalone scrape worker.
+
+Claims scraping jobs from the shared job queue (`JOB_QUEUE_DB`) and runs them on a
+warm scrape worker pool. Run as many workers as needed, on this machine or on
+others sharing the queue database:
+
+    python worker.py --jobs 2
+
+Set `EMBEDDED_SCRAPE_WORKER=false` on the API when every job should run on
+standalone workers.
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import socket
+
+from dotenv import load_dotenv
+
+from job_queue import JobQueue
+from scrape_jobs import WORKER_JOBS, process_jobs
+from scrape_pool import SCRAPE_WORKERS, ScrapeWorkerPool
+from utils import logger
+
+load_dotenv()
+
+
+async def serve(jobs: int, pool_size: int):
+    queue = JobQueue()
+    pool = ScrapeWorkerPool(pool_size)
+    pool.start()
+
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    tasks = [
+        asyncio.create_task(process_jobs(queue, pool, f"{worker_id}-{slot}"))
+        for slot in range(jobs)
+    ]
+
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, lambda: [task.cancel() for task in tasks])
+
+    logger.info(f"Worker {worker_id} running {jobs} jobs on {pool_size} scrapers")
+    try:
+        await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        logger.info(f"Worker {worker_id} shutting down")
+        await pool.shutdown()
+        queue.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--jobs", type=int, default=WORKER_JOBS)
+    parser.add_argument("--scrapers", type=int, default=SCRAPE_WORKERS)
+    args = parser.parse_args()
+
+    asyncio.run(serve(args.jobs, args.scrapers))
+
+
+if __name__ == "__main__":
+    main()
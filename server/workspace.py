@@ -0,0 +1,71 @@
+import os
+import shutil
+import uuid
+from typing import Optional
+
+# Parent directory of the per-job scratch workspaces
+JOBS_ROOT = os.getenv("SCRAPE_JOBS_DIR", os.path.join(os.getcwd(), "temp", "jobs"))
+
+
+class JobWorkspace:
+    """
+    Scratch directory holding everything a scrape job produces.
+
+    The markdown reports, downloaded attachments and converted PDFs of a job live
+    under its own root, so jobs running at the same time never see each other's
+    files, and the whole tree goes away with `cleanup` once the job is uploaded.
+    Workspaces only hold paths and can be sent to scrape worker processes.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.markdown_dir = os.path.join(root, "markdown")
+        self.attachments_dir = os.path.join(root, "attachments")
+        self.pdf_dir = os.path.join(root, "pdf")
+
+    @classmethod
+    def create(cls, job_id: Optional[str] = None) -> "JobWorkspace":
+        """Create a fresh workspace under `JOBS_ROOT`, named after `job_id`."""
+        workspace = cls(os.path.join(JOBS_ROOT, job_id or uuid.uuid4().hex))
+        for directory in (
+            workspace.markdown_dir,
+            workspace.attachments_dir,
+            workspace.pdf_dir,
+        ):
+            os.makedirs(directory, exist_ok=True)
+        return workspace
+
+    @classmethod
+    def shared(cls) -> "JobWorkspace":
+        """The `temp` directory used by callers that do not run in a job."""
+        return cls(os.path.join(os.getcwd(), "temp"))
+
+    def markdown_files(self) -> list[str]:
+        """Paths of the markdown reports written so far."""
+        if not os.path.isdir(self.markdown_dir):
+            return []
+        return sorted(
+            os.path.join(self.markdown_dir, name)
+            for name in os.listdir(self.markdown_dir)
+            if name.endswith(".md")
+        )
+
+    def attachment_files(self) -> list[str]:
+        """Paths of the attachments downloaded so far."""
+        files = []
+        for root, _, names in os.walk(self.attachments_dir):
+            files.extend(
+                os.path.join(root, name)
+                for name in sorted(names)
+                if not name.endswith(".part")
+            )
+        return files
+
+    def cleanup(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def __enter__(self) -> "JobWorkspace":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cleanup()